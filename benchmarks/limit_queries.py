@@ -0,0 +1,135 @@
+"""
+Бенчмарк запросов лимитов по таблице generations.
+
+Создает отдельную таблицу bench_generations, заполняет ее синтетическими
+данными и сравнивает старые запросы (DATE(created_at) = CURRENT_DATE) с
+полуоткрытыми диапазонами при старых и новом составном индексе.
+
+Запуск (использует настройки PostgreSQL из .env):
+    python -m benchmarks.limit_queries --rows 20000000 --users 200000
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import asyncpg
+
+from config import config
+
+TABLE = "bench_generations"
+
+QUERIES = {
+    "today (DATE())": f"""
+        SELECT COUNT(*) FROM {TABLE}
+        WHERE user_id = $1 AND DATE(created_at) = CURRENT_DATE
+    """,
+    "month (DATE_TRUNC())": f"""
+        SELECT COUNT(*) FROM {TABLE}
+        WHERE user_id = $1 AND DATE_TRUNC('month', created_at) = DATE_TRUNC('month', CURRENT_DATE)
+    """,
+    "today (range)": f"""
+        SELECT COUNT(*) FROM {TABLE}
+        WHERE user_id = $1 AND created_at >= CURRENT_DATE AND created_at < CURRENT_DATE + 1
+    """,
+    "month (range)": f"""
+        SELECT COUNT(*) FROM {TABLE}
+        WHERE user_id = $1
+          AND created_at >= date_trunc('month', LOCALTIMESTAMP)
+          AND created_at < date_trunc('month', LOCALTIMESTAMP) + INTERVAL '1 month'
+    """
+}
+
+
+async def fill_table(conn: asyncpg.Connection, rows: int, users: int, days: int):
+    print(f"Заполнение {TABLE}: {rows} строк, {users} пользователей, {days} дней истории...")
+    await conn.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    await conn.execute(f"""
+        CREATE TABLE {TABLE} (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            created_at TIMESTAMP NOT NULL
+        )
+    """)
+    started = time.monotonic()
+    await conn.execute(f"""
+        INSERT INTO {TABLE} (user_id, created_at)
+        SELECT
+            (random() * $2)::bigint + 1,
+            LOCALTIMESTAMP - random() * make_interval(days => $3)
+        FROM generate_series(1, $1)
+    """, rows, users, days)
+    await conn.execute(f"ANALYZE {TABLE}")
+    print(f"Готово за {time.monotonic() - started:.1f} с")
+
+
+async def run_queries(conn: asyncpg.Connection, user_ids: list, runs: int) -> dict:
+    results = {}
+    for name, query in QUERIES.items():
+        timings = []
+        for _ in range(runs):
+            user_id = random.choice(user_ids)
+            started = time.perf_counter()
+            await conn.fetchval(query, user_id)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        results[name] = (statistics.median(timings), timings[int(len(timings) * 0.95) - 1])
+    return results
+
+
+def print_results(title: str, results: dict):
+    print(f"\n{title}")
+    print(f"  {'запрос':<22} {'p50, мс':>10} {'p95, мс':>10}")
+    for name, (p50, p95) in results.items():
+        print(f"  {name:<22} {p50:>10.2f} {p95:>10.2f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк запросов лимитов")
+    parser.add_argument("--rows", type=int, default=20_000_000)
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--reuse", action="store_true", help="Не пересоздавать таблицу")
+    parser.add_argument("--keep", action="store_true", help="Не удалять таблицу после запуска")
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(
+        user=config.POSTGRES_USER,
+        password=config.POSTGRES_PASSWORD,
+        database=config.POSTGRES_DB,
+        host=config.POSTGRES_HOST,
+        port=config.POSTGRES_PORT
+    )
+    try:
+        if not args.reuse:
+            await fill_table(conn, args.rows, args.users, args.days)
+
+        user_ids = [random.randint(1, args.users) for _ in range(args.runs)]
+
+        # Старая схема: отдельные индексы по user_id и created_at
+        await conn.execute(f"DROP INDEX IF EXISTS {TABLE}_user_created")
+        await conn.execute(f"CREATE INDEX IF NOT EXISTS {TABLE}_user_id ON {TABLE}(user_id)")
+        await conn.execute(f"CREATE INDEX IF NOT EXISTS {TABLE}_created_at ON {TABLE}(created_at)")
+        await conn.execute(f"ANALYZE {TABLE}")
+        print_results("Индексы (user_id) и (created_at):", await run_queries(conn, user_ids, args.runs))
+
+        # Новая схема: составной индекс
+        await conn.execute(f"DROP INDEX IF EXISTS {TABLE}_user_id")
+        await conn.execute(f"CREATE INDEX IF NOT EXISTS {TABLE}_user_created ON {TABLE}(user_id, created_at)")
+        await conn.execute(f"ANALYZE {TABLE}")
+        print_results("Индекс (user_id, created_at):", await run_queries(conn, user_ids, args.runs))
+
+        plan = await conn.fetch(f"EXPLAIN ANALYZE {QUERIES['month (range)']}", user_ids[0])
+        print("\nПлан месячного запроса:")
+        for row in plan:
+            print(f"  {row[0]}")
+    finally:
+        if not args.keep:
+            await conn.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -12,11 +12,27 @@ class Config:
         if id.strip().isdigit()
     ]
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")  # DEBUG, INFO, WARNING, ERROR
+    # Рассылка: общий лимит Telegram около 30 сообщений в секунду
+    BROADCAST_RATE: float = float(os.getenv("BROADCAST_RATE", "25"))  # сообщений/с
+    BROADCAST_CONCURRENCY: int = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
     
     # OpenAI
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
     OPENAI_BASE_URL: str = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
     GPT_MODEL: str = os.getenv("GPT_MODEL", "gpt-4-1106-preview")
+    # Адаптивный лимит одновременных запросов к OpenAI: снижается при 429 и ответах дольше цели
+    OPENAI_MAX_CONCURRENCY: int = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+    OPENAI_LATENCY_TARGET: float = float(os.getenv("OPENAI_LATENCY_TARGET", "20"))  # сек
+    # Потоковый вывод сценария: сообщение правится каждые N фрагментов или раз в M мс
+    SCRIPT_STREAM_EDIT_CHUNKS: int = int(os.getenv("SCRIPT_STREAM_EDIT_CHUNKS", "15"))
+    SCRIPT_STREAM_EDIT_INTERVAL_MS: int = int(os.getenv("SCRIPT_STREAM_EDIT_INTERVAL_MS", "1000"))
+    # Начинать генерацию сценария сразу после выбора стиля, пока выбираются голос и фон
+    SPECULATIVE_SCRIPTS: bool = os.getenv("SPECULATIVE_SCRIPTS", "true").lower() in ("1", "true", "yes")
+    SPECULATIVE_TTL: int = int(os.getenv("SPECULATIVE_TTL", "900"))  # сек
+    # Вариантов сценария за один запрос; лишние хранятся в Redis для кнопки "Новый вариант"
+    SCRIPT_CANDIDATES: int = int(os.getenv("SCRIPT_CANDIDATES", "3"))
+    SCRIPT_ALTERNATIVES_LOW: int = int(os.getenv("SCRIPT_ALTERNATIVES_LOW", "1"))  # пополнять, когда осталось столько
+    SCRIPT_ALTERNATIVES_TTL: int = int(os.getenv("SCRIPT_ALTERNATIVES_TTL", "3600"))  # сек
     
     # ElevenLabs
     ELEVENLABS_API_KEY: str = os.getenv("ELEVENLABS_API_KEY", "")
@@ -24,21 +40,55 @@ class Config:
     DEFAULT_VOICE_ID: str = os.getenv("DEFAULT_VOICE_ID")
     MALE_VOICE_ID: str = os.getenv("MALE_VOICE_ID")
     FEMALE_VOICE_ID: str  = os.getenv("FEMALE_VOICE_ID")
+    ELEVENLABS_TIMEOUT: int = int(os.getenv("ELEVENLABS_TIMEOUT", "120"))
+    ELEVENLABS_MAX_CONNECTIONS: int = int(os.getenv("ELEVENLABS_MAX_CONNECTIONS", "10"))
+    TTS_CACHE_DIR: str = os.getenv("TTS_CACHE_DIR", "tts_cache")
+    TTS_CACHE_MAX_MB: int = int(os.getenv("TTS_CACHE_MAX_MB", "500"))  # 0 - кэш отключен
+    # Озвучка сценария заранее, пока пользователь его читает (нужен кэш озвучки)
+    SPECULATIVE_TTS: bool = os.getenv("SPECULATIVE_TTS", "false").lower() in ("1", "true", "yes")
+    # Символов в день на озвучку заранее по тарифам (использованная озвучка не учитывается)
+    SPECULATIVE_TTS_FREE_CHARS: int = int(os.getenv("SPECULATIVE_TTS_FREE_CHARS", "0"))
+    SPECULATIVE_TTS_LITE_CHARS: int = int(os.getenv("SPECULATIVE_TTS_LITE_CHARS", "3000"))
+    SPECULATIVE_TTS_PREMIUM_CHARS: int = int(os.getenv("SPECULATIVE_TTS_PREMIUM_CHARS", "10000"))
     # Database
     POSTGRES_DB: str = os.getenv("POSTGRES_DB", "reelsbot")
     POSTGRES_USER: str = os.getenv("POSTGRES_USER", "user")
     POSTGRES_PASSWORD: str = os.getenv("POSTGRES_PASSWORD", "password")
     POSTGRES_HOST: str = os.getenv("POSTGRES_HOST", "db")
     POSTGRES_PORT: int = int(os.getenv("POSTGRES_PORT", "5432"))
+    DB_POOL_MIN_SIZE: int = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+    DB_POOL_MAX_SIZE: int = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
     
     # Redis
     REDIS_HOST: str = os.getenv("REDIS_HOST", "redis")
     REDIS_PORT: int = int(os.getenv("REDIS_PORT", "6379"))
+    # Кэш профилей пользователей
+    PROFILE_CACHE_SIZE: int = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))  # 0 - кэш отключен
+    PROFILE_CACHE_TTL: int = int(os.getenv("PROFILE_CACHE_TTL", "300"))  # сек
+    # Общий кэш в Redis для нескольких экземпляров бота
+    PROFILE_CACHE_REDIS: bool = os.getenv("PROFILE_CACHE_REDIS", "false").lower() in ("1", "true", "yes")
+    # С Redis локальная копия живет недолго: инвалидация на другом экземпляре до нее не доходит
+    PROFILE_CACHE_LOCAL_TTL: int = int(os.getenv("PROFILE_CACHE_LOCAL_TTL", "5"))  # сек
     
     # Paths
     AUDIO_OUTPUT_DIR: str = os.getenv("AUDIO_OUTPUT_DIR", "generated_audio")
     TEMP_DIR: str = os.getenv("TEMP_DIR", "temp")
     ASSETS_DIR: str = os.getenv("ASSETS_DIR", "assets")
+
+    # FFmpeg
+    FFMPEG_TIMEOUT: int = int(os.getenv("FFMPEG_TIMEOUT", "600"))  # секунд на один проход ffmpeg
+    FFPROBE_TIMEOUT: int = int(os.getenv("FFPROBE_TIMEOUT", "30"))
+
+    # Очередь рендеров
+    RENDER_WORKERS: int = int(os.getenv("RENDER_WORKERS", "2"))  # одновременных задач ffmpeg
+    RENDER_ESTIMATED_DURATION: int = int(os.getenv("RENDER_ESTIMATED_DURATION", "60"))  # начальная оценка, сек
+    # Рендер одним проходом ffmpeg (без промежуточных файлов)
+    RENDER_SINGLE_PASS: bool = os.getenv("RENDER_SINGLE_PASS", "true").lower() in ("1", "true", "yes")
+
+    # Фоновые видео
+    BACKGROUND_REFRESH_INTERVAL: int = int(os.getenv("BACKGROUND_REFRESH_INTERVAL", "60"))  # сек
+    # Заранее перекодировать фоны в 1080x1920
+    BACKGROUND_MEZZANINE: bool = os.getenv("BACKGROUND_MEZZANINE", "true").lower() in ("1", "true", "yes")
     
     # Тарифы
     FREE_DAILY_LIMIT = 1
@@ -47,6 +97,18 @@ class Config:
     LITE_MONTHLY_LIMIT = 150
     PREMIUM_DAILY_LIMIT = 10
     PREMIUM_MONTHLY_LIMIT = 300
+    # Статистика для админки
+    STATS_AGGREGATE_INTERVAL: int = int(os.getenv("STATS_AGGREGATE_INTERVAL", "300"))  # сек
+    # Генерации моложе этого окна еще могут сменить статус и не попадают в агрегаты
+    STATS_SETTLE_MINUTES: int = int(os.getenv("STATS_SETTLE_MINUTES", "60"))
+    # Партиции generations по месяцам
+    GENERATIONS_PARTITIONS_AHEAD: int = int(os.getenv("GENERATIONS_PARTITIONS_AHEAD", "3"))  # месяцев вперед
+    GENERATIONS_RETENTION_MONTHS: int = int(os.getenv("GENERATIONS_RETENTION_MONTHS", "0"))  # 0 - хранить все
+    # detach - отсоединить в архивную таблицу generations_archive_*, drop - удалить
+    GENERATIONS_RETENTION_MODE: str = os.getenv("GENERATIONS_RETENTION_MODE", "detach")
+    PARTITION_MAINTENANCE_INTERVAL_HOURS: int = int(os.getenv("PARTITION_MAINTENANCE_INTERVAL_HOURS", "24"))
+    # Сверка счетчиков использования с таблицей generations
+    USAGE_REPAIR_INTERVAL_HOURS: int = int(os.getenv("USAGE_REPAIR_INTERVAL_HOURS", "24"))
 
     # Цены подписок
     LITE_PRICE = 799
@@ -60,6 +122,11 @@ class Config:
     
     # Security
     REQUEST_TIMEOUT: int = int(os.getenv("REQUEST_TIMEOUT", "30"))
+    # Предохранитель внешних API: при доле ошибок за окно запросы отклоняются сразу
+    CIRCUIT_FAILURE_RATE: float = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+    CIRCUIT_MIN_CALLS: int = int(os.getenv("CIRCUIT_MIN_CALLS", "10"))
+    CIRCUIT_WINDOW: int = int(os.getenv("CIRCUIT_WINDOW", "60"))  # сек
+    CIRCUIT_OPEN_SECONDS: int = int(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
     
     BOT_USERNAME: str = os.getenv("BOT_USERNAME", "")  
 
@@ -68,6 +135,15 @@ class Config:
     CRYPTOBOT_API_URL: str = os.getenv("CRYPTOBOT_API_URL", "https://pay.crypt.bot/api")
     CRYPTOBOT_CURRENCY: str = os.getenv("CRYPTOBOT_CURRENCY", "USDT")
     CRYPTOBOT_NETWORK: str = os.getenv("CRYPTOBOT_NETWORK", "TRON")
+    CRYPTOBOT_TIMEOUT: float = float(os.getenv("CRYPTOBOT_TIMEOUT", "30"))
+    CRYPTOBOT_CONNECT_TIMEOUT: float = float(os.getenv("CRYPTOBOT_CONNECT_TIMEOUT", "10"))
+    CRYPTOBOT_MAX_CONNECTIONS: int = int(os.getenv("CRYPTOBOT_MAX_CONNECTIONS", "10"))
+    CRYPTOBOT_HTTP2: bool = os.getenv("CRYPTOBOT_HTTP2", "true").lower() in ("1", "true", "yes")
+    # Проверка неоплаченных инвойсов: свежие часто, старые реже
+    PAYMENT_POLL_MIN_INTERVAL: int = int(os.getenv("PAYMENT_POLL_MIN_INTERVAL", "15"))
+    PAYMENT_POLL_MAX_INTERVAL: int = int(os.getenv("PAYMENT_POLL_MAX_INTERVAL", "600"))
+    PAYMENT_POLL_BATCH_SIZE: int = int(os.getenv("PAYMENT_POLL_BATCH_SIZE", "200"))
+    PAYMENT_INVOICE_TTL_HOURS: int = int(os.getenv("PAYMENT_INVOICE_TTL_HOURS", "48"))
     @classmethod
     def validate(cls):
         required = [
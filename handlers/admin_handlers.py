@@ -8,15 +8,35 @@ import logging
 import asyncpg
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import InputFile
 from config import config
 import asyncio
 from datetime import datetime, timedelta
 from services.database import db  # Импортируем экземпляр базы данных
+from services.render_queue import render_scheduler
+from services.tts_service import tts_service
+from services.media_cache import media_cache
+from services.cryptobot import cryptobot
+from services.gpt_service import gpt_service
+from services.quota_service import quota_service
+from services.broadcast_service import broadcast_service
+from services import stats_service
 
 router = Router()
 logger = logging.getLogger(__name__)
 
+# Размеры страниц: сообщение со страницей генераций должно укладываться в лимит Telegram
+USERS_PAGE_SIZE = 25
+GENERATIONS_PAGE_SIZE = 8
+USER_GENERATIONS_PAGE_SIZE = 10
+_EPOCH = datetime(1970, 1, 1)
+
+# Сегменты получателей рассылки (фильтры db.iter_users)
+BROADCAST_SEGMENTS = {
+    "all": {},
+    "paid": {"subscription_types": ["lite", "premium"]},
+    "active": {"active_days": 30}
+}
+
 class AdminSubscriptionStates(StatesGroup):
     waiting_for_user_id = State()
     waiting_for_subscription_type = State()
@@ -45,7 +65,8 @@ async def cmd_admin(message: Message):
         types.InlineKeyboardButton(text="📊 Статистика", callback_data="admin_stats"),
         types.InlineKeyboardButton(text="👥 Список пользователей", callback_data="admin_users_list"),
         types.InlineKeyboardButton(text="🎬 Генерации", callback_data="admin_generations"),
-        types.InlineKeyboardButton(text="✉️ Рассылка", callback_data="admin_broadcast")
+        types.InlineKeyboardButton(text="✉️ Рассылка", callback_data="admin_broadcast"),
+        types.InlineKeyboardButton(text="⚙️ Метрики", callback_data="admin_metrics")
     )
     builder.adjust(2)
     
@@ -54,6 +75,41 @@ async def cmd_admin(message: Message):
         reply_markup=builder.as_markup()
     )
 
+def _encode_time(value: datetime) -> int:
+    """Время создания записи для курсора в callback_data (микросекунды)"""
+    return (value - _EPOCH) // timedelta(microseconds=1)
+
+
+def _decode_time(value: str) -> datetime:
+    return _EPOCH + timedelta(microseconds=int(value))
+
+
+def _add_page_navigation(builder: InlineKeyboardBuilder, prefix: str, first_key: str, last_key: str,
+                         has_prev: bool, has_next: bool):
+    """Кнопки перехода между страницами; курсор - ключ крайней записи страницы"""
+    buttons = []
+    if has_prev:
+        buttons.append(types.InlineKeyboardButton(text="⬅️ Назад", callback_data=f"{prefix}:p:{first_key}"))
+    if has_next:
+        buttons.append(types.InlineKeyboardButton(text="Вперед ➡️", callback_data=f"{prefix}:n:{last_key}"))
+    if buttons:
+        builder.row(*buttons)
+
+
+def _page_flags(cursor, backward: bool, has_more: bool) -> tuple:
+    """Есть ли страницы до и после текущей"""
+    if backward:
+        return has_more, True
+    return cursor is not None, has_more
+
+
+async def _show_page(message: Message, text: str, builder: InlineKeyboardBuilder, edit: bool):
+    if edit:
+        await message.edit_text(text, reply_markup=builder.as_markup())
+    else:
+        await message.answer(text, reply_markup=builder.as_markup())
+
+
 @router.callback_query(F.data == "admin_users_list")
 async def admin_users_list(callback: CallbackQuery):
     """Показывает список всех пользователей с пагинацией"""
@@ -62,44 +118,7 @@ async def admin_users_list(callback: CallbackQuery):
         return
     
     try:
-        async with db.pool.acquire() as conn:
-            users = await conn.fetch("""
-                SELECT user_id, username, full_name 
-                FROM users 
-                ORDER BY username IS NULL, username ASC, created_at DESC
-                LIMIT 100
-            """)
-        
-        if not users:
-            await callback.answer("ℹ️ Нет пользователей")
-            return
-        
-        # Создаем клавиатуру с username пользователей
-        builder = InlineKeyboardBuilder()
-        for user in users:
-            username = user['username'] or f"ID:{user['user_id']}"
-            builder.add(
-                types.InlineKeyboardButton(
-                    text=f"@{username}",
-                    callback_data=f"user_detail_{user['user_id']}"
-                )
-            )
-        builder.adjust(1)
-        
-        # Добавляем кнопку "Показать еще" если пользователей много
-        if len(users) == 100:
-            builder.row(
-                types.InlineKeyboardButton(
-                    text="⬇️ Показать еще",
-                    callback_data="admin_users_list_more"
-                )
-            )
-        
-        await callback.message.answer(
-            "👥 Список пользователей:",
-            reply_markup=builder.as_markup()
-        )
-        
+        await show_users_page(callback.message)
     except Exception as e:
         logger.error(f"Ошибка в admin_users_list: {e}")
         await callback.message.answer("⚠️ Ошибка при получении списка пользователей")
@@ -107,6 +126,53 @@ async def admin_users_list(callback: CallbackQuery):
         await callback.answer()
 
 
+@router.callback_query(F.data.startswith("admin_ul:"))
+async def admin_users_list_page(callback: CallbackQuery):
+    """Переход по страницам списка пользователей"""
+    if not await check_admin(callback.from_user.id):
+        await callback.answer("⛔ Доступ запрещен")
+        return
+    
+    try:
+        # admin_ul:<n|p>:<без username>:<user_id>:<username>
+        _, direction, no_username, user_id, username = callback.data.split(":", 4)
+        cursor = (no_username == "1", username, int(user_id))
+        await show_users_page(callback.message, cursor, backward=direction == "p", edit=True)
+    except Exception as e:
+        logger.error(f"Ошибка в admin_users_list_page: {e}")
+        await callback.message.answer("⚠️ Ошибка при получении списка пользователей")
+    finally:
+        await callback.answer()
+
+
+async def show_users_page(message: Message, cursor: Optional[tuple] = None, backward: bool = False, edit: bool = False):
+    """Страница списка пользователей по ключу (без username, username, user_id)"""
+    users, has_more = await db.get_users_page(cursor, backward, USERS_PAGE_SIZE)
+    if not users:
+        await message.answer("ℹ️ Нет пользователей")
+        return
+    
+    # Создаем клавиатуру с username пользователей
+    builder = InlineKeyboardBuilder()
+    for user in users:
+        username = user['username'] or f"ID:{user['user_id']}"
+        builder.add(
+            types.InlineKeyboardButton(
+                text=f"@{username}",
+                callback_data=f"user_detail_{user['user_id']}"
+            )
+        )
+    builder.adjust(1)
+    
+    def key(user):
+        return f"{int(user['username'] is None)}:{user['user_id']}:{user['username'] or ''}"
+    
+    has_prev, has_next = _page_flags(cursor, backward, has_more)
+    _add_page_navigation(builder, "admin_ul", key(users[0]), key(users[-1]), has_prev, has_next)
+    
+    await _show_page(message, "👥 Список пользователей:", builder, edit)
+
+
 @router.callback_query(F.data.startswith("user_detail_"))
 async def show_user_detail(callback: CallbackQuery):
     """Показывает детальную информацию о пользователе"""
@@ -127,7 +193,7 @@ async def show_user_profile(message: Message, user_data: Optional[dict] = None,
     """Показывает профиль пользователя с возможностью управления"""
     try:
         if user_data is None and user_id is not None:
-            async with db.pool.acquire() as conn:
+            async with db.acquire() as conn:
                 user_data = await conn.fetchrow(
                     """
                     SELECT 
@@ -137,9 +203,10 @@ async def show_user_profile(message: Message, user_data: Optional[dict] = None,
                         COUNT(g.id) as generations_count,
                         SUM(CASE WHEN g.status = 'completed' THEN 1 ELSE 0 END) as completed_generations,
                         (SELECT COUNT(*) FROM generations 
-                         WHERE user_id = u.user_id AND DATE(created_at) = CURRENT_DATE) as today_generations,
+                         WHERE user_id = u.user_id AND created_at >= CURRENT_DATE AND created_at < CURRENT_DATE + 1) as today_generations,
                         (SELECT COUNT(*) FROM generations 
-                         WHERE user_id = u.user_id AND DATE_TRUNC('month', created_at) = DATE_TRUNC('month', CURRENT_DATE)) as month_generations
+                         WHERE user_id = u.user_id AND created_at >= date_trunc('month', LOCALTIMESTAMP)
+                         AND created_at < date_trunc('month', LOCALTIMESTAMP) + INTERVAL '1 month') as month_generations
                     FROM users u
                     LEFT JOIN user_profiles p ON u.user_id = p.user_id
                     LEFT JOIN generations g ON u.user_id = g.user_id
@@ -260,69 +327,84 @@ async def admin_user_generations(callback: CallbackQuery):
     
     try:
         user_id = int(callback.data.split("_")[3])
-        
-        async with db.pool.acquire() as conn:
-            user = await conn.fetchrow("SELECT username, full_name FROM users WHERE user_id = $1", user_id)
-            generations = await conn.fetch(
-                """
-                SELECT id, status, created_at, updated_at 
-                FROM generations 
-                WHERE user_id = $1
-                ORDER BY created_at DESC
-                LIMIT 20
-                """,
-                user_id
-            )
-        
-        if not user:
-            await callback.message.answer("⚠️ Пользователь не найден")
-            return
-        
-        username = f"@{user['username']}" if user['username'] else f"ID:{user_id}"
-        response = [
-            f"🎬 Последние генерации пользователя {user['full_name'] or 'Без имени'} {username}:\n"
-        ]
-        
-        for gen in generations:
-            gen_info = (
-                f"\n🆔 ID генерации: {gen['id']}",
-                f"📝 Статус: {gen['status']}",
-                f"🕒 Создано: {gen['created_at'].strftime('%d.%m.%Y %H:%M')}",
-                f"🔄 Обновлено: {gen['updated_at'].strftime('%d.%m.%Y %H:%M')}",
-                "━━━━━━━━━━━━━━━━━━"
-            )
-            response.extend(gen_info)
-        
-        # Кнопка возврата
-        builder = InlineKeyboardBuilder()
-        builder.add(
-            types.InlineKeyboardButton(
-                text="🔙 Назад к профилю",
-                callback_data=f"user_detail_{user_id}"
-            )
-        )
-        
-        # Разбиваем длинные сообщения
-        current_message = ""
-        for part in response:
-            if len(current_message) + len(part) > 4000:
-                await callback.message.answer(current_message)
-                current_message = part
-            else:
-                current_message += "\n" + part
-        
-        if current_message:
-            await callback.message.answer(
-                current_message,
-                reply_markup=builder.as_markup()
-            )
-            
+        await show_user_generations_page(callback.message, user_id)
     except Exception as e:
         logger.error(f"Ошибка в admin_user_generations: {e}")
         await callback.message.answer("⚠️ Ошибка при получении генераций")
     finally:
         await callback.answer()
 
+
+@router.callback_query(F.data.startswith("admin_ug:"))
+async def admin_user_generations_page(callback: CallbackQuery):
+    """Переход по страницам генераций пользователя"""
+    if not await check_admin(callback.from_user.id):
+        await callback.answer("⛔ Доступ запрещен")
+        return
+    
+    try:
+        # admin_ug:<user_id>:<n|p>:<created_at>:<id>
+        _, user_id, direction, created_at, generation_id = callback.data.split(":")
+        cursor = (_decode_time(created_at), int(generation_id))
+        await show_user_generations_page(
+            callback.message, int(user_id), cursor, backward=direction == "p", edit=True
+        )
+    except Exception as e:
+        logger.error(f"Ошибка в admin_user_generations_page: {e}")
+        await callback.message.answer("⚠️ Ошибка при получении генераций")
+    finally:
+        await callback.answer()
+
+
+async def show_user_generations_page(message: Message, user_id: int, cursor: Optional[tuple] = None,
+                                     backward: bool = False, edit: bool = False):
+    """Страница генераций пользователя, от новых к старым"""
+    async with db.acquire() as conn:
+        user = await conn.fetchrow("SELECT username, full_name FROM users WHERE user_id = $1", user_id)
+    
+    if not user:
+        await message.answer("⚠️ Пользователь не найден")
+        return
+    
+    generations, has_more = await db.get_generations_page(user_id, cursor, backward, USER_GENERATIONS_PAGE_SIZE)
+    
+    username = f"@{user['username']}" if user['username'] else f"ID:{user_id}"
+    response = [
+        f"🎬 Генерации пользователя {user['full_name'] or 'Без имени'} {username}:"
+    ]
+    if not generations:
+        response.append("\nℹ️ Нет генераций")
+    
+    for gen in generations:
+        response.extend((
+            f"\n🆔 ID генерации: {gen['id']}",
+            f"📝 Статус: {gen['status']}",
+            f"🕒 Создано: {gen['created_at'].strftime('%d.%m.%Y %H:%M')}",
+            f"🔄 Обновлено: {gen['updated_at'].strftime('%d.%m.%Y %H:%M')}",
+            "━━━━━━━━━━━━━━━━━━"
+        ))
+    
+    builder = InlineKeyboardBuilder()
+    if generations:
+        has_prev, has_next = _page_flags(cursor, backward, has_more)
+        _add_page_navigation(
+            builder,
+            f"admin_ug:{user_id}",
+            f"{_encode_time(generations[0]['created_at'])}:{generations[0]['id']}",
+            f"{_encode_time(generations[-1]['created_at'])}:{generations[-1]['id']}",
+            has_prev,
+            has_next
+        )
+    # Кнопка возврата
+    builder.row(
+        types.InlineKeyboardButton(
+            text="🔙 Назад к профилю",
+            callback_data=f"user_detail_{user_id}"
+        )
+    )
+    
+    await _show_page(message, "\n".join(response), builder, edit)
+
 @router.callback_query(F.data == "admin_broadcast")
 async def start_broadcast(callback: CallbackQuery, state: FSMContext):
     """Начало процесса рассылки"""
@@ -374,9 +456,12 @@ async def process_broadcast_message(message: Message, state: FSMContext):
     # Создаем кнопки подтверждения
     builder = InlineKeyboardBuilder()
     builder.add(
-        types.InlineKeyboardButton(text="✅ Отправить", callback_data="confirm_broadcast"),
+        types.InlineKeyboardButton(text="✅ Отправить всем", callback_data="confirm_broadcast_all"),
+        types.InlineKeyboardButton(text="💎 Платным подписчикам", callback_data="confirm_broadcast_paid"),
+        types.InlineKeyboardButton(text="🔥 Активным за 30 дней", callback_data="confirm_broadcast_active"),
         types.InlineKeyboardButton(text="❌ Отменить", callback_data="cancel_broadcast")
     )
+    builder.adjust(1)
     
     # Показываем предпросмотр
     preview_text = "📝 Предпросмотр сообщения:\n\n"
@@ -386,7 +471,8 @@ async def process_broadcast_message(message: Message, state: FSMContext):
         preview_text += content["text"]
     
     if content["has_media"]:
-        media = InputFile(content["media_id"])
+        # media_id - это file_id, файл уже есть на серверах Telegram
+        media = content["media_id"]
         if content["media_type"] == "photo":
             await message.answer_photo(
                 photo=media,
@@ -411,7 +497,7 @@ async def process_broadcast_message(message: Message, state: FSMContext):
             reply_markup=builder.as_markup()
         )
 
-@router.callback_query(F.data == "confirm_broadcast")
+@router.callback_query(F.data.startswith("confirm_broadcast_"))
 async def confirm_broadcast(callback: CallbackQuery, state: FSMContext):
     """Подтверждение и отправка рассылки"""
     if not await check_admin(callback.from_user.id):
@@ -426,62 +512,13 @@ async def confirm_broadcast(callback: CallbackQuery, state: FSMContext):
         await state.clear()
         return
     
-    await callback.message.answer("🔄 Начинаю рассылку...")
-    
     try:
-        # Получаем всех пользователей
-        async with db.pool.acquire() as conn:
-            users = await conn.fetch("SELECT user_id FROM users")
-        
-        total_users = len(users)
-        success = 0
-        failed = 0
-        
-        # Отправляем сообщение каждому пользователю
-        for user in users:
-            try:
-                if content["has_media"]:
-                    media = InputFile(content["media_id"])
-                    if content["media_type"] == "photo":
-                        await callback.bot.send_photo(
-                            chat_id=user["user_id"],
-                            photo=media,
-                            caption=content["text"]
-                        )
-                    elif content["media_type"] == "video":
-                        await callback.bot.send_video(
-                            chat_id=user["user_id"],
-                            video=media,
-                            caption=content["text"]
-                        )
-                    elif content["media_type"] == "document":
-                        await callback.bot.send_document(
-                            chat_id=user["user_id"],
-                            document=media,
-                            caption=content["text"]
-                        )
-                else:
-                    await callback.bot.send_message(
-                        chat_id=user["user_id"],
-                        text=content["text"]
-                    )
-                success += 1
-            except Exception as e:
-                logger.error(f"Ошибка при отправке пользователю {user['user_id']}: {e}")
-                failed += 1
-            
-            # Небольшая задержка, чтобы не перегружать сервер Telegram
-            await asyncio.sleep(0.1)
-        
-        # Отправляем отчет
-        report = (
-            "✅ Рассылка завершена\n"
-            f"👥 Всего пользователей: {total_users}\n"
-            f"✔️ Успешно отправлено: {success}\n"
-            f"❌ Не удалось отправить: {failed}"
+        # Рассылка идет в фоне, прогресс обновляется в отдельном сообщении
+        segment = callback.data.split("_")[2]
+        broadcast_id = await broadcast_service.start(
+            callback.bot, callback.message.chat.id, content, BROADCAST_SEGMENTS.get(segment)
         )
-        await callback.message.answer(report)
-    
+        logger.info(f"Админ {callback.from_user.id} запустил рассылку {broadcast_id}")
     except Exception as e:
         logger.error(f"Ошибка при рассылке: {e}")
         await callback.message.answer(f"⚠️ Ошибка при рассылке: {e}")
@@ -489,6 +526,18 @@ async def confirm_broadcast(callback: CallbackQuery, state: FSMContext):
         await state.clear()
         await callback.answer()
 
+@router.callback_query(F.data.startswith("broadcast_stop_"))
+async def stop_broadcast(callback: CallbackQuery):
+    """Остановка идущей рассылки"""
+    if not await check_admin(callback.from_user.id):
+        await callback.answer("⛔ Доступ запрещен")
+        return
+    
+    broadcast_id = int(callback.data.split("_")[2])
+    if await broadcast_service.stop(broadcast_id):
+        await callback.message.answer(f"⛔ Рассылка {broadcast_id} остановлена")
+    await callback.answer()
+
 @router.callback_query(F.data == "cancel_broadcast")
 async def cancel_broadcast_callback(callback: CallbackQuery, state: FSMContext):
     """Отмена рассылки через кнопку"""
@@ -504,48 +553,40 @@ async def admin_stats(callback: CallbackQuery):
         return
     
     try:
-        async with db.pool.acquire() as conn:
-            stats = await conn.fetchrow("""
-                SELECT 
-                    COUNT(DISTINCT u.user_id) as total_users,
-                    COUNT(DISTINCT CASE WHEN u.subscription_type = 'premium' THEN u.user_id END) as premium_users,
-                    COUNT(DISTINCT g.id) as total_generations,
-                    COUNT(DISTINCT CASE WHEN g.created_at > NOW() - INTERVAL '7 days' THEN g.user_id END) as active_week_users,
-                    COUNT(DISTINCT CASE WHEN g.created_at > NOW() - INTERVAL '30 days' THEN g.user_id END) as active_month_users
-                FROM users u
-                LEFT JOIN generations g ON u.user_id = g.user_id
-            """)
-            
-            niches = await conn.fetch("""
-                SELECT niche, COUNT(*) as count 
-                FROM user_profiles 
-                WHERE niche IS NOT NULL 
-                GROUP BY niche 
-                ORDER BY count DESC 
-                LIMIT 5
-            """)
-            
-            generations_stats = await conn.fetchrow("""
-                SELECT 
-                    COUNT(*) as total,
-                    COUNT(CASE WHEN status = 'completed' THEN 1 END) as completed,
-                    COUNT(CASE WHEN status = 'failed' THEN 1 END) as failed
-                FROM generations
-            """)
+        stats = await stats_service.get_dashboard()
+        users = stats['users']
+        generations = stats['generations']
+        
+        if stats['previous_week']:
+            change = (stats['this_week'] - stats['previous_week']) / stats['previous_week'] * 100
+            week_trend = f"{change:+.0f}% к прошлой неделе"
+        else:
+            week_trend = "нет данных за прошлую неделю"
         
         response = [
             "📈 Статистика бота:\n",
-            f"👥 Всего пользователей: {stats['total_users']}",
-            f"💎 Премиум-пользователей: {stats['premium_users']}",
-            f"🎬 Всего генераций: {stats['total_generations']}",
-            f"   ✔️ Успешных: {generations_stats['completed']}",
-            f"   ❌ Ошибок: {generations_stats['failed']}",
+            f"👥 Всего пользователей: {users['total']}",
+            f"💎 Премиум-пользователей: {users['premium']}, Lite: {users['lite']}",
+            f"🎬 Всего генераций: {generations['generations']}",
+            f"   ✔️ Успешных: {generations['completed']}",
+            f"   ❌ Ошибок: {generations['failed']}",
+            f"📊 За 7 дней: {stats['this_week']} ({week_trend})",
             f"🔄 Активных за неделю: {stats['active_week_users']}",
             f"🔄 Активных за месяц: {stats['active_month_users']}\n",
-            "🏷 Топ ниш:"
+            "📅 По дням (генерации / успешные / ошибки, активные, новые):"
         ]
         
-        for niche in niches:
+        for day in stats['daily']:
+            response.append(
+                f"- {day['day']:%d.%m}: {day['generations']} / {day['completed']} / {day['failed']}, "
+                f"👤 {day['active_users']}, 🆕 {day['new_users']}"
+            )
+        
+        if stats['watermark']:
+            response.append(f"(агрегаты по {stats['watermark']:%d.%m %H:%M}, дальше считается напрямую)")
+        
+        response.extend(["", "🏷 Топ ниш:"])
+        for niche in stats['niches']:
             response.append(f"- {niche['niche']}: {niche['count']}")
         
         await callback.message.answer("\n".join(response))
@@ -556,6 +597,111 @@ async def admin_stats(callback: CallbackQuery):
     finally:
         await callback.answer()
 
+@router.callback_query(F.data == "admin_metrics")
+async def admin_metrics(callback: CallbackQuery):
+    """Показывает метрики очереди рендеров и кэшей"""
+    if not await check_admin(callback.from_user.id):
+        await callback.answer("⛔ Доступ запрещен")
+        return
+    
+    queue = render_scheduler.get_metrics()
+    depth = queue['queue_depth_by_tier']
+    wait = queue['wait_time']
+    run = queue['run_time']
+    
+    response = [
+        "⚙️ Метрики:\n",
+        "🎞 Очередь рендеров:",
+        f"   Воркеров: {queue['active']}/{queue['workers']} заняты",
+        f"   В очереди: {queue['queue_depth']} "
+        f"(premium {depth['premium']}, lite {depth['lite']}, free {depth['free']})",
+        f"   Ожидание: среднее {wait['mean']:.1f} с, p95 ≤ {wait['p95']} с, макс {wait['max']:.1f} с",
+        f"   Рендер: среднее {run['mean']:.1f} с, p95 ≤ {run['p95']} с",
+        f"   Выполнено: {queue['completed']}, ошибок: {queue['failed']}"
+    ]
+    
+    if tts_service.cache:
+        tts_cache = tts_service.cache.get_metrics()
+        response.extend([
+            "",
+            "🔊 Кэш озвучки:",
+            f"   Попаданий: {tts_cache['hits']}, промахов: {tts_cache['misses']}",
+            f"   Файлов: {tts_cache['files']}, "
+            f"{tts_cache['bytes'] // (1024 * 1024)}/{tts_cache['max_bytes'] // (1024 * 1024)} МБ",
+            f"   Вытеснено: {tts_cache['evictions']}"
+        ])
+        speculative = tts_service.speculations.get_metrics()
+        response.append(
+            f"   Заранее: запущено {speculative['started']}, пригодилось {speculative['hits']}, "
+            f"отменено {speculative['cancelled']}"
+        )
+    
+    response.extend([
+        "",
+        "📤 Кэш file_id Telegram:",
+        f"   Отправок по file_id: {media_cache.hits}, загрузок файлов: {media_cache.uploads}"
+    ])
+    
+    pool = db.get_pool_metrics()
+    pool_wait = pool['wait_time']
+    response.extend([
+        "",
+        "🗄 Пул соединений PostgreSQL:",
+        f"   Открыто: {pool['size']}/{pool['max_size']}, свободно: {pool['idle']}",
+        f"   Ожидание соединения: p95 ≤ {pool_wait['p95']} с, макс {pool_wait['max']:.3f} с"
+    ])
+    
+    profiles = db.profile_cache.get_metrics()
+    response.extend([
+        "",
+        "👤 Кэш профилей:",
+        f"   Попаданий: {profiles['hits']} (из Redis: {profiles['redis_hits']}), промахов: {profiles['misses']}",
+        f"   Записей: {profiles['size']}/{profiles['max_size']}"
+    ])
+    
+    quota = quota_service.get_metrics()
+    response.extend([
+        "",
+        "🎟 Резервирование лимитов:",
+        f"   Через Redis: {quota['redis_reservations']}, через базу: {quota['db_reservations']}",
+        f"   Загрузок из базы: {quota['seeds']}, ожидают записи: {quota['pending_writes']}, "
+        f"ошибок записи: {quota['persist_errors']}"
+    ])
+    
+    cryptobot_latency = cryptobot.get_metrics()
+    if cryptobot_latency:
+        response.extend(["", "💳 CryptoBot API:"])
+        for endpoint, stats in cryptobot_latency.items():
+            response.append(
+                f"   {endpoint}: {stats['count']} запросов, среднее {stats['mean']:.2f} с, "
+                f"p95 ≤ {stats['p95']} с, ошибок: {stats['errors']}"
+            )
+    
+    response.extend(["", "🛡 Внешние API:"])
+    for title, policy in (
+        ("OpenAI", gpt_service.resilience),
+        ("ElevenLabs", tts_service.resilience),
+        ("CryptoBot", cryptobot.resilience)
+    ):
+        resilience = policy.get_metrics()
+        breaker = resilience['breaker']
+        errors = resilience['errors']
+        line = (
+            f"   {title}: {breaker['state']}, ошибок в окне {breaker['failures']}/{breaker['calls']}, "
+            f"срабатываний {breaker['trips']}, отклонено {breaker['rejected']}"
+        )
+        if resilience['limiter']:
+            limiter = resilience['limiter']
+            line += f", параллельно {limiter['in_flight']}/{limiter['limit']}"
+        response.append(line)
+        response.append(
+            f"      повторов {resilience['retries']}, 429: {errors['rate_limited']}, "
+            f"временных: {errors['retryable']}, фатальных: {errors['fatal']}"
+        )
+    
+    await callback.message.answer("\n".join(response))
+    await callback.answer()
+
 
 @router.callback_query(F.data == "admin_grant_subscription")
 async def admin_grant_subscription_start(callback: CallbackQuery, state: FSMContext):
@@ -617,7 +763,7 @@ async def process_subscription_type(callback: CallbackQuery, state: FSMContext):
     
     if sub_type == "free":
         # Для бесплатного тарифа сразу применяем изменения
-        async with db.pool.acquire() as conn:
+        async with db.acquire() as conn:
             await conn.execute(
                 "UPDATE users SET subscription_type = 'free', subscription_expire = NULL WHERE user_id = $1",
                 user_id
@@ -657,7 +803,7 @@ async def process_subscription_duration(message: Message, state: FSMContext):
         sub_type = data["subscription_type"]
         expire_date = datetime.now() + timedelta(days=duration)
         
-        async with db.pool.acquire() as conn:
+        async with db.acquire() as conn:
             await conn.execute(
                 "UPDATE users SET subscription_type = $1, subscription_expire = $2 WHERE user_id = $3",
                 sub_type, expire_date, user_id
@@ -691,7 +837,7 @@ async def process_revoke_subscription(message: Message, state: FSMContext):
     try:
         user_id = int(message.text)
         
-        async with db.pool.acquire() as conn:
+        async with db.acquire() as conn:
             result = await conn.execute(
                 "UPDATE users SET subscription_type = 'free', subscription_expire = NULL WHERE user_id = $1",
                 user_id
@@ -760,6 +906,7 @@ async def process_credits_selection(callback: CallbackQuery, state: FSMContext):
         success = await db.add_video_credits(user_id, amount)
         
         if success:
+            await quota_service.forget(user_id)
             credits = await db.get_video_credits(user_id)
             await callback.message.edit_text(
                 f"✅ Пользователю {user_id} добавлено {amount} видео-кредитов\n"
@@ -789,6 +936,7 @@ async def process_custom_credits(message: Message, state: FSMContext):
         success = await db.add_video_credits(user_id, amount)
         
         if success:
+            await quota_service.forget(user_id)
             credits = await db.get_video_credits(user_id)
             await message.answer(
                 f"✅ Пользователю {user_id} добавлено {amount} видео-кредитов\n"
@@ -819,6 +967,7 @@ async def process_add_credits(message: Message, state: FSMContext):
         success = await db.add_video_credits(user_id, amount)
         
         if success:
+            await quota_service.forget(user_id)
             credits = await db.get_video_credits(user_id)
             await message.answer(
                 f"✅ Пользователю {user_id} добавлено {amount} видео-кредитов\n"
@@ -845,57 +994,64 @@ async def admin_generations(callback: CallbackQuery):
         return
     
     try:
-        async with db.pool.acquire() as conn:
-            generations = await conn.fetch("""
-                SELECT 
-                    g.id,
-                    g.user_id,
-                    u.username,
-                    g.status,
-                    g.created_at,
-                    g.updated_at,
-                    LENGTH(g.script) as script_length,
-                    g.audio_path IS NOT NULL as has_audio,
-                    g.video_path IS NOT NULL as has_video
-                FROM generations g
-                LEFT JOIN users u ON g.user_id = u.user_id
-                ORDER BY g.created_at DESC
-                LIMIT 30
-            """)
-        
-        if not generations:
-            await callback.answer("ℹ️ Нет генераций")
-            return
-        
-        response = ["🎬 Последние генерации (30):\n"]
-        for gen in generations:
-            username = f"@{gen['username']}" if gen['username'] else f"ID:{gen['user_id']}"
-            gen_info = (
-                f"\n🆔 ID: {gen['id']}",
-                f"👤 Пользователь: {username}",
-                f"📝 Статус: {gen['status']}",
-                f"📏 Длина скрипта: {gen['script_length']} символов",
-                f"🔊 Аудио: {'есть' if gen['has_audio'] else 'нет'}",
-                f"🎥 Видео: {'есть' if gen['has_video'] else 'нет'}",
-                f"🕒 Создано: {gen['created_at'].strftime('%d.%m.%Y %H:%M')}",
-                "━━━━━━━━━━━━━━━━━━"
-            )
-            response.extend(gen_info)
-        
-        # Разбиваем длинные сообщения
-        current_message = ""
-        for part in response:
-            if len(current_message) + len(part) > 4000:
-                await callback.message.answer(current_message)
-                current_message = part
-            else:
-                current_message += "\n" + part
-        
-        if current_message:
-            await callback.message.answer(current_message)
-            
+        await show_generations_page(callback.message)
     except Exception as e:
         logger.error(f"Ошибка в admin_generations: {e}")
         await callback.message.answer("⚠️ Ошибка при получении списка генераций")
     finally:
-        await callback.answer()
\ No newline at end of file
+        await callback.answer()
+
+
+@router.callback_query(F.data.startswith("admin_g:"))
+async def admin_generations_page(callback: CallbackQuery):
+    """Переход по страницам генераций"""
+    if not await check_admin(callback.from_user.id):
+        await callback.answer("⛔ Доступ запрещен")
+        return
+    
+    try:
+        # admin_g:<n|p>:<created_at>:<id>
+        _, direction, created_at, generation_id = callback.data.split(":")
+        cursor = (_decode_time(created_at), int(generation_id))
+        await show_generations_page(callback.message, cursor, backward=direction == "p", edit=True)
+    except Exception as e:
+        logger.error(f"Ошибка в admin_generations_page: {e}")
+        await callback.message.answer("⚠️ Ошибка при получении списка генераций")
+    finally:
+        await callback.answer()
+
+
+async def show_generations_page(message: Message, cursor: Optional[tuple] = None, backward: bool = False,
+                                edit: bool = False):
+    """Страница всех генераций, от новых к старым"""
+    generations, has_more = await db.get_generations_page(None, cursor, backward, GENERATIONS_PAGE_SIZE)
+    if not generations:
+        await message.answer("ℹ️ Нет генераций")
+        return
+    
+    response = ["🎬 Генерации:"]
+    for gen in generations:
+        username = f"@{gen['username']}" if gen['username'] else f"ID:{gen['user_id']}"
+        response.extend((
+            f"\n🆔 ID: {gen['id']}",
+            f"👤 Пользователь: {username}",
+            f"📝 Статус: {gen['status']}",
+            f"📏 Длина скрипта: {gen['script_length']} символов",
+            f"🔊 Аудио: {'есть' if gen['has_audio'] else 'нет'}",
+            f"🎥 Видео: {'есть' if gen['has_video'] else 'нет'}",
+            f"🕒 Создано: {gen['created_at'].strftime('%d.%m.%Y %H:%M')}",
+            "━━━━━━━━━━━━━━━━━━"
+        ))
+    
+    builder = InlineKeyboardBuilder()
+    has_prev, has_next = _page_flags(cursor, backward, has_more)
+    _add_page_navigation(
+        builder,
+        "admin_g",
+        f"{_encode_time(generations[0]['created_at'])}:{generations[0]['id']}",
+        f"{_encode_time(generations[-1]['created_at'])}:{generations[-1]['id']}",
+        has_prev,
+        has_next
+    )
+    
+    await _show_page(message, "\n".join(response), builder, edit)
\ No newline at end of file
@@ -1,14 +1,16 @@
-from aiogram import Router, F
+from aiogram import Bot, Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command, CommandObject
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram import types
 from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
 import logging
 from config import config
 from services.database import db
 from services import subscription_service
 from services.cryptobot import cryptobot
+from services.quota_service import quota_service
 import asyncio
 
 router = Router()
@@ -26,8 +28,44 @@ SUBSCRIPTION_PLANS = {
     "premium": {"name": "Premium (30 дней)", "price": config.PREMIUM_PRICE, "duration": 30, "daily_limit": config.PREMIUM_DAILY_LIMIT}
 }
 
-# Кэш для хранения созданных инвойсов
-user_invoices = {}
+async def _complete_paid_invoice(invoice_info: Dict[str, Any]) -> Optional[str]:
+    """
+    Начисляет покупку по оплаченному инвойсу.
+    Возвращает текст уведомления или None, если инвойс уже был обработан.
+    """
+    invoice_id = invoice_info['invoice_id']
+
+    if invoice_info['invoice_type'] == "one_time":
+        purchase = ONE_TIME_PURCHASES.get(invoice_info['purchase_id'])
+        if not purchase:
+            logger.error(f"Unknown purchase {invoice_info['purchase_id']} in invoice {invoice_id}")
+            return None
+        user_id = await db.complete_invoice(invoice_id, video_credits=purchase['amount'])
+        if user_id is None:
+            return None
+        await quota_service.forget(user_id)
+        return (
+            f"✅ Покупка {purchase['name']} успешно завершена!\n"
+            f"Вы получили {purchase['amount']} дополнительных видео.\n\n"
+            f"Теперь у вас {await db.get_video_credits(user_id)} видео-кредитов."
+        )
+
+    plan = SUBSCRIPTION_PLANS.get(invoice_info['plan_id'])
+    if not plan:
+        logger.error(f"Unknown plan {invoice_info['plan_id']} in invoice {invoice_id}")
+        return None
+    user_id = await db.complete_invoice(
+        invoice_id,
+        subscription_type=invoice_info['plan_id'],
+        duration_days=plan["duration"]
+    )
+    if user_id is None:
+        return None
+    return (
+        f"✅ Подписка {plan['name']} активирована!\n"
+        f"Срок действия: {plan['duration']} дней\n\n"
+        "Теперь вы можете создавать больше видео каждый день!"
+    )
 
 @router.message(Command("buy_videos"))
 async def cmd_buy_videos(message: Message):
@@ -105,13 +143,13 @@ async def process_one_time_purchase(callback: CallbackQuery):
         return
     
     # Сохраняем информацию об инвойсе
-    user_invoices[invoice['invoice_id']] = {
-        "user_id": user_id,
-        "purchase_id": purchase_id,
-        "amount": amount_usdt,
-        "status": "created",
-        "type": "one_time"
-    }
+    await db.create_invoice(
+        invoice['invoice_id'],
+        user_id,
+        "one_time",
+        amount_usdt,
+        purchase_id=purchase_id
+    )
     
     builder = InlineKeyboardBuilder()
     builder.add(types.InlineKeyboardButton(
@@ -138,14 +176,18 @@ async def process_one_time_purchase(callback: CallbackQuery):
 # Обновляем обработчик проверки платежа
 @router.callback_query(F.data.startswith("check_payment_"))
 async def check_payment(callback: CallbackQuery):
-    """Проверка оплаты (обновленная версия для работы с разными типами платежей)"""
+    """Проверка оплаты разовой покупки или подписки"""
     invoice_id = int(callback.data.split("_")[2])
-    invoice_info = user_invoices.get(invoice_id)
+    invoice_info = await db.get_invoice(invoice_id)
     
-    if not invoice_info:
+    if not invoice_info or invoice_info['user_id'] != callback.from_user.id:
         await callback.answer("❌ Информация о платеже не найдена. Начните заново.")
         return
     
+    if invoice_info['status'] == "completed":
+        await callback.answer("✅ Этот платеж уже обработан")
+        return
+    
     # Проверяем статус инвойса
     invoice = await cryptobot.check_invoice(invoice_id)
     if not invoice:
@@ -153,37 +195,13 @@ async def check_payment(callback: CallbackQuery):
         return
     
     if invoice.get("status") == "paid":
-        user_id = callback.from_user.id
-        
-        if invoice_info['type'] == "one_time":
-            # Обработка разовой покупки
-            purchase = ONE_TIME_PURCHASES.get(invoice_info['purchase_id'])
-            if purchase:
-                await db.add_video_credits(user_id, purchase['amount'])
-                user_invoices[invoice_id]['status'] = "completed"
-                
-                await callback.message.edit_text(
-                    f"✅ Покупка {purchase['name']} успешно завершена!\n"
-                    f"Вы получили {purchase['amount']} дополнительных видео.\n\n"
-                    f"Теперь у вас {await db.get_video_credits(user_id)} видео-кредитов."
-                )
+        # Начисление идемпотентно: повторное нажатие или фоновая проверка не начислят дважды
+        text = await _complete_paid_invoice(invoice_info)
+        if text:
+            await callback.message.edit_text(text)
         else:
-            # Обработка подписки (старая логика)
-            plan = SUBSCRIPTION_PLANS.get(invoice_info['plan_id'])
-            if plan:
-                await subscription_service.update_subscription(
-                    user_id,
-                    "premium",
-                    plan["duration"],
-                    db.pool
-                )
-                user_invoices[invoice_id]['status'] = "completed"
-                
-                await callback.message.edit_text(
-                    f"✅ Подписка {plan['name']} активирована!\n"
-                    f"Срок действия: {plan['duration']} дней\n\n"
-                    "Теперь вы можете создавать больше видео каждый день!"
-                )
+            await callback.answer("✅ Этот платеж уже обработан")
+            return
     else:
         await callback.answer("ℹ️ Платеж еще не получен. Попробуйте позже.")
     
@@ -217,13 +235,18 @@ async def process_subscription_selection(callback: CallbackQuery):
     description=f"Premium subscription for {plan['name']}"
 )
     
+    if not invoice:
+        await callback.message.answer("⚠️ Не удалось создать платеж. Попробуйте позже.")
+        return
+    
     # Сохраняем информацию об инвойсе
-    user_invoices[invoice['invoice_id']] = {
-        "user_id": user_id,
-        "plan_id": plan_id,
-        "amount": amount_usdt,
-        "status": "created"
-    }
+    await db.create_invoice(
+        invoice['invoice_id'],
+        user_id,
+        "subscription",
+        amount_usdt,
+        plan_id=plan_id
+    )
     
     builder = InlineKeyboardBuilder()
     builder.add(types.InlineKeyboardButton(
@@ -247,62 +270,17 @@ async def process_subscription_selection(callback: CallbackQuery):
     )
     await callback.answer()
 
-@router.callback_query(F.data.startswith("check_payment_"))
-async def check_payment(callback: CallbackQuery):
-    """Проверка оплаты"""
-    invoice_id = int(callback.data.split("_")[2])
-    invoice_info = user_invoices.get(invoice_id)
-    
-    if not invoice_info:
-        await callback.answer("❌ Информация о платеже не найдена. Начните заново.")
-        return
-    
-    plan = SUBSCRIPTION_PLANS.get(invoice_info['plan_id'])
-    if not plan:
-        await callback.answer("❌ Неизвестный тариф")
-        return
-    
-    user_id = callback.from_user.id
-    
-    # Проверяем статус инвойса
-    invoice = await cryptobot.check_invoice(invoice_id)
-    if not invoice:
-        await callback.message.answer("⚠️ Не удалось проверить статус платежа. Попробуйте позже.")
-        return
-    
-    if invoice.get("status") == "paid":
-        # Активируем подписку
-        await subscription_service.update_subscription(
-            user_id,
-            "premium",
-            plan["duration"],
-            db.pool
-        )
-        
-        # Обновляем статус инвойса
-        user_invoices[invoice_id]['status'] = "completed"
-        
-        await callback.message.edit_text(
-            f"✅ Подписка {plan['name']} активирована!\n"
-            f"Срок действия: {plan['duration']} дней\n\n"
-            "Теперь вы можете создавать больше видео каждый день!"
-        )
-    else:
-        await callback.answer("ℹ️ Платеж еще не получен. Попробуйте позже.")
-    
-    await callback.answer()
-
 @router.message(Command("status"))
 async def cmd_status(message: Message):
     """Проверка статуса подписки и кредитов"""
     user_id = message.from_user.id
     
-    async with db.pool.acquire() as conn:
+    async with db.acquire() as conn:
         user = await conn.fetchrow(
             """SELECT subscription_type, subscription_expire, 
                   COALESCE(video_credits, 0) as video_credits,
-                  (SELECT COUNT(*) FROM generations 
-                   WHERE user_id = $1 AND DATE(created_at) = CURRENT_DATE) as generations_today
+                  COALESCE((SELECT count FROM user_usage
+                   WHERE user_id = $1 AND period = to_char(LOCALTIMESTAMP, 'YYYY-MM-DD')), 0) as generations_today
                FROM users WHERE user_id = $1""",
             user_id
         )
@@ -361,55 +339,55 @@ async def admin_grant_subscription(message: Message, command: CommandObject):
         logger.error(f"Ошибка выдачи подписки: {e}")
         await message.answer("❌ Ошибка. Формат: /admin_subscribe <user_id> <plan_id>")
 
-async def check_pending_payments():
-    """Фоновая задача для проверки pending платежей (обновленная версия)"""
+async def check_pending_payments(bot: Bot):
+    """
+    Фоновая задача для проверки неоплаченных инвойсов из базы.
+    Статусы запрашиваются пачками, свежие инвойсы проверяются чаще старых.
+    """
     while True:
         try:
-            # Проверяем все неоплаченные инвойсы
-            for invoice_id, invoice_info in list(user_invoices.items()):
-                if invoice_info['status'] == "created":
-                    invoice = await cryptobot.check_invoice(invoice_id)
-                    if invoice and invoice.get("status") == "paid":
-                        user_id = invoice_info['user_id']
-                        
-                        if invoice_info['type'] == "one_time":
-                            # Обработка разовой покупки
-                            purchase = ONE_TIME_PURCHASES.get(invoice_info['purchase_id'])
-                            if purchase:
-                                await db.add_video_credits(user_id, purchase['amount'])
-                                user_invoices[invoice_id]['status'] = "completed"
-                                
-                                # Уведомляем пользователя
-                                try:
-                                    await router.bot.send_message(
-                                        chat_id=user_id,
-                                        text=f"✅ Покупка {purchase['name']} успешно завершена!\n"
-                                             f"Вы получили {purchase['amount']} дополнительных видео."
-                                    )
-                                except Exception as e:
-                                    logger.error(f"Error notifying user: {e}")
-                        else:
-                            # Обработка подписки
-                            plan = SUBSCRIPTION_PLANS.get(invoice_info['plan_id'])
-                            if plan:
-                                await subscription_service.update_subscription(
-                                    user_id,
-                                    "premium",
-                                    plan["duration"],
-                                    db.pool
-                                )
-                                user_invoices[invoice_id]['status'] = "completed"
-                                
-                                # Уведомляем пользователя
-                                try:
-                                    await router.bot.send_message(
-                                        chat_id=user_id,
-                                        text=f"✅ Ваша подписка {plan['name']} активирована!"
-                                    )
-                                except Exception as e:
-                                    logger.error(f"Error notifying user: {e}")
+            await db.expire_stale_invoices(config.PAYMENT_INVOICE_TTL_HOURS)
+            pending = await db.get_pending_invoices(
+                config.PAYMENT_POLL_MIN_INTERVAL,
+                config.PAYMENT_POLL_MAX_INTERVAL
+            )
+            
+            batch_size = config.PAYMENT_POLL_BATCH_SIZE
+            for i in range(0, len(pending), batch_size):
+                batch = pending[i:i + batch_size]
+                invoice_ids = [invoice_info['invoice_id'] for invoice_info in batch]
+                invoices = await cryptobot.check_invoices(invoice_ids)
+                if invoices is None:
+                    # Ошибка API: попробуем на следующей итерации
+                    continue
+                
+                await db.mark_invoices_checked(invoice_ids)
+                
+                expired = [
+                    invoice_id for invoice_id, invoice in invoices.items()
+                    if invoice.get("status") == "expired"
+                ]
+                if expired:
+                    await db.expire_invoices(expired)
+                
+                for invoice_info in batch:
+                    invoice = invoices.get(invoice_info['invoice_id'])
+                    if not invoice or invoice.get("status") != "paid":
+                        continue
+                    
+                    text = await _complete_paid_invoice(invoice_info)
+                    if not text:
+                        continue
+                    
+                    # Уведомляем пользователя
+                    try:
+                        await bot.send_message(chat_id=invoice_info['user_id'], text=text)
+                    except Exception as e:
+                        logger.error(f"Error notifying user: {e}")
             
-            await asyncio.sleep(60)  # Проверяем каждую минуту
+            await asyncio.sleep(config.PAYMENT_POLL_MIN_INTERVAL)
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logger.error(f"Error in payment checking task: {e}")
-            await asyncio.sleep(60)
\ No newline at end of file
+            await asyncio.sleep(config.PAYMENT_POLL_MIN_INTERVAL)
\ No newline at end of file
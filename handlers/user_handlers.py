@@ -8,17 +8,29 @@ from services import gpt_service, tts_service, video_service
 import time
 from services import subscription_service
 from services.database import db
+from services.render_queue import render_scheduler
+from services.asset_service import background_library
+from services.media_cache import media_cache
+from services.quota_service import quota_service
+from services.script_alternatives import script_alternatives
+from utils.message_utils import ThrottledEditor
+from utils.speculative import SpeculativeTasks, StreamBuffer
 from datetime import datetime, timedelta
 from config import config
 from utils.file_utils import generate_temp_file_path
 import logging
 import os
 import asyncio
+import math
 from aiohttp import ClientConnectorError
 import re
+from typing import AsyncIterator, Optional
 
 router = Router()
 
+# Сценарии, которые генерируются, пока пользователь выбирает голос и фон (ключ - user_id)
+speculative_scripts = SpeculativeTasks(config.SPECULATIVE_TTL)
+
 VIDEO_STYLES = {
     "inspire": {
         "name": "💡 Вдохновляющий",
@@ -77,61 +89,9 @@ class ProfileStates(StatesGroup):
     waiting_tone = State()
     waiting_audience = State()
 
-async def check_usage_limit(user_id: int) -> tuple:
-    """Check if user has exceeded daily limit"""
-    subscription = await db.get_user_subscription(user_id)
-    daily_limit = (
-        config.PREMIUM_DAILY_LIMIT 
-        if subscription == "premium" 
-        else config.FREE_DAILY_LIMIT
-    )
-    
-    usage = await db.get_user_usage(user_id)
-    credits = await db.get_video_credits(user_id)
-    
-    # Если есть кредиты, разрешаем генерацию независимо от лимита
-    if credits > 0:
-        return (True, credits - 1)  # (can_generate, remaining_credits)
-    
-    return (usage < daily_limit, daily_limit - usage - 1)
-
 async def _get_available_backgrounds():
-    backgrounds = []
-    bg_dir = "video_assets"
-    
-    if not os.path.exists(bg_dir):
-        os.makedirs(bg_dir, exist_ok=True)
-        return backgrounds
-    
-    # Сопоставление имен файлов с человекочитаемыми названиями
-    name_mapping = {
-        "city_sunlight.mp4": "Солнечный город",
-        "studio_white.mp4": "Затягивающий полет",
-        "sunset_nature.mp4": "Золотой час природы",
-        "warm_abstract.mp4": "Поле подсолнухов",
-        "dark_forest.mp4": "Тёмный лес",
-        "firelight.mp4": "Камин",
-        "deep_abstract.mp4": "Темный вечер в лесу",
-        "night_glow.mp4": "Ночное свечение луны",
-        "cloud_sky.mp4": "Облака",
-        "color_flow.mp4": "Цветной полет",
-        "watercolor_pastel.mp4": "Рыжий кот",
-        "light_shapes.mp4": "Полет над облаками",
-        "podcast_mic.mp4": "Микрофон",
-        "studio_light.mp4": "Светлая студия",
-        "studio_dark.mp4": "Тёмная студия",
-        "visual_wave.mp4": "Тёмная студия v2"
-    }
-    
-    for filename in os.listdir(bg_dir):
-        if filename.endswith(('.mp4', '.mov', '.avi')):
-            name = name_mapping.get(filename, filename.split('.')[0].replace('_', ' ').capitalize())
-            backgrounds.append({
-                'filename': filename,
-                'name': name,
-                'path': os.path.join(bg_dir, filename)
-            })
-    return backgrounds
+    """Список фонов из индекса в памяти (без обращения к диску)"""
+    return [asset.as_dict() for asset in background_library.list()]
 
 @router.message(Command("start"))
 async def cmd_start(message: Message, state: FSMContext):
@@ -139,6 +99,8 @@ async def cmd_start(message: Message, state: FSMContext):
     username = message.from_user.username
     full_name = message.from_user.full_name
     
+    await _drop_prepared_scripts(user_id, state)
+    
     # Сохраняем/обновляем данные пользователя в базе
     await db.create_user(
         user_id=user_id,
@@ -201,6 +163,9 @@ async def cmd_new_video(message: Message, state: FSMContext):
         await message.answer("ℹ️ Пожалуйста, сначала настройте профиль: /start")
         return
     
+    # Новый сценарий начинается заново, заготовки прошлого не нужны
+    await _drop_prepared_scripts(user_id, state)
+    
     # Проверяем лимиты
     can_generate, limit_message = await subscription_service.check_user_limits(user_id, db.pool)
     credits = await db.get_video_credits(user_id)
@@ -257,43 +222,103 @@ async def process_idea(message: Message, state: FSMContext):
     
     await message.answer("🎬 Выберите стиль для вашего видео:", reply_markup=builder.as_markup())
 
-async def _generate_script(callback: CallbackQuery, state: FSMContext):
-    await callback.message.answer("🔄 Генерирую текст для озвучки... Пожалуйста, подождите ⏳")
+def _script_keyboard():
+    builder = InlineKeyboardBuilder()
+    builder.button(text="👍 Одобрить", callback_data="script_approve")
+    builder.button(text="✍️ Редактировать", callback_data="script_edit")
+    builder.button(text="🔄 Новый вариант", callback_data="script_regenerate")
+    builder.button(text="❌ Отменить", callback_data="script_cancel")
+    builder.adjust(1, repeat=True)
+    return builder.as_markup()
+
+def _background_name(background: Optional[str]) -> str:
+    if not background:
+        return "Черный"
+    return background.split('.')[0].replace('_', ' ').capitalize()
+
+def _script_prompt(data: dict) -> str:
+    return f"Напиши текст для озвучки видео в {data['style']} стиле. Тема: {data['idea']}"
+
+async def _script_chunks(user_id: int, prompt: str) -> AsyncIterator[str]:
+    """Текст первого варианта по мере генерации; остальные откладываются для кнопки «Новый вариант»"""
+    profile = await db.get_user_profile(user_id)
+    alternatives = []
+    async for chunk in gpt_service.stream_script(prompt, profile, config.SCRIPT_CANDIDATES, alternatives):
+        yield chunk
+    await script_alternatives.push(user_id, prompt, alternatives)
+
+async def _drop_prepared_scripts(user_id: int, state: FSMContext):
+    """Отменяет заготовленные сценарии и озвучку прошлой генерации"""
+    speculative_scripts.cancel(user_id)
+    tts_service.cancel_speculation(user_id)
+    data = await state.get_data()
+    if data.get('style') and data.get('idea'):
+        await script_alternatives.discard(user_id, _script_prompt(data))
+
+async def _stream_script(
+    message: Message,
+    state: FSMContext,
+    user_id: int,
+    prompt: str,
+    title: str,
+    chunks: Optional[AsyncIterator[str]] = None
+) -> str:
+    """
+    Генерирует сценарий, показывая текст по мере генерации, и переходит к его просмотру.
+    chunks - уже запущенная генерация (например, заготовка), иначе запускается новая.
+    """
+    preview = await message.answer("🔄 Генерирую текст для озвучки... Пожалуйста, подождите ⏳")
+    editor = ThrottledEditor(
+        preview,
+        every_chunks=config.SCRIPT_STREAM_EDIT_CHUNKS,
+        max_interval=config.SCRIPT_STREAM_EDIT_INTERVAL_MS / 1000
+    )
     
+    if chunks is None:
+        chunks = _script_chunks(user_id, prompt)
+    script = ""
+    async for chunk in chunks:
+        script += chunk
+        await editor.update(f"✍️ Пишу текст для озвучки...\n\n{script}")
+    
+    script = script.strip()
+    if not script:
+        raise Exception("Не удалось создать текст для озвучки")
+    
+    await state.update_data(script=script)
+    await state.set_state(GenerationStates.previewing_script)
+    await editor.finish(f"{title}\n\n{script}", reply_markup=_script_keyboard())
+    await _speculate_tts(user_id, state)
+    return script
+
+async def _speculate_tts(user_id: int, state: FSMContext):
+    """Начинает озвучку показанного сценария, пока пользователь его читает"""
+    if not config.SPECULATIVE_TTS:
+        return
+    try:
+        data = await state.get_data()
+        tier = await db.get_effective_tier(user_id)
+        tts_service.speculate(user_id, tier, data['script'], data.get('voice_gender'))
+    except Exception as e:
+        logging.error(f"Ошибка запуска озвучки заранее: {e}")
+
+async def _generate_script(callback: CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
     data = await state.get_data()
+    prompt = _script_prompt(data)
     
     try:
-        profile = await db.get_user_profile(user_id)
-        script = await gpt_service.generate_script(
-            f"Напиши текст для озвучки видео в {data['style']} стиле. Тема: {data['idea']}",
-            profile
-        )
-        
-        if not script:
-            raise Exception("Не удалось создать текст для озвучки")
-        
-        await state.update_data(script=script)
-        await state.set_state(GenerationStates.previewing_script)
-        
-        builder = InlineKeyboardBuilder()
-        builder.button(text="👍 Одобрить", callback_data="script_approve")
-        builder.button(text="✍️ Редактировать", callback_data="script_edit")
-        builder.button(text="🔄 Новый вариант", callback_data="script_regenerate")
-        builder.button(text="❌ Отменить", callback_data="script_cancel")
-        builder.adjust(1, repeat=True)
-        
-        bg_name = "Черный"
-        if data.get('background'):
-            bg_name = data['background'].split('.')[0].replace('_', ' ').capitalize()
-        
-        await callback.message.answer(
+        await _stream_script(
+            callback.message,
+            state,
+            user_id,
+            prompt,
             f"🎬 Текст для озвучки готов!\n\n"
             f"Стиль: {data['style']}\n"
             f"Тема: {data['idea']}\n"
-            f"Фон: {bg_name}\n\n"
-            f"{script}",
-            reply_markup=builder.as_markup()
+            f"Фон: {_background_name(data.get('background'))}",
+            # Заготовка, начатая после выбора стиля, если идея и стиль не менялись
+            speculative_scripts.take(user_id, prompt)
         )
     except Exception as e:
         logging.error(f"Ошибка генерации текста: {str(e)}")
@@ -312,6 +337,12 @@ async def process_style_selection(callback: CallbackQuery, state: FSMContext):
     
     await state.update_data(style=style_data["name"], style_id=style_id)
     await callback.message.edit_reply_markup()
+    
+    if config.SPECULATIVE_SCRIPTS:
+        # Текст зависит только от идеи и стиля: начинаем генерацию, пока выбираются голос и фон
+        user_id = callback.from_user.id
+        prompt = _script_prompt(await state.get_data())
+        speculative_scripts.start(user_id, prompt, lambda: StreamBuffer(_script_chunks(user_id, prompt)))
     await state.set_state(GenerationStates.waiting_for_voice)  # Переходим к выбору голоса
     
     builder = InlineKeyboardBuilder()
@@ -370,16 +401,17 @@ async def select_default_background(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(GenerationStates.waiting_for_background, F.data.startswith("bg_preview_"))
 async def preview_background(callback: CallbackQuery):
     bg_filename = callback.data.replace("bg_preview_", "")
-    bg_path = os.path.join("video_assets", bg_filename)
+    asset = background_library.get(bg_filename)
     
-    if not os.path.exists(bg_path):
+    if not asset or not os.path.exists(asset.render_path):
         await callback.answer("⚠️ Фон не найден", show_alert=True)
         return
     
     try:
-        video = FSInputFile(bg_path)
-        await callback.message.answer_video(
-            video,
+        # Файл загружается в Telegram один раз, дальше отправляем по file_id
+        await media_cache.answer_video(
+            callback.message,
+            asset.render_path,
             caption=f"🎥 Предпросмотр фона: {bg_filename.split('.')[0].replace('_', ' ').capitalize()}",
             width=1080,
             height=1920
@@ -400,39 +432,7 @@ async def select_background(callback: CallbackQuery, state: FSMContext):
     bg_filename = callback.data.replace("bg_select_", "")
     await state.update_data(background=bg_filename)
     await callback.message.edit_reply_markup()
-    await callback.message.answer("🔄 Генерирую текст для озвучки... Пожалуйста, подождите ⏳")
-    
-    user_id = callback.from_user.id
-    data = await state.get_data()
-    
-    try:
-        profile = await db.get_user_profile(user_id)
-        script = await gpt_service.generate_script(
-            f"Напиши текст для озвучки видео в {data['style']} стиле. Тема: {data['idea']}",
-            profile
-        )
-        
-        if not script:
-            raise Exception("Не удалось создать текст для озвучки")
-        
-        await state.update_data(script=script)
-        await state.set_state(GenerationStates.previewing_script)
-        
-        builder = InlineKeyboardBuilder()
-        builder.button(text="👍 Одобрить", callback_data="script_approve")
-        builder.button(text="✍️ Редактировать", callback_data="script_edit")
-        builder.button(text="🔄 Новый вариант", callback_data="script_regenerate")
-        builder.button(text="❌ Отменить", callback_data="script_cancel")
-        builder.adjust(1, repeat=True)
-        
-        await callback.message.answer(
-            f"🎬 Текст для озвучки готов!\n\nСтиль: {data['style']}\nТема: {data['idea']}\nФон: {bg_filename.split('.')[0].replace('_', ' ').capitalize()}\n\n{script}",
-            reply_markup=builder.as_markup()
-        )
-    except Exception as e:
-        logging.error(f"Ошибка генерации текста: {str(e)}")
-        await callback.message.answer("⚠️ Не удалось создать текст для озвучки")
-        await state.clear()
+    await _generate_script(callback, state)
 
 @router.callback_query(GenerationStates.waiting_for_background, F.data == "bg_show_all")
 async def show_all_backgrounds(callback: CallbackQuery):
@@ -450,56 +450,25 @@ async def show_all_backgrounds(callback: CallbackQuery):
 async def select_no_background(callback: CallbackQuery, state: FSMContext):
     await state.update_data(background=None)
     await callback.message.edit_reply_markup()
-    
-    user_id = callback.from_user.id
-    data = await state.get_data()
-    
-    try:
-        profile = await db.get_user_profile(user_id)
-        script = await gpt_service.generate_script(
-            f"Напиши текст для озвучки видео в {data['style']} стиле. Тема: {data['idea']}",
-            profile
-        )
-        
-        if not script:
-            raise Exception("Не удалось создать текст для озвучки")
-        
-        await state.update_data(script=script)
-        await state.set_state(GenerationStates.previewing_script)
-        
-        builder = InlineKeyboardBuilder()
-        builder.button(text="👍 Одобрить", callback_data="script_approve")
-        builder.button(text="✍️ Редактировать", callback_data="script_edit")
-        builder.button(text="🔄 Новый вариант", callback_data="script_regenerate")
-        builder.button(text="❌ Отменить", callback_data="script_cancel")
-        builder.adjust(1, repeat=True)
-        
-        await callback.message.answer(
-            f"🎬 Текст для озвучки готов!\n\nСтиль: {data['style']}\nТема: {data['idea']}\nФон: Черный\n\n{script}",
-            reply_markup=builder.as_markup()
-        )
-    except Exception as e:
-        logging.error(f"Ошибка генерации текста: {str(e)}")
-        await callback.message.answer("⚠️ Не удалось создать текст для озвучки")
-        await state.clear()
+    await _generate_script(callback, state)
 
 @router.message(Command("status"))
 async def cmd_status(message: Message):
     """Проверка статуса подписки и кредитов с отображением месячных лимитов"""
     user_id = message.from_user.id
     
-    async with db.pool.acquire() as conn:
+    async with db.acquire() as conn:
         user = await conn.fetchrow(
             """SELECT 
                   u.subscription_type, 
                   u.subscription_expire, 
                   COALESCE(u.video_credits, 0) as video_credits,
-                  (SELECT COUNT(*) FROM generations 
-                   WHERE user_id = $1 AND DATE(created_at) = CURRENT_DATE) as generations_today,
-                  (SELECT COUNT(*) FROM generations 
-                   WHERE user_id = $1 AND DATE_TRUNC('month', created_at) = DATE_TRUNC('month', CURRENT_DATE)) as generations_month,
-                  (SELECT COUNT(*) FROM generations 
-                   WHERE user_id = $1) as generations_total
+                  COALESCE((SELECT count FROM user_usage
+                   WHERE user_id = $1 AND period = to_char(LOCALTIMESTAMP, 'YYYY-MM-DD')), 0) as generations_today,
+                  COALESCE((SELECT count FROM user_usage
+                   WHERE user_id = $1 AND period = to_char(LOCALTIMESTAMP, 'YYYY-MM')), 0) as generations_month,
+                  COALESCE((SELECT count FROM user_usage
+                   WHERE user_id = $1 AND period = 'all'), 0) as generations_total
                FROM users u WHERE u.user_id = $1""",
             user_id
         )
@@ -543,15 +512,49 @@ async def cmd_status(message: Message):
         
         await message.answer("\n".join(status_msg))
 
+def _format_eta(seconds: float) -> str:
+    minutes = math.ceil(seconds / 60)
+    if minutes <= 1:
+        return "меньше минуты"
+    return f"~{minutes} мин."
+
+async def _render_video(data: dict, audio_path: str, video_path: str):
+    """Озвучка и сборка видео (выполняется воркером очереди рендеров)"""
+    os.makedirs("generated_audio", exist_ok=True)
+    success = await tts_service.generate_audio(
+        data['script'],
+        audio_path,
+        voice_gender=data.get('voice_gender')
+    )
+
+    if not success or not os.path.exists(audio_path):
+        raise Exception("Не удалось сгенерировать аудио")
+
+    success = await video_service.create_video(
+        script=data['script'],
+        audio_path=audio_path,
+        output_path=video_path,
+        background=data.get('background')
+    )
+
+    if not success or not os.path.exists(video_path):
+        raise Exception("Не удалось создать видео")
+
 @router.callback_query(GenerationStates.previewing_script, F.data == "script_approve")
 async def approve_script(callback: CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
+    data = await state.get_data()
+    # Тариф с учетом срока подписки, как и в db.reserve_generation
+    tier = await db.get_effective_tier(user_id)
+    
+    # Проверяем лимиты и резервируем генерацию (или кредит) одной атомарной операцией
+    reservation = await quota_service.reserve(
+        user_id,
+        tier,
+        prompt=f"Style: {data.get('style')}, Idea: {data.get('idea')}"
+    )
     
-    # Проверяем лимиты и кредиты
-    can_generate, remaining = await check_usage_limit(user_id)
-    credits = await db.get_video_credits(user_id)
-    
-    if not can_generate and credits <= 0:
+    if not reservation.allowed:
         await callback.message.edit_reply_markup()
         await callback.message.answer(
             f"⚠️ Вы исчерпали дневной лимит генераций.\n"
@@ -564,56 +567,43 @@ async def approve_script(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_reply_markup()
     await callback.message.answer("⏳ Начинаю создание видео...")
     
-    data = await state.get_data()
+    # Озвучка могла начаться заранее: generate_audio дождется ее или возьмет из кэша
+    tts_service.claim_speculation(user_id, data['script'], data.get('voice_gender'))
+    
     audio_path = "audio_assets/"
     video_path = None
     
     try:
-        # Если нет обычного лимита, но есть кредиты, используем кредит
-        if not can_generate and credits > 0:
-            await db.use_video_credit(user_id)
-            credits -= 1
-        
-        # Логируем генерацию
-        generation_id = await db.log_generation(
-            user_id=user_id,
-            prompt=f"Style: {data.get('style')}, Idea: {data.get('idea')}",
-            status="processing"
-        )
-        
-        voiceover_text = data['script']
         audio_filename = f"audio_{user_id}_{int(time.time())}.mp3"
         audio_path = os.path.join("generated_audio", audio_filename)
-        
-        os.makedirs("generated_audio", exist_ok=True)
-        success = await tts_service.generate_audio(
-            voiceover_text, 
-            audio_path,
-            voice_gender=data.get('voice_gender')  
-        )
-        
-        if not success or not os.path.exists(audio_path):
-            raise Exception("Не удалось сгенерировать аудио")
-        
         video_path = generate_temp_file_path("mp4")
-        success = await video_service.create_video(
-            script=data['script'],
-            audio_path=audio_path,
-            output_path=video_path,
-            background=data.get('background')
+
+        # Ставим озвучку и рендер в очередь с приоритетом по тарифу
+        job = render_scheduler.submit(
+            user_id,
+            tier,
+            lambda: _render_video(data, audio_path, video_path)
         )
-        
-        if not success or not os.path.exists(video_path):
-            raise Exception("Не удалось создать видео")
-        
+        position = render_scheduler.position(job)
+        eta = render_scheduler.estimate_wait(job)
+        if eta > 0:
+            await callback.message.answer(
+                f"🕒 Ваше видео в очереди: позиция {position}\n"
+                f"Примерное время ожидания: {_format_eta(eta)}"
+            )
+
+        await job.future
+
         # Обновляем статус генерации
-        await db.update_generation(
-            generation_id=generation_id,
-            script=data['script'],
-            audio_path=audio_path,
-            video_path=video_path,
-            status="completed"
-        )
+        generation_id = await reservation.generation_id()
+        if generation_id:
+            await db.update_generation(
+                generation_id=generation_id,
+                script=data['script'],
+                audio_path=audio_path,
+                video_path=video_path,
+                status="completed"
+            )
         
         video = FSInputFile(video_path)
         await callback.message.answer_video(
@@ -624,22 +614,22 @@ async def approve_script(callback: CallbackQuery, state: FSMContext):
         )
         
         # Показываем оставшийся лимит/кредиты
-        if credits > 0:
+        if reservation.used_credit:
             await callback.message.answer(
-                f"🔄 Осталось видео-кредитов: {credits}\n"
+                f"🔄 Осталось видео-кредитов: {reservation.remaining}\n"
                 f"Купить еще: /buy_videos"
             )
         else:
-            _, remaining = await check_usage_limit(user_id)
             await callback.message.answer(
-                f"🔄 Осталось генераций сегодня: {remaining}\n"
+                f"🔄 Осталось генераций сегодня: {reservation.remaining}\n"
                 f"Лимит обновится через {_time_until_midnight()}"
             )
     except Exception as e:
         logging.error(f"Ошибка создания видео: {str(e)}")
         await callback.message.answer("⚠️ Ошибка при создании видео")
         # Обновляем статус генерации в случае ошибки
-        if 'generation_id' in locals():
+        generation_id = await reservation.generation_id()
+        if generation_id:
             await db.update_generation(
                 generation_id=generation_id,
                 status="failed"
@@ -666,6 +656,8 @@ async def cmd_premium(message: Message):
 
 @router.callback_query(GenerationStates.previewing_script, F.data == "script_edit")
 async def request_script_edit(callback: CallbackQuery, state: FSMContext):
+    # Текст изменится, озвучка текущего не понадобится
+    tts_service.cancel_speculation(callback.from_user.id)
     await callback.message.answer("📝 Введите ваши правки к сценарию:")
     await state.set_state(GenerationStates.editing_script)
 
@@ -686,14 +678,8 @@ async def process_script_edit(message: Message, state: FSMContext):
         await state.update_data(script=improved_script)
         await state.set_state(GenerationStates.previewing_script)
         
-        builder = InlineKeyboardBuilder()
-        builder.button(text="👍 Одобрить", callback_data="script_approve")
-        builder.button(text="✍️ Редактировать", callback_data="script_edit")
-        builder.button(text="🔄 Новый вариант", callback_data="script_regenerate")
-        builder.button(text="❌ Отменить", callback_data="script_cancel")
-        builder.adjust(1, repeat=True)
-        
-        await message.answer(f"🔄 Сценарий обновлен!\n\n{improved_script}", reply_markup=builder.as_markup())
+        await message.answer(f"🔄 Сценарий обновлен!\n\n{improved_script}", reply_markup=_script_keyboard())
+        await _speculate_tts(user_id, state)
     except Exception as e:
         logging.error(f"Ошибка редактирования: {str(e)}")
         await message.answer("⚠️ Не удалось применить правки")
@@ -702,37 +688,39 @@ async def process_script_edit(message: Message, state: FSMContext):
 @router.callback_query(GenerationStates.previewing_script, F.data == "script_regenerate")
 async def regenerate_script(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_reply_markup()
-    await callback.message.answer("🔄 Создаю новый вариант сценария...")
+    tts_service.cancel_speculation(callback.from_user.id)
     
     user_id = callback.from_user.id
     data = await state.get_data()
+    prompt = _script_prompt(data)
     
     try:
-        profile = await db.get_user_profile(user_id)
-        script = await gpt_service.generate_script(
-            f"Создай сценарий в стиле: {data['style']}\nТема: {data['idea']}",
-            profile
-        )
-        
-        if not script:
-            raise Exception("Не удалось создать сценарий")
-        
-        await state.update_data(script=script)
-        
-        builder = InlineKeyboardBuilder()
-        builder.button(text="👍 Одобрить", callback_data="script_approve")
-        builder.button(text="✍️ Редактировать", callback_data="script_edit")
-        builder.button(text="🔄 Новый вариант", callback_data="script_regenerate")
-        builder.button(text="❌ Отменить", callback_data="script_cancel")
-        builder.adjust(1, repeat=True)
+        # Обычно вариант уже готов: он был получен вместе с предыдущим
+        script = await script_alternatives.pop(user_id, prompt)
+        if script:
+            await state.update_data(script=script)
+            await callback.message.answer(
+                f"🆕 Новый вариант сценария готов!\n\n{script}",
+                reply_markup=_script_keyboard(),
+                parse_mode=None
+            )
+            await _speculate_tts(user_id, state)
+            return
         
-        await callback.message.answer(f"🆕 Новый вариант сценария готов!\n\n{script}", reply_markup=builder.as_markup())
+        await _stream_script(
+            callback.message,
+            state,
+            user_id,
+            prompt,
+            "🆕 Новый вариант сценария готов!"
+        )
     except Exception as e:
         logging.error(f"Ошибка перегенерации: {str(e)}")
         await callback.message.answer("⚠️ Не удалось создать новый вариант")
 
 @router.callback_query(GenerationStates.previewing_script, F.data == "script_cancel")
 async def cancel_generation(callback: CallbackQuery, state: FSMContext):
+    await _drop_prepared_scripts(callback.from_user.id, state)
     await callback.message.edit_reply_markup()
     await callback.message.answer("❌ Создание видео отменено")
     await state.clear()
\ No newline at end of file
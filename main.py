@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
@@ -7,12 +8,44 @@ from redis.asyncio import Redis
 from config import config
 from handlers import user_handlers, admin_handlers, payment_handlers
 from services.database import db
+from services.render_queue import render_scheduler
+from services.tts_service import tts_service
+from services.asset_service import background_library
+from services.cryptobot import cryptobot
+from services.subscription_service import maintain_usage_counters
+from services.quota_service import quota_service
+from services.broadcast_service import broadcast_service
+from services.script_alternatives import script_alternatives
+from services import stats_service
+from services.maintenance_service import run_partition_maintenance
 from utils.logging import setup_logging
 
+# Фоновые задачи, которые нужно остановить при выключении
+background_tasks = []
+
 async def on_startup(bot: Bot):
     """Initialize services and notify admins"""
     try:
         await db.connect()
+        await render_scheduler.start()
+        await cryptobot.start()
+        await background_library.refresh()
+        background_tasks.append(asyncio.create_task(
+            background_library.watch(config.BACKGROUND_REFRESH_INTERVAL)
+        ))
+        background_tasks.append(asyncio.create_task(
+            payment_handlers.check_pending_payments(bot)
+        ))
+        background_tasks.append(asyncio.create_task(
+            maintain_usage_counters(config.USAGE_REPAIR_INTERVAL_HOURS)
+        ))
+        background_tasks.append(asyncio.create_task(
+            stats_service.run_aggregator(config.STATS_AGGREGATE_INTERVAL, config.STATS_SETTLE_MINUTES)
+        ))
+        background_tasks.append(asyncio.create_task(
+            run_partition_maintenance(config.PARTITION_MAINTENANCE_INTERVAL_HOURS)
+        ))
+        await broadcast_service.resume(bot)
         
         for admin_id in config.ADMIN_IDS:
             try:
@@ -36,6 +69,17 @@ async def on_shutdown(bot: Bot):
         except Exception as e:
             logging.error(f"Failed to notify admin {admin_id}: {e}")
     
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    
+    await broadcast_service.close()
+    await render_scheduler.stop()
+    await quota_service.close()
+    await tts_service.close()
+    await cryptobot.close()
+    
     if db.pool:
         await db.pool.close()
 
@@ -50,6 +94,10 @@ async def main():
         decode_responses=True
     )
     storage = RedisStorage(redis)
+    quota_service.setup(redis)
+    script_alternatives.setup(redis)
+    if config.PROFILE_CACHE_REDIS:
+        db.profile_cache.setup_redis(redis, config.PROFILE_CACHE_LOCAL_TTL)
     
     # Initialize bot
     bot = Bot(token=config.BOT_TOKEN, default=DefaultBotProperties(parse_mode='HTML'))
@@ -72,5 +120,4 @@ async def main():
     )
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,33 @@
+"""
+Перенос таблицы generations старых версий в таблицу с партициями по месяцам.
+
+Таблица подменяется короткой транзакцией, после чего строки переносятся
+пачками; бот может работать во время переноса (до его окончания история
+генераций видна не полностью). Прерванный перенос продолжается повторным запуском.
+
+Запуск (использует настройки PostgreSQL из .env):
+    python -m migrations.partition_generations --batch-size 10000
+"""
+import argparse
+import asyncio
+import logging
+
+from services.database import db
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Перенос generations в таблицу с партициями")
+    parser.add_argument("--batch-size", type=int, default=10000, help="строк за одну транзакцию")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+
+    await db.connect()
+    try:
+        moved = await db.migrate_generations(args.batch_size)
+        print(f"Перенесено строк: {moved}")
+    finally:
+        await db.pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,253 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from config import config
+from services.render_queue import MAINTENANCE_TIER, render_scheduler
+from utils.process_utils import run_process
+
+logger = logging.getLogger(__name__)
+
+BACKGROUNDS_DIR = "video_assets"
+MEZZANINE_DIR = os.path.join(BACKGROUNDS_DIR, ".mezzanine")
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi')
+TARGET_WIDTH = 1080
+TARGET_HEIGHT = 1920
+# Сколько держать замененную подготовленную версию: ее еще может читать рендер,
+# начатый до замены (рендер - не больше трех проходов ffmpeg)
+MEZZANINE_GRACE_PERIOD = 3 * config.FFMPEG_TIMEOUT
+
+# Сопоставление имен файлов с человекочитаемыми названиями
+BACKGROUND_NAMES = {
+    "city_sunlight.mp4": "Солнечный город",
+    "studio_white.mp4": "Затягивающий полет",
+    "sunset_nature.mp4": "Золотой час природы",
+    "warm_abstract.mp4": "Поле подсолнухов",
+    "dark_forest.mp4": "Тёмный лес",
+    "firelight.mp4": "Камин",
+    "deep_abstract.mp4": "Темный вечер в лесу",
+    "night_glow.mp4": "Ночное свечение луны",
+    "cloud_sky.mp4": "Облака",
+    "color_flow.mp4": "Цветной полет",
+    "watercolor_pastel.mp4": "Рыжий кот",
+    "light_shapes.mp4": "Полет над облаками",
+    "podcast_mic.mp4": "Микрофон",
+    "studio_light.mp4": "Светлая студия",
+    "studio_dark.mp4": "Тёмная студия",
+    "visual_wave.mp4": "Тёмная студия v2"
+}
+
+# Приведение к вертикальному формату: заполняем кадр и обрезаем лишнее
+NORMALIZE_FILTER = (
+    f"scale={TARGET_WIDTH}:{TARGET_HEIGHT}:force_original_aspect_ratio=increase,"
+    f"crop={TARGET_WIDTH}:{TARGET_HEIGHT},setsar=1"
+)
+
+
+@dataclass
+class BackgroundAsset:
+    filename: str
+    name: str
+    path: str
+    mtime: float
+    size: int
+    duration: float
+    width: int
+    height: int
+    codec: str
+    has_audio: bool
+    mezzanine_path: Optional[str] = None
+
+    @property
+    def render_path(self) -> str:
+        """Файл для рендера: подготовленная версия, если она готова"""
+        return self.mezzanine_path or self.path
+
+    @property
+    def is_normalized(self) -> bool:
+        """Не требует масштабирования при рендере"""
+        return bool(self.mezzanine_path) or (self.width, self.height) == (TARGET_WIDTH, TARGET_HEIGHT)
+
+    def as_dict(self) -> Dict:
+        return {
+            'filename': self.filename,
+            'name': self.name,
+            'path': self.path
+        }
+
+
+def background_display_name(filename: str) -> str:
+    return BACKGROUND_NAMES.get(filename, filename.split('.')[0].replace('_', ' ').capitalize())
+
+
+class BackgroundLibrary:
+    """Индекс фоновых видео с метаданными ffprobe, хранится в памяти"""
+
+    def __init__(self, directory: str = BACKGROUNDS_DIR, mezzanine_dir: str = MEZZANINE_DIR):
+        self.directory = directory
+        self.mezzanine_dir = mezzanine_dir
+        self._assets: Dict[str, BackgroundAsset] = {}
+        # Когда подготовленная версия перестала быть актуальной
+        self._stale_since: Dict[str, float] = {}
+        self._lock = asyncio.Lock()
+
+    def list(self) -> List[BackgroundAsset]:
+        return [self._assets[name] for name in sorted(self._assets)]
+
+    def get(self, filename: Optional[str]) -> Optional[BackgroundAsset]:
+        if not filename:
+            return None
+        return self._assets.get(filename)
+
+    async def refresh(self) -> bool:
+        """Пересканирует директорию и пробует только новые или измененные файлы"""
+        async with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            found = {}
+            for filename in os.listdir(self.directory):
+                if not filename.endswith(VIDEO_EXTENSIONS):
+                    continue
+                path = os.path.join(self.directory, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found[filename] = (path, stat.st_mtime, stat.st_size)
+
+            changed = False
+            for filename in list(self._assets):
+                if filename not in found:
+                    del self._assets[filename]
+                    changed = True
+
+            for filename, (path, mtime, size) in found.items():
+                current = self._assets.get(filename)
+                if current and current.mtime == mtime and current.size == size:
+                    continue
+                try:
+                    asset = await self._probe(filename, path, mtime, size)
+                except Exception as e:
+                    logger.error(f"Не удалось проанализировать фон {path}: {e}")
+                    continue
+                mezzanine_path = self._mezzanine_path(asset)
+                if os.path.exists(mezzanine_path):
+                    asset.mezzanine_path = mezzanine_path
+                self._assets[filename] = asset
+                changed = True
+
+            if changed:
+                logger.info(f"Background index refreshed: {len(self._assets)} assets")
+            return changed
+
+    async def prepare_mezzanines(self):
+        """Готовит версии фонов в 1080x1920, которые еще не подготовлены"""
+        os.makedirs(self.mezzanine_dir, exist_ok=True)
+        for asset in self.list():
+            if asset.mezzanine_path:
+                continue
+            target = self._mezzanine_path(asset)
+            temp_path = f"{target}.tmp.mp4"
+            cmd = [
+                "ffmpeg",
+                "-y",
+                "-i", asset.path,
+                "-vf", f"{NORMALIZE_FILTER},fps=30",
+                "-c:v", "libx264",
+                "-preset", "medium",
+                "-crf", "20",
+                "-pix_fmt", "yuv420p",
+                "-c:a", "aac",
+                "-b:a", "128k",
+                "-movflags", "+faststart",
+                temp_path
+            ]
+            # Через очередь рендеров с низшим приоритетом: не отнимаем ядра у пользователей
+            job = render_scheduler.submit(
+                0, MAINTENANCE_TIER, lambda: run_process(cmd, timeout=config.FFMPEG_TIMEOUT)
+            )
+            try:
+                await job.future
+                os.replace(temp_path, target)
+            except asyncio.CancelledError:
+                job.future.cancel()
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка подготовки фона {asset.filename}: {e}")
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                continue
+            # Файл мог измениться, пока шло перекодирование
+            if self._assets.get(asset.filename) is asset:
+                asset.mezzanine_path = target
+                logger.info(f"Mezzanine ready for {asset.filename}")
+        self._cleanup_mezzanines()
+
+    async def watch(self, interval: int):
+        """Фоновая задача: подготовка фонов и отслеживание изменений"""
+        while True:
+            try:
+                if config.BACKGROUND_MEZZANINE:
+                    await self.prepare_mezzanines()
+                await asyncio.sleep(interval)
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in background library watcher: {e}")
+                await asyncio.sleep(interval)
+
+    def _mezzanine_path(self, asset: BackgroundAsset) -> str:
+        # Расширение в имени: clip.mp4 и clip.mov с одинаковым mtime не должны совпасть
+        stem, ext = os.path.splitext(asset.filename)
+        return os.path.join(self.mezzanine_dir, f"{stem}_{ext.lstrip('.')}_{int(asset.mtime)}.mp4")
+
+    def _cleanup_mezzanines(self):
+        """
+        Удаляет подготовленные версии удаленных или измененных фонов,
+        когда с их замены прошло MEZZANINE_GRACE_PERIOD
+        """
+        actual = {os.path.basename(a.mezzanine_path) for a in self._assets.values() if a.mezzanine_path}
+        now = time.monotonic()
+        stale = set()
+        for filename in os.listdir(self.mezzanine_dir):
+            if filename in actual:
+                continue
+            stale.add(filename)
+            since = self._stale_since.setdefault(filename, now)
+            if now - since < MEZZANINE_GRACE_PERIOD:
+                continue
+            try:
+                os.remove(os.path.join(self.mezzanine_dir, filename))
+                stale.discard(filename)
+            except Exception as e:
+                logger.error(f"Ошибка удаления устаревшего фона {filename}: {e}")
+        self._stale_since = {filename: self._stale_since[filename] for filename in stale}
+
+    async def _probe(self, filename: str, path: str, mtime: float, size: int) -> BackgroundAsset:
+        result = await run_process([
+            "ffprobe", "-v", "error",
+            "-show_entries", "format=duration:stream=codec_type,codec_name,width,height",
+            "-of", "json", path
+        ], timeout=config.FFPROBE_TIMEOUT)
+        info = json.loads(result.stdout or "{}")
+        streams = info.get("streams", [])
+        video = next((s for s in streams if s.get("codec_type") == "video"), {})
+        return BackgroundAsset(
+            filename=filename,
+            name=background_display_name(filename),
+            path=path,
+            mtime=mtime,
+            size=size,
+            duration=float(info.get("format", {}).get("duration") or 0),
+            width=int(video.get("width") or 0),
+            height=int(video.get("height") or 0),
+            codec=video.get("codec_name", ""),
+            has_audio=any(s.get("codec_type") == "audio" for s in streams)
+        )
+
+
+background_library = BackgroundLibrary()
@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardButton
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from config import config
+from services.database import db
+from utils.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Пользователей в пачке; прогресс сохраняется после каждой пачки,
+# поэтому после перезапуска повторно может уйти не больше одной пачки
+BATCH_SIZE = 200
+# Как часто обновлять сообщение с прогрессом (сек)
+PROGRESS_INTERVAL = 5
+# Сколько раз повторять отправку после RetryAfter
+MAX_RETRIES = 3
+
+
+async def send_content(bot: Bot, chat_id: int, content: Dict[str, Any]):
+    """Отправляет сообщение рассылки (текст или медиа с подписью)"""
+    if content["has_media"]:
+        media = content["media_id"]
+        if content["media_type"] == "photo":
+            await bot.send_photo(chat_id=chat_id, photo=media, caption=content["text"])
+        elif content["media_type"] == "video":
+            await bot.send_video(chat_id=chat_id, video=media, caption=content["text"])
+        elif content["media_type"] == "document":
+            await bot.send_document(chat_id=chat_id, document=media, caption=content["text"])
+    else:
+        await bot.send_message(chat_id=chat_id, text=content["text"])
+
+
+class BroadcastService:
+    """Рассылка с общим ограничением частоты и сохранением прогресса в базе"""
+
+    def __init__(self):
+        # Один ограничитель на все рассылки: лимит Telegram общий для бота
+        self.bucket = TokenBucket(config.BROADCAST_RATE, config.BROADCAST_RATE)
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    async def start(self, bot: Bot, chat_id: int, content: Dict[str, Any], filters: Optional[Dict[str, Any]] = None) -> int:
+        """
+        Создает рассылку и запускает ее в фоне; прогресс выводится в chat_id.
+        filters - сегмент получателей (параметры db.iter_users).
+        """
+        filters = filters or {}
+        total = await db.count_users(**filters)
+        progress = await bot.send_message(chat_id, f"🔄 Начинаю рассылку на {total} пользователей...")
+        broadcast_id = await db.create_broadcast(chat_id, progress.message_id, content, filters, total)
+        self._spawn(bot, broadcast_id)
+        return broadcast_id
+
+    async def resume(self, bot: Bot):
+        """Продолжает рассылки, прерванные перезапуском"""
+        for broadcast_id in await db.get_running_broadcasts():
+            logger.info(f"Продолжаем рассылку {broadcast_id}")
+            self._spawn(bot, broadcast_id)
+
+    async def stop(self, broadcast_id: int) -> bool:
+        """Останавливает рассылку; повторно она не возобновится"""
+        stopped = await db.finish_broadcast(broadcast_id, "cancelled")
+        task = self._tasks.get(broadcast_id)
+        if task:
+            task.cancel()
+        return stopped
+
+    async def close(self):
+        """Прерывает рассылки при выключении, они продолжатся после запуска"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _spawn(self, bot: Bot, broadcast_id: int):
+        if broadcast_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(bot, broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def _run(self, bot: Bot, broadcast_id: int):
+        broadcast = await db.get_broadcast(broadcast_id)
+        if not broadcast or broadcast["status"] != "running":
+            return
+
+        content = broadcast["content"]
+        counters = {key: broadcast[key] for key in ("sent", "failed", "blocked")}
+        last_user_id = broadcast["last_user_id"]
+        semaphore = asyncio.Semaphore(config.BROADCAST_CONCURRENCY)
+        started = time.monotonic()
+        processed_at_start = sum(counters.values())
+        reported = started
+
+        try:
+            async for users in db.iter_users(BATCH_SIZE, last_user_id, **broadcast["filters"]):
+                user_ids = [user["user_id"] for user in users]
+                results = await asyncio.gather(
+                    *(self._send(bot, semaphore, user_id, content) for user_id in user_ids)
+                )
+                for result in results:
+                    counters[result] += 1
+                blocked = [user_id for user_id, result in zip(user_ids, results) if result == "blocked"]
+                if blocked:
+                    await db.mark_users_blocked(blocked)
+
+                last_user_id = user_ids[-1]
+                await db.update_broadcast_progress(broadcast_id, last_user_id, **counters)
+
+                if time.monotonic() - reported >= PROGRESS_INTERVAL:
+                    reported = time.monotonic()
+                    rate = (sum(counters.values()) - processed_at_start) / (reported - started)
+                    await self._report(bot, broadcast, counters, rate, finished=False)
+
+            await db.finish_broadcast(broadcast_id, "completed")
+            elapsed = max(time.monotonic() - started, 1e-6)
+            rate = (sum(counters.values()) - processed_at_start) / elapsed
+            await self._report(bot, broadcast, counters, rate, finished=True)
+            logger.info(f"Рассылка {broadcast_id} завершена: {counters}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при рассылке {broadcast_id}: {e}")
+            await db.finish_broadcast(broadcast_id, "failed")
+            try:
+                await bot.send_message(broadcast["chat_id"], f"⚠️ Ошибка при рассылке: {e}")
+            except Exception:
+                pass
+
+    async def _send(self, bot: Bot, semaphore: asyncio.Semaphore, user_id: int, content: Dict[str, Any]) -> str:
+        """Отправляет одному пользователю: sent, blocked или failed"""
+        async with semaphore:
+            for attempt in range(MAX_RETRIES + 1):
+                await self.bucket.acquire()
+                try:
+                    await send_content(bot, user_id, content)
+                    return "sent"
+                except TelegramRetryAfter as e:
+                    # Флуд-контроль общий для бота: останавливаем все отправки
+                    logger.warning(f"Рассылка: RetryAfter {e.retry_after} с")
+                    self.bucket.pause(e.retry_after)
+                except TelegramForbiddenError:
+                    return "blocked"
+                except Exception as e:
+                    logger.warning(f"Ошибка при отправке пользователю {user_id}: {e}")
+                    return "failed"
+            return "failed"
+
+    async def _report(self, bot: Bot, broadcast: Dict[str, Any], counters: Dict[str, int], rate: float, finished: bool):
+        """Обновляет сообщение с прогрессом рассылки"""
+        processed = sum(counters.values())
+        total = max(broadcast["total"], processed)
+        lines = [
+            "✅ Рассылка завершена" if finished else f"🔄 Рассылка: {processed}/{total}",
+            f"👥 Получателей: {total}",
+            f"✔️ Успешно отправлено: {counters['sent']}",
+            f"❌ Не удалось отправить: {counters['failed']}",
+            f"🚫 Заблокировали бота: {counters['blocked']}",
+            f"⚡ Скорость: {rate:.1f} сообщ./с"
+        ]
+        builder = InlineKeyboardBuilder()
+        if not finished:
+            if rate > 0:
+                lines.append(f"⏳ Осталось примерно: {int((total - processed) / rate // 60)} мин")
+            builder.add(InlineKeyboardButton(
+                text="⛔ Остановить",
+                callback_data=f"broadcast_stop_{broadcast['id']}"
+            ))
+
+        try:
+            await bot.edit_message_text(
+                "\n".join(lines),
+                chat_id=broadcast["chat_id"],
+                message_id=broadcast["message_id"],
+                reply_markup=builder.as_markup()
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось обновить прогресс рассылки {broadcast['id']}: {e}")
+            if finished:
+                await bot.send_message(broadcast["chat_id"], "\n".join(lines))
+
+
+broadcast_service = BroadcastService()
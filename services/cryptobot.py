@@ -1,10 +1,19 @@
 import httpx
 import json
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from config import config
 import logging
 from urllib.parse import urlencode
 import asyncio
+import time
+from utils.metrics import Histogram
+from utils.resilience import CircuitOpenError, ResiliencePolicy, breaker_from_config
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
@@ -12,10 +21,60 @@ class CryptoBot:
     def __init__(self):
         self.token = config.CRYPTOBOT_TOKEN
         self.base_url = config.CRYPTOBOT_API_URL
-        self.timeout = 30.0
+        self.timeout = config.CRYPTOBOT_TIMEOUT
         self.retries = 3
         self.retry_delay = 2.0
+        # Параллельность ограничена пулом соединений, поэтому без адаптивного лимита
+        self.resilience = ResiliencePolicy(
+            "cryptobot",
+            breaker=breaker_from_config("cryptobot"),
+            max_tries=self.retries,
+            base_delay=self.retry_delay,
+            retryable=(httpx.TransportError,)
+        )
         self.supported_btn_names = ['viewItem', 'openChannel', 'openBot', 'callback']
+        self.client: Optional[httpx.AsyncClient] = None
+        # Задержка запросов по методам API
+        self.latency: Dict[str, Histogram] = {}
+        self.errors: Dict[str, int] = {}
+
+    async def start(self):
+        """Открывает общий HTTP-клиент с пулом keep-alive соединений"""
+        if self.client is not None and not self.client.is_closed:
+            return
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={
+                "Crypto-Pay-API-Token": self.token,
+                "Accept": "application/json"
+            },
+            timeout=httpx.Timeout(self.timeout, connect=config.CRYPTOBOT_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=config.CRYPTOBOT_MAX_CONNECTIONS,
+                max_keepalive_connections=config.CRYPTOBOT_MAX_CONNECTIONS
+            ),
+            http2=config.CRYPTOBOT_HTTP2 and HTTP2_AVAILABLE
+        )
+        logger.info(f"CryptoBot client started (http2={config.CRYPTOBOT_HTTP2 and HTTP2_AVAILABLE})")
+
+    async def close(self):
+        """Закрытие HTTP-соединений"""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            endpoint: {**histogram.snapshot(), "errors": self.errors.get(endpoint, 0)}
+            for endpoint, histogram in sorted(self.latency.items())
+        }
+
+    def _observe(self, endpoint: str, started: float, failed: bool = False):
+        if endpoint not in self.latency:
+            self.latency[endpoint] = Histogram()
+        self.latency[endpoint].observe(time.monotonic() - started)
+        if failed:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
 
     async def _make_api_request(
         self,
@@ -24,49 +83,50 @@ class CryptoBot:
         params: Optional[Dict[str, Any]] = None
     ) -> Optional[Dict[str, Any]]:
         """Универсальный метод для API запросов с обработкой ошибок"""
-        url = f"{self.base_url}/{endpoint}"
-        headers = {
-            "Crypto-Pay-API-Token": self.token,
-            "Accept": "application/json",
-            "Content-Type": "application/json"
-        }
+        if self.client is None or self.client.is_closed:
+            await self.start()
 
-        for attempt in range(self.retries):
+        attempt = 0
+        while True:
+            attempt += 1
+            started = time.monotonic()
             try:
-                async with httpx.AsyncClient(timeout=self.timeout) as client:
+                async with self.resilience.attempt():
                     if method == "GET":
-                        response = await client.get(
-                            url,
-                            headers=headers,
-                            params=params
-                        )
+                        response = await self.client.get(endpoint, params=params)
                     else:
-                        response = await client.post(
-                            url,
-                            headers=headers,
-                            json=params
-                        )
-
+                        response = await self.client.post(endpoint, json=params)
                     response.raise_for_status()
-                    return response.json()
+
+                self._observe(endpoint, started)
+                return response.json()
+
+            except CircuitOpenError as e:
+                logger.error(f"Request to {endpoint} skipped: {e}")
+                return None
 
             except httpx.HTTPStatusError as e:
-                error_detail = e.response.json() if e.response.content else {}
+                self._observe(endpoint, started, failed=True)
+                error = e
+                try:
+                    error_detail = e.response.json() if e.response.content else {}
+                except ValueError:
+                    error_detail = e.response.text
                 logger.error(
-                    f"Attempt {attempt + 1} failed for {endpoint}: "
+                    f"Attempt {attempt} failed for {endpoint}: "
                     f"{e.response.status_code} - {error_detail}"
                 )
-                if attempt == self.retries - 1 or e.response.status_code in (400, 401, 403, 404):
-                    break
 
             except Exception as e:
-                logger.error(f"Attempt {attempt + 1} failed for {endpoint}: {str(e)}")
-                if attempt == self.retries - 1:
-                    break
-
-            await asyncio.sleep(self.retry_delay * (attempt + 1))
+                self._observe(endpoint, started, failed=True)
+                error = e
+                logger.error(f"Attempt {attempt} failed for {endpoint}: {str(e)}")
 
-        return None
+            # 4xx и ошибки разбора ответа не повторяем
+            if not self.resilience.should_retry(error, attempt):
+                return None
+            self.resilience.retries += 1
+            await asyncio.sleep(self.resilience.retry_delay(error, attempt))
 
     async def get_exchange_rate(self) -> Optional[float]:
         """Получаем курс USDT к RUB"""
@@ -110,13 +170,31 @@ class CryptoBot:
 
     async def check_invoice(self, invoice_id: int) -> Optional[Dict[str, Any]]:
         """Проверяем статус инвойса"""
-        params = {"invoice_ids": invoice_id}
+        invoices = await self.check_invoices([invoice_id])
+        if not invoices:
+            return None
+        return invoices.get(invoice_id)
+
+    async def check_invoices(self, invoice_ids: List[int]) -> Optional[Dict[int, Dict[str, Any]]]:
+        """
+        Статусы нескольких инвойсов одним запросом (не более 1000 за раз).
+        Возвращает словарь invoice_id -> инвойс или None при ошибке запроса.
+        """
+        params = {
+            "invoice_ids": ",".join(str(invoice_id) for invoice_id in invoice_ids),
+            "count": len(invoice_ids)
+        }
         result = await self._make_api_request("GET", "getInvoices", params)
         
-        if result and isinstance(result.get("result"), dict):
-            items = result["result"].get("items", [])
-            if items and isinstance(items, list):
-                return items[0]
-        return None
+        if not result or not isinstance(result.get("result"), dict):
+            return None
+        
+        invoices = {}
+        items = result["result"].get("items", [])
+        if isinstance(items, list):
+            for item in items:
+                if isinstance(item, dict) and "invoice_id" in item:
+                    invoices[int(item["invoice_id"])] = item
+        return invoices
 
 cryptobot = CryptoBot()
\ No newline at end of file
@@ -1,15 +1,28 @@
 import asyncpg
 from asyncpg import Pool, Connection
 from config import config
-from typing import Optional, Dict, Any, Union
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Dict, Any, Tuple, Union
+from utils.cache import TTLCache
+from utils.metrics import Histogram
+import json
 import logging
 import datetime
+import re
+import time
 
 logger = logging.getLogger(__name__)
 
+# Генерации младше этого пересчитываются под блокировкой: более старые уже
+# закоммичены и не меняются, их можно считать без блокировки
+USAGE_REBUILD_TAIL = datetime.timedelta(minutes=5)
+
 class Database:
     def __init__(self):
         self.pool: Optional[Pool] = None
+        # Время ожидания свободного соединения в пуле
+        self.pool_wait = Histogram((0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+        self.profile_cache = TTLCache("profile", config.PROFILE_CACHE_SIZE, config.PROFILE_CACHE_TTL)
 
     async def connect(self):
         """Initialize connection pool"""
@@ -20,8 +33,8 @@ class Database:
                 database=config.POSTGRES_DB,
                 host=config.POSTGRES_HOST,
                 port=config.POSTGRES_PORT,
-                min_size=1,
-                max_size=10
+                min_size=config.DB_POOL_MIN_SIZE,
+                max_size=config.DB_POOL_MAX_SIZE
             )
             await self._init_db()
             logger.info("Database connection established")
@@ -29,26 +42,67 @@ class Database:
             logger.error(f"Database connection failed: {e}")
             raise
     
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[Connection]:
+        """Acquire pooled connection, recording how long it took"""
+        started = time.monotonic()
+        async with self.pool.acquire() as conn:
+            self.pool_wait.observe(time.monotonic() - started)
+            yield conn
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[Connection]:
+        """Acquire connection and run the block in one transaction"""
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                yield conn
+
+    @asynccontextmanager
+    async def _use(self, conn: Optional[Connection]) -> AsyncIterator[Connection]:
+        """Use caller's connection if given, otherwise acquire one from the pool"""
+        if conn is not None:
+            yield conn
+        else:
+            async with self.acquire() as conn:
+                yield conn
+
+    def get_pool_metrics(self) -> Dict[str, Any]:
+        return {
+            "size": self.pool.get_size() if self.pool else 0,
+            "idle": self.pool.get_idle_size() if self.pool else 0,
+            "max_size": config.DB_POOL_MAX_SIZE,
+            "wait_time": self.pool_wait.snapshot()
+        }
+
     async def get_monthly_usage(self, user_id: int) -> int:
         """Get user's generation count for current month"""
-        async with self.pool.acquire() as conn:
-            month_start = datetime.now().replace(day=1).date()
-            return await conn.fetchval(
-                "SELECT COUNT(*) FROM generations WHERE user_id = $1 AND created_at >= $2",
-                user_id, month_start
-            )
+        return (await self.get_usage_counters(user_id))['month']
+
+    async def get_usage_counters(self, user_id: int, conn: Optional[Connection] = None) -> Dict[str, int]:
+        """Get user's generation counters for today, current month and all time"""
+        async with self._use(conn) as conn:
+            row = await conn.fetchrow("""
+                SELECT
+                    COALESCE(SUM(count) FILTER (WHERE period = to_char(LOCALTIMESTAMP, 'YYYY-MM-DD')), 0) AS today,
+                    COALESCE(SUM(count) FILTER (WHERE period = to_char(LOCALTIMESTAMP, 'YYYY-MM')), 0) AS month,
+                    COALESCE(SUM(count) FILTER (WHERE period = 'all'), 0) AS total
+                FROM user_usage
+                WHERE user_id = $1
+                  AND period IN (to_char(LOCALTIMESTAMP, 'YYYY-MM-DD'), to_char(LOCALTIMESTAMP, 'YYYY-MM'), 'all')
+            """, user_id)
+            return {key: int(value) for key, value in row.items()}
 
     async def get_available_credits(self, user_id: int) -> tuple:
         """Get available video credits and subscription info"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             row = await conn.fetchrow(
                 """SELECT 
                     subscription_type, 
                     COALESCE(video_credits, 0) as credits,
-                    (SELECT COUNT(*) FROM generations 
-                    WHERE user_id = $1 AND DATE(created_at) = CURRENT_DATE) as today_count,
-                    (SELECT COUNT(*) FROM generations 
-                    WHERE user_id = $1 AND DATE(created_at) >= DATE_TRUNC('month', CURRENT_DATE)) as month_count
+                    COALESCE((SELECT count FROM user_usage
+                    WHERE user_id = $1 AND period = to_char(LOCALTIMESTAMP, 'YYYY-MM-DD')), 0) as today_count,
+                    COALESCE((SELECT count FROM user_usage
+                    WHERE user_id = $1 AND period = to_char(LOCALTIMESTAMP, 'YYYY-MM')), 0) as month_count
                 FROM users WHERE user_id = $1""",
                 user_id
             )
@@ -56,7 +110,7 @@ class Database:
 
     async def _init_db(self):
        """Initialize database schema"""
-       async with self.pool.acquire() as conn:
+       async with self.acquire() as conn:
             await conn.execute("""
                 CREATE TABLE IF NOT EXISTS users (
                     user_id BIGINT PRIMARY KEY,
@@ -80,35 +134,394 @@ class Database:
                     updated_at TIMESTAMP DEFAULT NOW()
                 );
 
-                CREATE TABLE IF NOT EXISTS generations (
-                    id SERIAL PRIMARY KEY,
+                -- Счетчики генераций: period = 'YYYY-MM-DD', 'YYYY-MM' или 'all'
+                CREATE TABLE IF NOT EXISTS user_usage (
                     user_id BIGINT REFERENCES users(user_id) ON DELETE CASCADE,
-                    prompt TEXT NOT NULL,
-                    script TEXT,
-                    audio_path TEXT,
-                    video_path TEXT,
-                    status TEXT DEFAULT 'pending',
+                    period TEXT NOT NULL,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, period)
+                );
+
+                CREATE TABLE IF NOT EXISTS telegram_file_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    file_id TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT NOW()
+                );
+
+                CREATE TABLE IF NOT EXISTS invoices (
+                    invoice_id BIGINT PRIMARY KEY,
+                    user_id BIGINT REFERENCES users(user_id) ON DELETE CASCADE,
+                    invoice_type TEXT NOT NULL,
+                    plan_id TEXT,
+                    purchase_id TEXT,
+                    amount NUMERIC(18, 2),
+                    status TEXT NOT NULL DEFAULT 'created',
                     created_at TIMESTAMP DEFAULT NOW(),
-                    updated_at TIMESTAMP DEFAULT NOW()
+                    updated_at TIMESTAMP DEFAULT NOW(),
+                    checked_at TIMESTAMP,
+                    completed_at TIMESTAMP
+                );
+
+                CREATE INDEX IF NOT EXISTS idx_invoices_pending ON invoices(created_at)
+                    WHERE status = 'created';
+
+                -- Предрасчитанная статистика для админки (заполняет stats_service)
+                CREATE TABLE IF NOT EXISTS generation_stats_hourly (
+                    hour TIMESTAMP PRIMARY KEY,
+                    generations INTEGER NOT NULL DEFAULT 0,
+                    completed INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    new_users INTEGER NOT NULL DEFAULT 0
                 );
 
-                CREATE INDEX IF NOT EXISTS idx_generations_user_id ON generations(user_id);
-                CREATE INDEX IF NOT EXISTS idx_generations_created_at ON generations(created_at);
+                CREATE TABLE IF NOT EXISTS user_activity_daily (
+                    day DATE NOT NULL,
+                    user_id BIGINT NOT NULL,
+                    PRIMARY KEY (day, user_id)
+                );
+
+                CREATE TABLE IF NOT EXISTS stats_watermarks (
+                    name TEXT PRIMARY KEY,
+                    processed_until TIMESTAMP NOT NULL
+                );
+
+                -- Статистика, которую нельзя собрать из часовых агрегатов (тарифы, ниши)
+                CREATE TABLE IF NOT EXISTS stats_snapshots (
+                    name TEXT PRIMARY KEY,
+                    data JSONB NOT NULL,
+                    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+                );
+
+                CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at);
+
+                -- Пользователи, заблокировавшие бота, пропускаются при рассылках
+                ALTER TABLE users ADD COLUMN IF NOT EXISTS blocked_at TIMESTAMP;
+
+                -- Рассылки: last_user_id - до какого пользователя включительно уже отправлено
+                CREATE TABLE IF NOT EXISTS broadcasts (
+                    id SERIAL PRIMARY KEY,
+                    chat_id BIGINT NOT NULL,
+                    message_id BIGINT,
+                    content JSONB NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'running',
+                    last_user_id BIGINT NOT NULL DEFAULT 0,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    sent INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    blocked INTEGER NOT NULL DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT NOW(),
+                    updated_at TIMESTAMP DEFAULT NOW(),
+                    finished_at TIMESTAMP
+                );
+                -- Сегмент получателей (фильтры iter_users)
+                ALTER TABLE broadcasts ADD COLUMN IF NOT EXISTS filters JSONB NOT NULL DEFAULT '{}';
+
+                -- Ключ постраничного списка пользователей в админке
+                CREATE INDEX IF NOT EXISTS idx_users_username_key
+                    ON users((username IS NULL), COALESCE(username, ''), user_id);
+            """)
+
+            await self._init_generations(conn)
+
+            # Проверка лимитов, списание кредита и запись генерации за один вызов.
+            # Строка пользователя блокируется, поэтому параллельные запросы выполняются по очереди.
+            await conn.execute("""
+                CREATE OR REPLACE FUNCTION reserve_generation(
+                    p_user_id BIGINT,
+                    p_prompt TEXT,
+                    p_limits JSONB
+                ) RETURNS TABLE (generation_id INTEGER, used_credit BOOLEAN, remaining INTEGER) AS $$
+                DECLARE
+                    v_now TIMESTAMP := LOCALTIMESTAMP;
+                    v_tier TEXT;
+                    v_credits INTEGER;
+                    v_today INTEGER;
+                    v_month INTEGER;
+                    v_daily_limit INTEGER;
+                    v_monthly_limit INTEGER;
+                    v_used_credit BOOLEAN := FALSE;
+                    v_generation_id INTEGER;
+                BEGIN
+                    INSERT INTO users (user_id) VALUES (p_user_id) ON CONFLICT (user_id) DO NOTHING;
+
+                    SELECT
+                        CASE WHEN u.subscription_expire < v_now THEN 'free'
+                             ELSE COALESCE(u.subscription_type, 'free') END,
+                        COALESCE(u.video_credits, 0)
+                    INTO v_tier, v_credits
+                    FROM users u WHERE u.user_id = p_user_id
+                    FOR UPDATE;
+
+                    v_daily_limit := COALESCE(p_limits -> v_tier ->> 0, p_limits -> 'free' ->> 0)::INTEGER;
+                    v_monthly_limit := COALESCE(p_limits -> v_tier ->> 1, p_limits -> 'free' ->> 1)::INTEGER;
+
+                    SELECT
+                        COALESCE(SUM(uu.count) FILTER (WHERE uu.period = to_char(v_now, 'YYYY-MM-DD')), 0),
+                        COALESCE(SUM(uu.count) FILTER (WHERE uu.period = to_char(v_now, 'YYYY-MM')), 0)
+                    INTO v_today, v_month
+                    FROM user_usage uu
+                    WHERE uu.user_id = p_user_id
+                      AND uu.period IN (to_char(v_now, 'YYYY-MM-DD'), to_char(v_now, 'YYYY-MM'));
+
+                    IF v_today >= v_daily_limit OR v_month >= v_monthly_limit THEN
+                        IF v_credits <= 0 THEN
+                            RETURN;
+                        END IF;
+                        UPDATE users SET video_credits = video_credits - 1, updated_at = NOW()
+                        WHERE user_id = p_user_id;
+                        v_credits := v_credits - 1;
+                        v_used_credit := TRUE;
+                    END IF;
+
+                    INSERT INTO generations (user_id, prompt, status, created_at)
+                    VALUES (p_user_id, p_prompt, 'processing', v_now)
+                    RETURNING id INTO v_generation_id;
+
+                    INSERT INTO user_usage (user_id, period, count)
+                    SELECT p_user_id, p, 1
+                    FROM unnest(ARRAY[to_char(v_now, 'YYYY-MM-DD'), to_char(v_now, 'YYYY-MM'), 'all']) AS p
+                    ON CONFLICT (user_id, period) DO UPDATE SET count = user_usage.count + 1;
+
+                    RETURN QUERY SELECT
+                        v_generation_id,
+                        v_used_credit,
+                        CASE WHEN v_used_credit THEN v_credits ELSE v_daily_limit - v_today - 1 END;
+                END;
+                $$ LANGUAGE plpgsql;
+            """)
+
+    async def _init_generations(self, conn: Connection):
+        """
+        Create generations partitioned by month. A plain table from older versions is left
+        as is: copying it would block startup, see migrate_generations().
+        """
+        relkind = await conn.fetchval(
+            "SELECT relkind FROM pg_class WHERE oid = to_regclass('generations')"
+        )
+        if relkind == 'r':
+            logger.warning(
+                "generations is not partitioned yet, run "
+                "python -m migrations.partition_generations to migrate it"
+            )
+            return
+        async with conn.transaction():
+            await self._create_generations(conn)
+            await self.ensure_partitions(conn)
+
+    async def _create_generations(self, conn: Connection):
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS generations (
+                id SERIAL,
+                user_id BIGINT REFERENCES users(user_id) ON DELETE CASCADE,
+                prompt TEXT NOT NULL,
+                script TEXT,
+                audio_path TEXT,
+                video_path TEXT,
+                status TEXT DEFAULT 'pending',
+                created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                updated_at TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY (id, created_at)
+            ) PARTITION BY RANGE (created_at);
+
+            -- Страховка на случай, если партиция на месяц не была создана заранее
+            CREATE TABLE IF NOT EXISTS generations_default PARTITION OF generations DEFAULT;
+
+            -- Индексы создаются на всех партициях, в т.ч. будущих.
+            -- Лимиты считаются по диапазону created_at для одного пользователя,
+            -- id добавлен для постраничного просмотра по ключу (created_at, id)
+            CREATE INDEX IF NOT EXISTS idx_generations_user_created_id ON generations(user_id, created_at, id);
+            CREATE INDEX IF NOT EXISTS idx_generations_created_id ON generations(created_at, id);
+            -- Смена статуса после агрегации часа (stats_service.refresh_statuses)
+            CREATE INDEX IF NOT EXISTS idx_generations_updated_at ON generations(updated_at);
+            DROP INDEX IF EXISTS idx_generations_user_created;
+            DROP INDEX IF EXISTS idx_generations_created_at;
+        """)
+
+    async def migrate_generations(self, batch_size: int = 10000) -> int:
+        """
+        Move a plain generations table from older versions into the partitioned one.
+        The swap is a short transaction, then rows are copied in batches while the bot
+        keeps writing new generations; an interrupted run continues where it stopped.
+        Returns the number of rows moved.
+        """
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                relkind = await conn.fetchval(
+                    "SELECT relkind FROM pg_class WHERE oid = to_regclass('generations')"
+                )
+                if relkind == 'r':
+                    logger.info("Swapping generations for a partitioned table")
+                    await conn.execute("LOCK TABLE generations IN ACCESS EXCLUSIVE MODE")
+                    await conn.execute("ALTER TABLE generations RENAME TO generations_legacy")
+                    await self._create_generations(conn)
+                    start = await conn.fetchval("SELECT MIN(created_at) FROM generations_legacy")
+                    await self.ensure_partitions(conn, start)
+                    # Новые генерации получают id после перенесенных
+                    await conn.execute("""
+                        SELECT setval(
+                            pg_get_serial_sequence('generations', 'id'),
+                            COALESCE((SELECT MAX(id) FROM generations_legacy), 0) + 1,
+                            false
+                        )
+                    """)
+                elif await conn.fetchval("SELECT to_regclass('generations_legacy') IS NULL"):
+                    logger.info("generations is already partitioned")
+                    return 0
+
+            moved = 0
+            while True:
+                async with conn.transaction():
+                    batch = await conn.fetchval("""
+                        WITH batch AS (
+                            DELETE FROM generations_legacy
+                            WHERE id IN (SELECT id FROM generations_legacy ORDER BY id LIMIT $1)
+                            RETURNING *
+                        ), inserted AS (
+                            INSERT INTO generations (
+                                id, user_id, prompt, script, audio_path, video_path, status, created_at, updated_at
+                            )
+                            SELECT
+                                id, user_id, prompt, script, audio_path, video_path, status,
+                                COALESCE(created_at, NOW()), updated_at
+                            FROM batch
+                            RETURNING 1
+                        )
+                        SELECT COUNT(*) FROM inserted
+                    """, batch_size)
+                if not batch:
+                    break
+                moved += batch
+                logger.info(f"Moved {moved} generations")
+
+            await conn.execute("DROP TABLE generations_legacy")
+            logger.info(f"generations migration finished: {moved} rows moved")
+            return moved
+
+    @staticmethod
+    def _month_start(value: datetime.date, shift: int = 0) -> datetime.date:
+        month = value.year * 12 + value.month - 1 + shift
+        return datetime.date(month // 12, month % 12 + 1, 1)
+
+    async def ensure_partitions(
+        self,
+        conn: Optional[Connection] = None,
+        start: Optional[datetime.datetime] = None
+    ) -> int:
+        """
+        Create monthly partitions of generations from start (default: current month)
+        up to GENERATIONS_PARTITIONS_AHEAD months ahead. Returns number of partitions created.
+        Rows of a new month already in generations_default are moved into its partition.
+        """
+        today = datetime.date.today()
+        month = self._month_start(start or today)
+        last = self._month_start(today, config.GENERATIONS_PARTITIONS_AHEAD)
+        created = 0
+        async with self._use(conn) as conn:
+            relkind = await conn.fetchval(
+                "SELECT relkind FROM pg_class WHERE oid = to_regclass('generations')"
+            )
+            if relkind != 'p':
+                return 0
+            while month <= last:
+                next_month = self._month_start(month, 1)
+                name = f"generations_{month:%Y_%m}"
+                exists = await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", name)
+                if not exists:
+                    try:
+                        async with conn.transaction():
+                            await self._create_partition(conn, name, month, next_month)
+                        created += 1
+                    except asyncpg.PostgresError as e:
+                        logger.error(f"Failed to create partition {name}: {e}")
+                month = next_month
+        if created:
+            logger.info(f"Created {created} generations partitions")
+        return created
+
+    async def _create_partition(
+        self,
+        conn: Connection,
+        name: str,
+        month: datetime.date,
+        next_month: datetime.date
+    ):
+        bounds = f"FOR VALUES FROM ('{month}') TO ('{next_month}')"
+        in_default = await conn.fetchval("""
+            SELECT EXISTS (
+                SELECT 1 FROM generations_default WHERE created_at >= $1 AND created_at < $2
+            )
+        """, month, next_month)
+        if not in_default:
+            await conn.execute(f"CREATE TABLE {name} PARTITION OF generations {bounds}")
+            return
+
+        # Партицию нельзя создать, пока строки ее месяца лежат в generations_default:
+        # отсоединяем default, переносим их и подключаем обратно в той же транзакции
+        logger.warning(f"Moving rows for {month:%Y-%m} out of generations_default")
+        await conn.execute("ALTER TABLE generations DETACH PARTITION generations_default")
+        await conn.execute(f"CREATE TABLE {name} PARTITION OF generations {bounds}")
+        await conn.execute(f"""
+            WITH moved AS (
+                DELETE FROM generations_default WHERE created_at >= $1 AND created_at < $2
+                RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        """, month, next_month)
+        await conn.execute("ALTER TABLE generations ATTACH PARTITION generations_default DEFAULT")
+
+    async def apply_generations_retention(self, months: int, mode: str = "detach") -> list:
+        """
+        Remove generations partitions older than `months` full months.
+        mode "detach" keeps them as standalone generations_archive_* tables, "drop" deletes them.
+        """
+        if months <= 0:
+            return []
+        cutoff = self._month_start(datetime.date.today(), -months)
+        removed = []
+        async with self.acquire() as conn:
+            partitions = await conn.fetch("""
+                SELECT c.relname
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'generations'::regclass
             """)
+            for row in partitions:
+                match = re.fullmatch(r"generations_(\d{4})_(\d{2})", row['relname'])
+                if not match:
+                    continue
+                month = datetime.date(int(match.group(1)), int(match.group(2)), 1)
+                if month >= cutoff:
+                    continue
+                name = row['relname']
+                async with conn.transaction():
+                    await conn.execute(f"ALTER TABLE generations DETACH PARTITION {name}")
+                    if mode == "drop":
+                        await conn.execute(f"DROP TABLE {name}")
+                    else:
+                        await conn.execute(
+                            f"ALTER TABLE {name} RENAME TO generations_archive_{month:%Y_%m}"
+                        )
+                removed.append(name)
+        if removed:
+            logger.info(f"Generations retention ({mode}): {', '.join(sorted(removed))}")
+        return removed
 
     async def get_user_usage(self, user_id: int, date: str = None) -> int:
         """Get user's generation count for current day"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             query = """
-                SELECT COUNT(*) FROM generations 
-                WHERE user_id = $1::bigint 
-                AND created_at::date = COALESCE($2::date, CURRENT_DATE)
+                SELECT COALESCE(
+                    (SELECT count FROM user_usage
+                     WHERE user_id = $1::bigint
+                     AND period = to_char(COALESCE($2::date, CURRENT_DATE), 'YYYY-MM-DD')),
+                    0
+                )
             """
             return await conn.fetchval(query, user_id, date)
 
-    async def add_video_credits(self, user_id: int, amount: int) -> bool:
+    async def add_video_credits(self, user_id: int, amount: int, conn: Optional[Connection] = None) -> bool:
         """Add video credits to user"""
-        async with self.pool.acquire() as conn:
+        async with self._use(conn) as conn:
             await conn.execute("""
                 INSERT INTO users (user_id, video_credits)
                 VALUES ($1, $2)
@@ -118,10 +531,10 @@ class Database:
             """, user_id, amount)
             return True
 
-    async def use_video_credit(self, user_id: int) -> bool:
+    async def use_video_credit(self, user_id: int, conn: Optional[Connection] = None) -> bool:
         """Use one video credit"""
-        async with self.pool.acquire() as conn:
-            result = await conn.execute("""
+        async with self._use(conn) as conn:
+            result = await conn.fetchval("""
                 UPDATE users 
                 SET video_credits = video_credits - 1 
                 WHERE user_id = $1 AND video_credits > 0
@@ -129,42 +542,61 @@ class Database:
             """, user_id)
             return bool(result)
 
-    async def get_video_credits(self, user_id: int) -> int:
+    async def get_video_credits(self, user_id: int, conn: Optional[Connection] = None) -> int:
         """Get available video credits count"""
-        async with self.pool.acquire() as conn:
+        async with self._use(conn) as conn:
             return await conn.fetchval("""
                 SELECT COALESCE(video_credits, 0) FROM users WHERE user_id = $1
             """, user_id)
 
-    async def get_user_subscription(self, user_id: int) -> str:
+    async def get_user_subscription(self, user_id: int, conn: Optional[Connection] = None) -> str:
         """Get user's subscription type"""
-        async with self.pool.acquire() as conn:
+        async with self._use(conn) as conn:
             return await conn.fetchval(
                 "SELECT subscription_type FROM users WHERE user_id = $1::bigint", 
                 user_id
             )
 
+    async def get_effective_tier(self, user_id: int, conn: Optional[Connection] = None) -> str:
+        """Get the tier limits apply to: 'free' once the subscription has expired"""
+        async with self._use(conn) as conn:
+            tier = await conn.fetchval("""
+                SELECT CASE WHEN subscription_expire < LOCALTIMESTAMP THEN 'free'
+                            ELSE COALESCE(subscription_type, 'free') END
+                FROM users WHERE user_id = $1::bigint
+            """, user_id)
+            return tier or 'free'
+
     async def create_user(
         self,
         user_id: int,
         username: Optional[str] = None,
-        full_name: Optional[str] = None
+        full_name: Optional[str] = None,
+        conn: Optional[Connection] = None
     ) -> bool:
         """Create or update basic user record with all available info"""
-        async with self.pool.acquire() as conn:
+        async with self._use(conn) as conn:
             await conn.execute("""
                 INSERT INTO users (user_id, username, full_name)
                 VALUES ($1::bigint, $2::text, $3::text)
                 ON CONFLICT (user_id) DO UPDATE SET
                     username = COALESCE(EXCLUDED.username, users.username),
                     full_name = COALESCE(EXCLUDED.full_name, users.full_name),
+                    blocked_at = NULL,
                     updated_at = NOW()
             """, user_id, username, full_name)
             return True
 
-    async def get_user_profile(self, user_id: int) -> Optional[Dict[str, Any]]:
-        """Get user profile data"""
-        async with self.pool.acquire() as conn:
+    async def get_user_profile(self, user_id: int, conn: Optional[Connection] = None) -> Optional[Dict[str, Any]]:
+        """Get user profile data (cached)"""
+        profile = await self.profile_cache.get_or_load(
+            user_id,
+            lambda: self._load_user_profile(user_id, conn)
+        )
+        return dict(profile) if profile else None
+
+    async def _load_user_profile(self, user_id: int, conn: Optional[Connection] = None) -> Optional[Dict[str, Any]]:
+        async with self._use(conn) as conn:
             row = await conn.fetchrow(
                 "SELECT * FROM user_profiles WHERE user_id = $1::bigint", 
                 user_id
@@ -174,54 +606,175 @@ class Database:
     async def save_user_profile(
         self,
         user_id: int,
-        profile_data: Dict[str, Any]
+        profile_data: Dict[str, Any],
+        conn: Optional[Connection] = None
     ) -> bool:
         """Save or update user profile"""
-        async with self.pool.acquire() as conn:
-            await self.create_user(user_id)
-            
-            await conn.execute("""
-                INSERT INTO user_profiles (
-                    user_id, niche, content_style, goals, tone_of_voice, target_audience
-                ) VALUES (
-                    $1::bigint, $2::text, $3::text, $4::text, $5::text, $6::text
-                ) ON CONFLICT (user_id) DO UPDATE SET
-                    niche = EXCLUDED.niche,
-                    content_style = EXCLUDED.content_style,
-                    goals = EXCLUDED.goals,
-                    tone_of_voice = EXCLUDED.tone_of_voice,
-                    target_audience = EXCLUDED.target_audience,
-                    updated_at = NOW()
-            """, 
-                user_id,
-                profile_data.get("niche"),
-                profile_data.get("content_style"),
-                profile_data.get("goals"),
-                profile_data.get("tone_of_voice"),
-                profile_data.get("target_audience")
-            )
-            return True
+        async with self._use(conn) as conn:
+            async with conn.transaction():
+                await self.create_user(user_id, conn=conn)
+                
+                await conn.execute("""
+                    INSERT INTO user_profiles (
+                        user_id, niche, content_style, goals, tone_of_voice, target_audience
+                    ) VALUES (
+                        $1::bigint, $2::text, $3::text, $4::text, $5::text, $6::text
+                    ) ON CONFLICT (user_id) DO UPDATE SET
+                        niche = EXCLUDED.niche,
+                        content_style = EXCLUDED.content_style,
+                        goals = EXCLUDED.goals,
+                        tone_of_voice = EXCLUDED.tone_of_voice,
+                        target_audience = EXCLUDED.target_audience,
+                        updated_at = NOW()
+                """, 
+                    user_id,
+                    profile_data.get("niche"),
+                    profile_data.get("content_style"),
+                    profile_data.get("goals"),
+                    profile_data.get("tone_of_voice"),
+                    profile_data.get("target_audience")
+                )
+        await self.profile_cache.invalidate(user_id)
+        return True
 
     async def log_generation(
         self,
         user_id: int,
         prompt: str,
-        status: str = "pending"
+        status: str = "pending",
+        conn: Optional[Connection] = None
     ) -> int:
-        """Log generation request and return generation ID"""
-        async with self.pool.acquire() as conn:
-            await self.create_user(user_id)
-            
+        """Log generation request, update usage counters and return generation ID"""
+        async with self._use(conn) as conn:
             try:
-                return await conn.fetchval("""
-                    INSERT INTO generations (user_id, prompt, status)
-                    VALUES ($1::bigint, $2::text, $3::text)
-                    RETURNING id
-                """, user_id, str(prompt), status)
+                async with conn.transaction():
+                    await self.create_user(user_id, conn=conn)
+                    row = await conn.fetchrow("""
+                        INSERT INTO generations (user_id, prompt, status)
+                        VALUES ($1::bigint, $2::text, $3::text)
+                        RETURNING id, created_at
+                    """, user_id, str(prompt), status)
+                    await conn.execute("""
+                        INSERT INTO user_usage (user_id, period, count)
+                        SELECT $1::bigint, period, 1
+                        FROM unnest(ARRAY[
+                            to_char($2::timestamp, 'YYYY-MM-DD'),
+                            to_char($2::timestamp, 'YYYY-MM'),
+                            'all'
+                        ]) AS period
+                        ON CONFLICT (user_id, period) DO UPDATE SET
+                            count = user_usage.count + 1
+                    """, user_id, row['created_at'])
+                    return row['id']
             except Exception as e:
                 logger.error(f"Failed to log generation: {e}")
                 raise Exception(f"Database error: {e}")
 
+    async def reserve_generation(
+        self,
+        user_id: int,
+        prompt: str,
+        conn: Optional[Connection] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Check limits, use a credit if needed and log the generation in one round trip.
+        Returns generation_id, used_credit and remaining, or None if limits and credits are exhausted.
+        """
+        limits = {
+            "free": [config.FREE_DAILY_LIMIT, config.FREE_MONTHLY_LIMIT],
+            "lite": [config.LITE_DAILY_LIMIT, config.LITE_MONTHLY_LIMIT],
+            "premium": [config.PREMIUM_DAILY_LIMIT, config.PREMIUM_MONTHLY_LIMIT]
+        }
+        async with self._use(conn) as conn:
+            row = await conn.fetchrow(
+                "SELECT * FROM reserve_generation($1::bigint, $2::text, $3::jsonb)",
+                user_id, str(prompt), json.dumps(limits)
+            )
+            return dict(row) if row else None
+
+    async def has_usage_counters(self) -> bool:
+        """Check if usage counters were ever built"""
+        async with self.acquire() as conn:
+            return await conn.fetchval("SELECT EXISTS (SELECT 1 FROM user_usage)")
+
+    async def rebuild_usage_counters(self, full: bool = False) -> int:
+        """
+        Rebuild usage counters from generations and return the number of corrected rows.
+        By default only the current month is recounted; full=True recounts every month
+        still in generations (months already removed by retention are kept as is).
+        Daily counters are kept for the current month only, older ones are never read,
+        and the all-time counter is the sum of monthly ones.
+        """
+        async with self.acquire() as conn:
+            month_start, tail_start = await conn.fetchrow("""
+                SELECT date_trunc('month', LOCALTIMESTAMP), LOCALTIMESTAMP - $1::interval
+            """, USAGE_REBUILD_TAIL)
+            scan_from = datetime.datetime.min if full else month_start
+            first_month = await conn.fetchval("""
+                SELECT to_char(COALESCE(MIN(created_at), LOCALTIMESTAMP), 'YYYY-MM')
+                FROM generations WHERE created_at >= $1
+            """, scan_from)
+            counts_query = """
+                SELECT user_id, to_char(created_at, 'YYYY-MM-DD') AS period, COUNT(*)::int AS count
+                FROM generations
+                WHERE created_at >= GREATEST($1::timestamp, $3::timestamp) AND created_at < $2
+                GROUP BY 1, 2
+                UNION ALL
+                SELECT user_id, to_char(created_at, 'YYYY-MM'), COUNT(*)::int
+                FROM generations
+                WHERE created_at >= $1 AND created_at < $2
+                GROUP BY 1, 2
+            """
+            try:
+                # Основной подсчет идет без блокировок, свежие записи досчитываются под блокировкой
+                await conn.execute("DROP TABLE IF EXISTS usage_rebuild")
+                await conn.execute(
+                    f"CREATE TEMP TABLE usage_rebuild AS {counts_query}",
+                    scan_from, tail_start, month_start
+                )
+                async with conn.transaction():
+                    # Блокирует log_generation только на время сверки, чтобы не потерять инкременты
+                    await conn.execute("LOCK TABLE user_usage IN EXCLUSIVE MODE")
+                    await conn.execute(
+                        f"INSERT INTO usage_rebuild {counts_query}",
+                        max(tail_start, scan_from), datetime.datetime.max, month_start
+                    )
+                    await conn.execute("""
+                        INSERT INTO usage_rebuild (user_id, period, count)
+                        SELECT user_id, 'all', SUM(count)
+                        FROM (
+                            SELECT user_id, count FROM user_usage
+                            WHERE length(period) = 7 AND period < $1
+                            UNION ALL
+                            SELECT user_id, count FROM usage_rebuild
+                            WHERE length(period) = 7
+                        ) months
+                        GROUP BY user_id
+                    """, first_month)
+                    deleted = await conn.execute("""
+                        DELETE FROM user_usage uu
+                        WHERE (uu.period = 'all'
+                               OR length(uu.period) = 10
+                               OR (length(uu.period) = 7 AND uu.period >= $1))
+                          AND NOT EXISTS (
+                              SELECT 1 FROM usage_rebuild r
+                              WHERE r.user_id = uu.user_id AND r.period = uu.period
+                          )
+                    """, first_month)
+                    updated = await conn.execute("""
+                        INSERT INTO user_usage (user_id, period, count)
+                        SELECT user_id, period, SUM(count)
+                        FROM usage_rebuild
+                        GROUP BY user_id, period
+                        ON CONFLICT (user_id, period) DO UPDATE SET count = EXCLUDED.count
+                        WHERE user_usage.count <> EXCLUDED.count
+                    """)
+            finally:
+                await conn.execute("DROP TABLE IF EXISTS usage_rebuild")
+            corrected = int(deleted.split()[-1]) + int(updated.split()[-1])
+            logger.info(f"Usage counters rebuilt since {first_month}: {corrected} rows corrected")
+            return corrected
+
     async def update_generation(
         self,
         generation_id: int,
@@ -263,7 +816,7 @@ class Database:
             WHERE id = ${param_count}::integer
         """
         
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             try:
                 await conn.execute(query, *params)
                 return True
@@ -271,4 +824,379 @@ class Database:
                 logger.error(f"Failed to update generation: {e}")
                 raise Exception(f"Database error: {e}")
 
+    async def get_users_page(
+        self,
+        cursor: Optional[Tuple[bool, str, int]] = None,
+        backward: bool = False,
+        limit: int = 25
+    ) -> Tuple[list, bool]:
+        """
+        Get a page of users ordered by (username IS NULL, username, user_id).
+        cursor is the key of the last shown row (the first one when going backward).
+        Returns the rows in display order and whether more rows exist in that direction.
+        """
+        condition = ""
+        params = [limit + 1]
+        if cursor is not None:
+            operator = "<" if backward else ">"
+            condition = f"WHERE (username IS NULL, COALESCE(username, ''), user_id) {operator} ($2, $3, $4)"
+            params.extend(cursor)
+        order = "DESC" if backward else "ASC"
+
+        async with self.acquire() as conn:
+            rows = await conn.fetch(f"""
+                SELECT user_id, username, full_name
+                FROM users
+                {condition}
+                ORDER BY username IS NULL {order}, COALESCE(username, '') {order}, user_id {order}
+                LIMIT $1
+            """, *params)
+
+        rows = [dict(row) for row in rows]
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backward:
+            rows.reverse()
+        return rows, has_more
+
+    @staticmethod
+    def _segment_conditions(
+        params: list,
+        subscription_types: Optional[list] = None,
+        active_days: Optional[int] = None,
+        niche: Optional[str] = None,
+        include_blocked: bool = False
+    ) -> list:
+        """SQL conditions on users u for a user segment, appending values to params"""
+        conditions = []
+        if not include_blocked:
+            conditions.append("u.blocked_at IS NULL")
+        if subscription_types:
+            params.append(list(subscription_types))
+            conditions.append(f"u.subscription_type = ANY(${len(params)}::text[])")
+        if active_days:
+            params.append(active_days)
+            conditions.append(f"""EXISTS (
+                SELECT 1 FROM generations g
+                WHERE g.user_id = u.user_id AND g.created_at >= LOCALTIMESTAMP - make_interval(days => ${len(params)})
+            )""")
+        if niche:
+            params.append(niche)
+            conditions.append(f"""EXISTS (
+                SELECT 1 FROM user_profiles p
+                WHERE p.user_id = u.user_id AND lower(p.niche) = lower(${len(params)})
+            )""")
+        return conditions
+
+    async def count_users(self, **segment) -> int:
+        """Count users in a segment (same filters as iter_users)"""
+        params = []
+        conditions = self._segment_conditions(params, **segment)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        async with self.acquire() as conn:
+            return await conn.fetchval(f"SELECT COUNT(*) FROM users u {where}", *params)
+
+    async def iter_users(
+        self,
+        batch_size: int = 1000,
+        after_user_id: int = 0,
+        **segment
+    ) -> AsyncIterator[list]:
+        """
+        Iterate over users in user_id order, yielding batches of dicts.
+        Uses keyset batches instead of a server-side cursor, so no connection
+        or transaction is held while the caller processes a batch.
+        segment: subscription_types, active_days, niche, include_blocked.
+        """
+        last_user_id = after_user_id
+        while True:
+            params = [last_user_id, batch_size]
+            conditions = ["u.user_id > $1"] + self._segment_conditions(params, **segment)
+            async with self.acquire() as conn:
+                rows = await conn.fetch(f"""
+                    SELECT u.user_id, u.username, u.full_name, u.subscription_type, u.subscription_expire
+                    FROM users u
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY u.user_id
+                    LIMIT $2
+                """, *params)
+            if not rows:
+                return
+            yield [dict(row) for row in rows]
+            if len(rows) < batch_size:
+                return
+            last_user_id = rows[-1]['user_id']
+
+    async def get_generations_page(
+        self,
+        user_id: Optional[int] = None,
+        cursor: Optional[Tuple[datetime.datetime, int]] = None,
+        backward: bool = False,
+        limit: int = 10
+    ) -> Tuple[list, bool]:
+        """
+        Get a page of generations, newest first, optionally for one user.
+        cursor is the (created_at, id) of the last shown row (the first one when going backward).
+        Returns the rows in display order and whether more rows exist in that direction.
+        """
+        conditions = []
+        params = [limit + 1]
+        if user_id is not None:
+            params.append(user_id)
+            conditions.append(f"g.user_id = ${len(params)}")
+        if cursor is not None:
+            operator = ">" if backward else "<"
+            params.extend(cursor)
+            conditions.append(f"(g.created_at, g.id) {operator} (${len(params) - 1}, ${len(params)})")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        order = "ASC" if backward else "DESC"
+
+        async with self.acquire() as conn:
+            rows = await conn.fetch(f"""
+                SELECT
+                    g.id,
+                    g.user_id,
+                    u.username,
+                    g.status,
+                    g.created_at,
+                    g.updated_at,
+                    LENGTH(g.script) as script_length,
+                    g.audio_path IS NOT NULL as has_audio,
+                    g.video_path IS NOT NULL as has_video
+                FROM generations g
+                LEFT JOIN users u ON g.user_id = u.user_id
+                {where}
+                ORDER BY g.created_at {order}, g.id {order}
+                LIMIT $1
+            """, *params)
+
+        rows = [dict(row) for row in rows]
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backward:
+            rows.reverse()
+        return rows, has_more
+
+    async def get_cached_file_id(self, cache_key: str) -> Optional[str]:
+        """Get Telegram file_id for previously uploaded file"""
+        async with self.acquire() as conn:
+            return await conn.fetchval(
+                "SELECT file_id FROM telegram_file_cache WHERE cache_key = $1",
+                cache_key
+            )
+
+    async def save_cached_file_id(self, cache_key: str, file_id: str) -> bool:
+        """Remember Telegram file_id for uploaded file"""
+        async with self.acquire() as conn:
+            await conn.execute("""
+                INSERT INTO telegram_file_cache (cache_key, file_id)
+                VALUES ($1, $2)
+                ON CONFLICT (cache_key) DO UPDATE SET
+                    file_id = EXCLUDED.file_id,
+                    created_at = NOW()
+            """, cache_key, file_id)
+            return True
+
+    async def delete_cached_file_id(self, cache_key: str) -> bool:
+        """Forget Telegram file_id (e.g. when Telegram rejects it)"""
+        async with self.acquire() as conn:
+            await conn.execute(
+                "DELETE FROM telegram_file_cache WHERE cache_key = $1",
+                cache_key
+            )
+            return True
+
+    async def create_invoice(
+        self,
+        invoice_id: int,
+        user_id: int,
+        invoice_type: str,
+        amount: float,
+        plan_id: Optional[str] = None,
+        purchase_id: Optional[str] = None
+    ) -> bool:
+        """Save created CryptoBot invoice"""
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    "INSERT INTO users (user_id) VALUES ($1) ON CONFLICT (user_id) DO NOTHING",
+                    user_id
+                )
+                await conn.execute("""
+                    INSERT INTO invoices (invoice_id, user_id, invoice_type, plan_id, purchase_id, amount)
+                    VALUES ($1, $2, $3, $4, $5, $6)
+                    ON CONFLICT (invoice_id) DO NOTHING
+                """, invoice_id, user_id, invoice_type, plan_id, purchase_id, amount)
+            return True
+
+    async def get_invoice(self, invoice_id: int) -> Optional[Dict[str, Any]]:
+        """Get invoice by CryptoBot invoice ID"""
+        async with self.acquire() as conn:
+            row = await conn.fetchrow(
+                "SELECT * FROM invoices WHERE invoice_id = $1",
+                invoice_id
+            )
+            return dict(row) if row else None
+
+    async def get_pending_invoices(self, min_interval: int, max_interval: int) -> list:
+        """
+        Get unpaid invoices that are due for a status check.
+        Each invoice is rechecked after a tenth of its age, clamped to [min_interval, max_interval] seconds.
+        """
+        async with self.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT * FROM invoices
+                WHERE status = 'created'
+                  AND (
+                      checked_at IS NULL
+                      OR checked_at <= NOW() - LEAST(
+                          GREATEST((NOW() - created_at) / 10, make_interval(secs => $1)),
+                          make_interval(secs => $2)
+                      )
+                  )
+                ORDER BY created_at
+            """, min_interval, max_interval)
+            return [dict(row) for row in rows]
+
+    async def mark_invoices_checked(self, invoice_ids: list) -> None:
+        """Remember when invoice statuses were last polled"""
+        async with self.acquire() as conn:
+            await conn.execute(
+                "UPDATE invoices SET checked_at = NOW() WHERE invoice_id = ANY($1::bigint[])",
+                invoice_ids
+            )
+
+    async def expire_invoices(self, invoice_ids: list) -> None:
+        """Mark unpaid invoices as expired"""
+        async with self.acquire() as conn:
+            await conn.execute("""
+                UPDATE invoices SET status = 'expired', updated_at = NOW()
+                WHERE invoice_id = ANY($1::bigint[]) AND status = 'created'
+            """, invoice_ids)
+
+    async def expire_stale_invoices(self, max_age_hours: int) -> int:
+        """Stop polling invoices older than max_age_hours"""
+        async with self.acquire() as conn:
+            rows = await conn.fetch("""
+                UPDATE invoices SET status = 'expired', updated_at = NOW()
+                WHERE status = 'created' AND created_at < NOW() - make_interval(hours => $1)
+                RETURNING invoice_id
+            """, max_age_hours)
+            return len(rows)
+
+    async def complete_invoice(
+        self,
+        invoice_id: int,
+        video_credits: int = 0,
+        subscription_type: Optional[str] = None,
+        duration_days: Optional[int] = None
+    ) -> Optional[int]:
+        """
+        Mark invoice as completed and credit the user in one transaction.
+        Returns user_id if this call completed the invoice, None if it was already processed.
+        """
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                user_id = await conn.fetchval("""
+                    UPDATE invoices SET
+                        status = 'completed',
+                        completed_at = NOW(),
+                        updated_at = NOW()
+                    WHERE invoice_id = $1 AND status <> 'completed'
+                    RETURNING user_id
+                """, invoice_id)
+
+                if user_id is None:
+                    return None
+
+                if video_credits:
+                    await conn.execute("""
+                        UPDATE users SET
+                            video_credits = COALESCE(video_credits, 0) + $2,
+                            updated_at = NOW()
+                        WHERE user_id = $1
+                    """, user_id, video_credits)
+
+                if subscription_type:
+                    await conn.execute("""
+                        UPDATE users SET
+                            subscription_type = $2,
+                            subscription_expire = LOCALTIMESTAMP + make_interval(days => $3),
+                            updated_at = NOW()
+                        WHERE user_id = $1
+                    """, user_id, subscription_type, duration_days)
+
+                logger.info(f"Invoice {invoice_id} completed for user {user_id}")
+                return user_id
+
+    async def create_broadcast(
+        self,
+        chat_id: int,
+        message_id: int,
+        content: Dict[str, Any],
+        filters: Dict[str, Any],
+        total: int
+    ) -> int:
+        """Create a running broadcast and return its id"""
+        async with self.acquire() as conn:
+            return await conn.fetchval("""
+                INSERT INTO broadcasts (chat_id, message_id, content, filters, total)
+                VALUES ($1, $2, $3::jsonb, $4::jsonb, $5)
+                RETURNING id
+            """, chat_id, message_id, json.dumps(content), json.dumps(filters), total)
+
+    async def get_broadcast(self, broadcast_id: int) -> Optional[Dict[str, Any]]:
+        """Get broadcast with decoded content"""
+        async with self.acquire() as conn:
+            row = await conn.fetchrow("SELECT * FROM broadcasts WHERE id = $1", broadcast_id)
+            if not row:
+                return None
+            broadcast = dict(row)
+            broadcast['content'] = json.loads(broadcast['content'])
+            broadcast['filters'] = json.loads(broadcast['filters'])
+            return broadcast
+
+    async def get_running_broadcasts(self) -> list:
+        """Get ids of broadcasts interrupted by a restart"""
+        async with self.acquire() as conn:
+            rows = await conn.fetch("SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id")
+            return [row['id'] for row in rows]
+
+    async def update_broadcast_progress(
+        self,
+        broadcast_id: int,
+        last_user_id: int,
+        sent: int,
+        failed: int,
+        blocked: int
+    ) -> None:
+        """Save broadcast position and counters after a finished batch"""
+        async with self.acquire() as conn:
+            await conn.execute("""
+                UPDATE broadcasts SET
+                    last_user_id = $2,
+                    sent = $3,
+                    failed = $4,
+                    blocked = $5,
+                    updated_at = NOW()
+                WHERE id = $1
+            """, broadcast_id, last_user_id, sent, failed, blocked)
+
+    async def finish_broadcast(self, broadcast_id: int, status: str) -> bool:
+        """Move a running broadcast to its final status"""
+        async with self.acquire() as conn:
+            result = await conn.execute("""
+                UPDATE broadcasts SET status = $2, finished_at = NOW(), updated_at = NOW()
+                WHERE id = $1 AND status = 'running'
+            """, broadcast_id, status)
+            return result != "UPDATE 0"
+
+    async def mark_users_blocked(self, user_ids: list) -> None:
+        """Remember users who blocked the bot"""
+        async with self.acquire() as conn:
+            await conn.execute(
+                "UPDATE users SET blocked_at = NOW() WHERE user_id = ANY($1::bigint[])",
+                user_ids
+            )
+
 db = Database()
\ No newline at end of file
@@ -1,9 +1,10 @@
 import openai
-from openai import AsyncOpenAI, APIError
+from openai import AsyncOpenAI, APIError, APIConnectionError
 from config import config
-from typing import Optional, Dict, Any
+from typing import AsyncIterator, Optional, Dict, Any, List
+import asyncio
 import logging
-import backoff
+from utils.resilience import AIMDLimiter, ResiliencePolicy, breaker_from_config
 
 logger = logging.getLogger(__name__)
 
@@ -12,16 +13,22 @@ class GPTService:
         self.client = AsyncOpenAI(
             api_key=config.OPENAI_API_KEY,
             base_url=config.OPENAI_BASE_URL,
-            timeout=config.REQUEST_TIMEOUT
+            timeout=config.REQUEST_TIMEOUT,
+            # Повторы делает self.resilience, иначе они перемножаются с повторами клиента
+            max_retries=0
         )
         self.model = config.GPT_MODEL
+        self.resilience = ResiliencePolicy(
+            "openai",
+            breaker=breaker_from_config("openai"),
+            limiter=AIMDLimiter(
+                "openai",
+                max_limit=config.OPENAI_MAX_CONCURRENCY,
+                latency_target=config.OPENAI_LATENCY_TARGET
+            ),
+            retryable=(APIConnectionError,)
+        )
 
-    @backoff.on_exception(
-        backoff.expo,
-        (APIError, Exception),
-        max_tries=3,
-        logger=logger
-    )
     async def generate_script(
         self, 
         prompt: str, 
@@ -33,12 +40,12 @@ class GPTService:
         messages = self._build_messages(prompt, profile_info)
         
         try:
-            response = await self.client.chat.completions.create(
+            response = await self.resilience.call(lambda: self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
                 temperature=0.7,
                 max_tokens=350  # Уменьшили количество токенов для короткого текста
-            )
+            ))
             return response.choices[0].message.content
         except APIError as e:
             logger.error(f"OpenAI API error: {e}")
@@ -47,6 +54,103 @@ class GPTService:
             logger.error(f"Unexpected error: {e}")
             raise Exception(f"Script generation failed: {e}")
 
+    async def generate_candidates(
+        self,
+        prompt: str,
+        profile_info: Optional[Dict[str, Any]] = None,
+        n: int = 3
+    ) -> List[str]:
+        """
+        Generate several alternative scripts in one completion call
+        """
+        messages = self._build_messages(prompt, profile_info)
+        
+        try:
+            response = await self.resilience.call(lambda: self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=350,
+                n=n
+            ))
+            return [choice.message.content for choice in response.choices if choice.message.content]
+        except Exception as e:
+            logger.error(f"Candidates generation failed: {e}")
+            raise Exception(f"Script generation failed: {e}")
+
+    async def stream_script(
+        self,
+        prompt: str,
+        profile_info: Optional[Dict[str, Any]] = None,
+        n: int = 1,
+        alternatives: Optional[List[str]] = None
+    ) -> AsyncIterator[str]:
+        """
+        Generate video script, yielding text chunks as they arrive.
+        With n > 1 only the first candidate is streamed, the others are
+        appended to alternatives when the completion ends.
+        Retries only until the first chunk, so the caller never gets duplicated text.
+        """
+        messages = self._build_messages(prompt, profile_info)
+        
+        attempt = 0
+        while True:
+            attempt += 1
+            received = False
+            others: Dict[int, List[str]] = {}
+            try:
+                first: List[str] = []
+                # The attempt covers the time to the first chunk only: the limiter slot
+                # and a half-open probe are released before text reaches the caller,
+                # whose message edits must not count as provider latency
+                async with self.resilience.attempt():
+                    stream = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        temperature=0.7,
+                        max_tokens=350,
+                        n=n,
+                        stream=True
+                    )
+                    chunks = stream.__aiter__()
+                    async for chunk in chunks:
+                        first.extend(self._split_chunk(chunk, others))
+                        if first:
+                            break
+                for delta in first:
+                    received = True
+                    yield delta
+                async for chunk in chunks:
+                    for delta in self._split_chunk(chunk, others):
+                        yield delta
+                if alternatives is not None:
+                    alternatives.extend("".join(others[index]) for index in sorted(others))
+                return
+            except Exception as e:
+                if received or not self.resilience.should_retry(e, attempt):
+                    logger.error(f"Script streaming failed: {e}")
+                    raise Exception(f"Script generation failed: {e}")
+                delay = self.resilience.retry_delay(e, attempt)
+                self.resilience.retries += 1
+                logger.warning(f"Script streaming attempt {attempt} failed, retrying in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    def _split_chunk(chunk: Any, others: Dict[int, List[str]]) -> List[str]:
+        """
+        Return text deltas of the first candidate, collecting the other candidates into others
+        """
+        deltas = []
+        for choice in chunk.choices:
+            delta = choice.delta.content
+            if not delta:
+                continue
+            if choice.index == 0:
+                deltas.append(delta)
+            else:
+                others.setdefault(choice.index, []).append(delta)
+        return deltas
+
     async def improve_script(
         self,
         script: str,
@@ -68,12 +172,12 @@ class GPTService:
         ]
         
         try:
-            response = await self.client.chat.completions.create(
+            response = await self.resilience.call(lambda: self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
                 temperature=0.5,
                 max_tokens=200
-            )
+            ))
             return response.choices[0].message.content
         except Exception as e:
             logger.error(f"Script improvement failed: {e}")
@@ -0,0 +1,23 @@
+import asyncio
+import logging
+
+from config import config
+from services.database import db
+
+logger = logging.getLogger(__name__)
+
+
+async def run_partition_maintenance(interval_hours: int):
+    """Фоновая задача: создание будущих партиций generations и удаление старых"""
+    while True:
+        try:
+            await db.ensure_partitions()
+            await db.apply_generations_retention(
+                config.GENERATIONS_RETENTION_MONTHS,
+                config.GENERATIONS_RETENTION_MODE
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in partition maintenance: {e}")
+        await asyncio.sleep(interval_hours * 3600)
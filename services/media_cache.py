@@ -0,0 +1,74 @@
+import logging
+import os
+from typing import Dict, Optional
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+
+from services.database import db
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramFileCache:
+    """Сопоставление локальных файлов и file_id, полученных после первой загрузки в Telegram"""
+
+    def __init__(self):
+        self._local: Dict[str, str] = {}
+        self.hits = 0
+        self.uploads = 0
+
+    @staticmethod
+    def make_key(path: str) -> str:
+        """Ключ меняется вместе с файлом, поэтому старый file_id не переиспользуется"""
+        stat = os.stat(path)
+        return f"{os.path.normpath(path)}:{int(stat.st_mtime)}:{stat.st_size}"
+
+    async def get(self, cache_key: str) -> Optional[str]:
+        file_id = self._local.get(cache_key)
+        if file_id:
+            return file_id
+        try:
+            file_id = await db.get_cached_file_id(cache_key)
+        except Exception as e:
+            logger.error(f"Failed to read file_id cache: {e}")
+            return None
+        if file_id:
+            self._local[cache_key] = file_id
+        return file_id
+
+    async def set(self, cache_key: str, file_id: str):
+        self._local[cache_key] = file_id
+        try:
+            await db.save_cached_file_id(cache_key, file_id)
+        except Exception as e:
+            logger.error(f"Failed to save file_id cache: {e}")
+
+    async def invalidate(self, cache_key: str):
+        self._local.pop(cache_key, None)
+        try:
+            await db.delete_cached_file_id(cache_key)
+        except Exception as e:
+            logger.error(f"Failed to delete file_id cache: {e}")
+
+    async def answer_video(self, message: Message, path: str, **kwargs) -> Message:
+        """Отправляет видео, загружая файл только при первой отправке"""
+        cache_key = self.make_key(path)
+        file_id = await self.get(cache_key)
+        if file_id:
+            try:
+                sent = await message.answer_video(file_id, **kwargs)
+                self.hits += 1
+                return sent
+            except TelegramBadRequest as e:
+                logger.warning(f"Cached file_id rejected for {path}, re-uploading: {e}")
+                await self.invalidate(cache_key)
+
+        sent = await message.answer_video(FSInputFile(path), **kwargs)
+        self.uploads += 1
+        if sent.video:
+            await self.set(cache_key, sent.video.file_id)
+        return sent
+
+
+media_cache = TelegramFileCache()
@@ -1,6 +1,7 @@
 from typing import Optional, Dict
 from datetime import datetime
 from config import config
+from services.database import db
 
 class ProfileStates:
     WAITING_NICHE = 1
@@ -25,15 +26,15 @@ async def save_profile_data(user_id: int, field: str, value: str, db_pool) -> bo
             ON CONFLICT (user_id) DO UPDATE
             SET {field} = EXCLUDED.{field}, updated_at = EXCLUDED.updated_at
         """, user_id, value, datetime.now())
+    await db.profile_cache.invalidate(user_id)
     return True
 
 async def get_user_profile(user_id: int, db_pool) -> Optional[Dict]:
-    async with db_pool.acquire() as conn:
-        profile = await conn.fetchrow(
-            "SELECT niche, content_style, goals, tone_of_voice, target_audience FROM user_profiles WHERE user_id = $1",
-            user_id
-        )
-        return dict(profile) if profile else None
+    # Читаем через кэш профилей базы данных
+    profile = await db.get_user_profile(user_id)
+    if not profile:
+        return None
+    return {field: profile.get(field) for field in PROFILE_QUESTIONS}
 
 async def is_profile_complete(user_id: int, db_pool) -> bool:
     profile = await get_user_profile(user_id, db_pool)
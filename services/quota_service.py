@@ -0,0 +1,233 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Set, Tuple
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from config import config
+from services.database import db
+
+logger = logging.getLogger(__name__)
+
+# KEYS: счетчик за день, счетчик за месяц, кредиты
+# ARGV: дневной лимит, месячный лимит
+# Ответ: {статус, остаток, кредиты}; статус -1 - ключей нет, 0 - отказ, 1 - по лимиту, 2 - за кредит
+RESERVE_SCRIPT = """
+local day = redis.call('GET', KEYS[1])
+local month = redis.call('GET', KEYS[2])
+local credits = redis.call('GET', KEYS[3])
+if not day or not month or not credits then
+    return {-1, 0, 0}
+end
+day = tonumber(day)
+month = tonumber(month)
+credits = tonumber(credits)
+local daily_limit = tonumber(ARGV[1])
+local monthly_limit = tonumber(ARGV[2])
+if day < daily_limit and month < monthly_limit then
+    redis.call('INCR', KEYS[1])
+    redis.call('INCR', KEYS[2])
+    return {1, daily_limit - day - 1, credits}
+end
+if credits > 0 then
+    redis.call('INCR', KEYS[1])
+    redis.call('INCR', KEYS[2])
+    redis.call('DECR', KEYS[3])
+    return {2, credits - 1, credits - 1}
+end
+return {0, 0, credits}
+"""
+
+def get_tier_limits(tier: Optional[str]) -> Tuple[int, int]:
+    """Дневной и месячный лимиты тарифа"""
+    if tier == "premium":
+        return config.PREMIUM_DAILY_LIMIT, config.PREMIUM_MONTHLY_LIMIT
+    if tier == "lite":
+        return config.LITE_DAILY_LIMIT, config.LITE_MONTHLY_LIMIT
+    return config.FREE_DAILY_LIMIT, config.FREE_MONTHLY_LIMIT
+
+
+@dataclass
+class Reservation:
+    allowed: bool
+    used_credit: bool = False
+    # Генераций по лимиту на сегодня или кредитов, если списан кредит
+    remaining: int = 0
+    persisted: Optional[asyncio.Future] = field(default=None, repr=False)
+
+    async def generation_id(self) -> Optional[int]:
+        """ID записи в generations (None, если запись в базу не удалась)"""
+        if self.persisted is None:
+            return None
+        try:
+            return await self.persisted
+        except Exception:
+            return None
+
+
+class QuotaService:
+    """Атомарное резервирование генераций в Redis с асинхронной записью в PostgreSQL"""
+
+    def __init__(self):
+        self.redis: Optional[Redis] = None
+        self._reserve_script = None
+        # Незаписанные в базу резервирования по пользователям
+        self._pending: Dict[int, Set[asyncio.Task]] = {}
+        self.redis_reservations = 0
+        self.db_reservations = 0
+        self.seeds = 0
+        self.persist_errors = 0
+
+    def setup(self, redis: Redis):
+        self.redis = redis
+        self._reserve_script = redis.register_script(RESERVE_SCRIPT)
+
+    async def reserve(self, user_id: int, tier: Optional[str], prompt: str) -> Reservation:
+        """
+        Проверяет лимиты и списывает генерацию (или кредит) одной операцией.
+        tier - действующий тариф из db.get_effective_tier: истекшая подписка считается free,
+        так же как в db.reserve_generation, которая используется без Redis.
+        """
+        daily_limit, monthly_limit = get_tier_limits(tier)
+        if self.redis is not None:
+            try:
+                return await self._reserve_in_redis(user_id, daily_limit, monthly_limit, prompt)
+            except RedisError as e:
+                logger.error(f"Redis quota reservation failed for user {user_id}, using database: {e}")
+        return await self._reserve_in_db(user_id, prompt)
+
+    async def forget(self, user_id: int):
+        """
+        Сбрасывает значения в Redis, чтобы они были заново загружены из базы.
+        Вызывается после начисления кредитов в базу: прибавлять их в Redis нельзя,
+        параллельная загрузка могла уже прочитать новый баланс.
+        """
+        if self.redis is None:
+            return
+        now = datetime.now()
+        try:
+            await self.redis.delete(
+                self._day_key(user_id, now),
+                self._month_key(user_id, now),
+                self._credits_key(user_id)
+            )
+        except RedisError as e:
+            logger.error(f"Failed to reset quota keys for user {user_id}: {e}")
+
+    async def close(self):
+        """Дожидается записи зарезервированных генераций в базу"""
+        tasks = [task for tasks in self._pending.values() for task in tasks]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "redis_reservations": self.redis_reservations,
+            "db_reservations": self.db_reservations,
+            "seeds": self.seeds,
+            "pending_writes": sum(len(tasks) for tasks in self._pending.values()),
+            "persist_errors": self.persist_errors
+        }
+
+    async def _reserve_in_redis(self, user_id: int, daily_limit: int, monthly_limit: int, prompt: str) -> Reservation:
+        now = datetime.now()
+        keys = [self._day_key(user_id, now), self._month_key(user_id, now), self._credits_key(user_id)]
+
+        status, remaining, credits = await self._reserve_script(keys=keys, args=[daily_limit, monthly_limit])
+        if status == -1:
+            await self._seed(user_id, now, keys)
+            status, remaining, credits = await self._reserve_script(keys=keys, args=[daily_limit, monthly_limit])
+
+        self.redis_reservations += 1
+        if status <= 0:
+            return Reservation(allowed=False)
+
+        used_credit = status == 2
+        task = asyncio.create_task(self._persist(user_id, prompt, used_credit))
+        self._pending.setdefault(user_id, set()).add(task)
+        task.add_done_callback(lambda done: self._forget_pending(user_id, done))
+        return Reservation(allowed=True, used_credit=used_credit, remaining=int(remaining), persisted=task)
+
+    async def _reserve_in_db(self, user_id: int, prompt: str) -> Reservation:
+        self.db_reservations += 1
+        result = await db.reserve_generation(user_id, prompt)
+        if not result:
+            return Reservation(allowed=False)
+
+        persisted = asyncio.get_running_loop().create_future()
+        persisted.set_result(result['generation_id'])
+        return Reservation(
+            allowed=True,
+            used_credit=result['used_credit'],
+            remaining=result['remaining'],
+            persisted=persisted
+        )
+
+    async def _seed(self, user_id: int, now: datetime, keys: list):
+        """Загружает счетчики и кредиты из базы для ключей, которых нет в Redis"""
+        self.seeds += 1
+        # Резервирования, еще не записанные в базу, иначе потерялись бы при загрузке
+        await self._wait_pending(user_id)
+        usage = await db.get_usage_counters(user_id)
+        credits = await db.get_video_credits(user_id) or 0
+
+        day_end = datetime(now.year, now.month, now.day) + timedelta(days=1)
+        month_end = (datetime(now.year, now.month, 1) + timedelta(days=32)).replace(day=1)
+
+        day_key, month_key, credits_key = keys
+        async with self.redis.pipeline(transaction=False) as pipe:
+            # NX: не затираем значения, которые успел загрузить параллельный запрос
+            pipe.set(day_key, usage['today'], nx=True)
+            pipe.expireat(day_key, day_end + timedelta(days=1))
+            pipe.set(month_key, usage['month'], nx=True)
+            pipe.expireat(month_key, month_end + timedelta(days=1))
+            # Кредиты живут столько же, сколько дневной счетчик, и загружаются вместе с ним
+            pipe.set(credits_key, credits, nx=True)
+            pipe.expireat(credits_key, day_end + timedelta(days=1))
+            await pipe.execute()
+
+    async def _wait_pending(self, user_id: int):
+        """Дожидается записи в базу резервирований пользователя"""
+        tasks = list(self._pending.get(user_id, ()))
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _forget_pending(self, user_id: int, task: asyncio.Task):
+        tasks = self._pending.get(user_id)
+        if tasks is None:
+            return
+        tasks.discard(task)
+        if not tasks:
+            del self._pending[user_id]
+
+    async def _persist(self, user_id: int, prompt: str, used_credit: bool) -> int:
+        """Записывает зарезервированную генерацию в PostgreSQL"""
+        try:
+            async with db.transaction() as conn:
+                if used_credit:
+                    await db.use_video_credit(user_id, conn=conn)
+                return await db.log_generation(user_id=user_id, prompt=prompt, status="processing", conn=conn)
+        except Exception as e:
+            self.persist_errors += 1
+            logger.error(f"Failed to persist quota reservation for user {user_id}: {e}")
+            # Redis разошелся с базой: при следующем запросе значения загрузятся заново
+            await self.forget(user_id)
+            raise
+
+    @staticmethod
+    def _day_key(user_id: int, now: datetime) -> str:
+        return f"quota:{user_id}:day:{now:%Y-%m-%d}"
+
+    @staticmethod
+    def _month_key(user_id: int, now: datetime) -> str:
+        return f"quota:{user_id}:month:{now:%Y-%m}"
+
+    @staticmethod
+    def _credits_key(user_id: int) -> str:
+        return f"quota:{user_id}:credits"
+
+
+quota_service = QuotaService()
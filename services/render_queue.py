@@ -0,0 +1,163 @@
+import asyncio
+import itertools
+import logging
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from config import config
+from utils.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+# Чем меньше число, тем выше приоритет
+TIER_PRIORITY = {
+    "premium": 0,
+    "lite": 1,
+    "free": 2
+}
+# Служебные задачи (подготовка фонов) идут после всех пользовательских
+MAINTENANCE_TIER = "maintenance"
+MAINTENANCE_PRIORITY = len(TIER_PRIORITY)
+
+
+@dataclass(order=True)
+class RenderJob:
+    priority: int
+    seq: int
+    user_id: int = field(compare=False)
+    tier: str = field(compare=False)
+    func: Callable[[], Awaitable[Any]] = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    enqueued_at: float = field(compare=False)
+
+
+class RenderScheduler:
+    """Очередь рендеров с ограниченным числом одновременных задач ffmpeg"""
+
+    def __init__(self, workers: int):
+        self.workers = max(1, workers)
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._pending: List[RenderJob] = []
+        self._tasks: List[asyncio.Task] = []
+        self._seq = itertools.count()
+        self._active = 0
+        # Скользящая оценка длительности одного рендера для расчета ETA
+        self._avg_duration = float(config.RENDER_ESTIMATED_DURATION)
+        self.wait_time = Histogram()
+        self.run_time = Histogram()
+        self.completed = 0
+        self.failed = 0
+
+    async def start(self):
+        """Запуск воркеров"""
+        if self._tasks:
+            return
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(i)))
+        logger.info(f"Render scheduler started with {self.workers} workers")
+
+    async def stop(self):
+        """Остановка воркеров и отмена ожидающих задач"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        for job in self._pending:
+            if not job.future.done():
+                job.future.cancel()
+        self._pending.clear()
+
+    def submit(self, user_id: int, tier: Optional[str], func: Callable[[], Awaitable[Any]]) -> RenderJob:
+        """Ставит задачу в очередь. Результат доступен через job.future"""
+        if tier != MAINTENANCE_TIER:
+            tier = tier if tier in TIER_PRIORITY else "free"
+        job = RenderJob(
+            priority=TIER_PRIORITY.get(tier, MAINTENANCE_PRIORITY),
+            seq=next(self._seq),
+            user_id=user_id,
+            tier=tier,
+            func=func,
+            future=asyncio.get_running_loop().create_future(),
+            enqueued_at=time.monotonic()
+        )
+        self._pending.append(job)
+        self._queue.put_nowait(job)
+        return job
+
+    def position(self, job: RenderJob) -> int:
+        """Позиция задачи в очереди (0 - уже выполняется или завершена)"""
+        if job not in self._pending:
+            return 0
+        return sum(1 for other in self._pending if other < job) + 1
+
+    def estimate_wait(self, job: RenderJob) -> float:
+        """Примерное время ожидания начала рендера в секундах"""
+        position = self.position(job)
+        if position == 0:
+            return 0.0
+        # Если есть свободный воркер, задача стартует сразу
+        free_workers = self.workers - self._active
+        if position <= free_workers:
+            return 0.0
+        rounds = math.ceil((position - free_workers) / self.workers)
+        return rounds * self._avg_duration
+
+    def get_metrics(self) -> Dict[str, Any]:
+        depth_by_tier = {tier: 0 for tier in TIER_PRIORITY}
+        for job in self._pending:
+            if job.tier in depth_by_tier:
+                depth_by_tier[job.tier] += 1
+        return {
+            "workers": self.workers,
+            "active": self._active,
+            "queue_depth": len(self._pending),
+            "queue_depth_by_tier": depth_by_tier,
+            "wait_time": self.wait_time.snapshot(),
+            "run_time": self.run_time.snapshot(),
+            "completed": self.completed,
+            "failed": self.failed
+        }
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self._queue.get()
+            try:
+                if job in self._pending:
+                    self._pending.remove(job)
+                if job.future.cancelled():
+                    continue
+
+                started = time.monotonic()
+                self.wait_time.observe(started - job.enqueued_at)
+                self._active += 1
+                try:
+                    result = await job.func()
+                except asyncio.CancelledError:
+                    job.future.cancel()
+                    raise
+                except Exception as e:
+                    self.failed += 1
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                else:
+                    self.completed += 1
+                    if not job.future.done():
+                        job.future.set_result(result)
+                finally:
+                    self._active -= 1
+                    duration = time.monotonic() - started
+                    self.run_time.observe(duration)
+                    # Перекодирование фонов не похоже на рендер и не должно влиять на ETA
+                    if job.tier != MAINTENANCE_TIER:
+                        self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Render worker {index} error: {e}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+
+render_scheduler = RenderScheduler(config.RENDER_WORKERS)
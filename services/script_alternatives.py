@@ -0,0 +1,115 @@
+import asyncio
+import hashlib
+import logging
+from typing import Dict, List, Optional
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from config import config
+from services.database import db
+from services.gpt_service import gpt_service
+
+logger = logging.getLogger(__name__)
+
+
+class ScriptAlternatives:
+    """
+    Запасные варианты сценария в Redis: "Новый вариант" берет готовый текст,
+    а пополнение идет в фоне. Варианты привязаны к промпту (идея и стиль).
+    """
+
+    def __init__(self):
+        self.redis: Optional[Redis] = None
+        self._refills: Dict[int, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+
+    def setup(self, redis: Redis):
+        self.redis = redis
+
+    async def push(self, user_id: int, prompt: str, scripts: List[str]):
+        scripts = [script.strip() for script in scripts if script and script.strip()]
+        if self.redis is None or not scripts:
+            return
+        key = self._key(user_id, prompt)
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.rpush(key, *scripts)
+                pipe.expire(key, config.SCRIPT_ALTERNATIVES_TTL)
+                await pipe.execute()
+        except RedisError as e:
+            logger.error(f"Failed to store script alternatives for user {user_id}: {e}")
+
+    async def pop(self, user_id: int, prompt: str) -> Optional[str]:
+        """Следующий готовый вариант; при необходимости запускает пополнение"""
+        if self.redis is None:
+            return None
+        key = self._key(user_id, prompt)
+        try:
+            script = await self.redis.lpop(key)
+            left = await self.redis.llen(key)
+        except RedisError as e:
+            logger.error(f"Failed to read script alternatives for user {user_id}: {e}")
+            return None
+
+        if script is None:
+            # Вызывающий сгенерирует сценарий заново, вместе с ним придут и новые варианты
+            self.misses += 1
+            return None
+        self.hits += 1
+        if left <= config.SCRIPT_ALTERNATIVES_LOW and config.SCRIPT_CANDIDATES > 1:
+            self._start_refill(user_id, prompt)
+        return script
+
+    async def discard(self, user_id: int, prompt: Optional[str]):
+        """Удаляет варианты и останавливает пополнение (пользователь бросил сценарий)"""
+        task = self._refills.pop(user_id, None)
+        if task:
+            task.cancel()
+        if self.redis is None or not prompt:
+            return
+        try:
+            await self.redis.delete(self._key(user_id, prompt))
+        except RedisError as e:
+            logger.error(f"Failed to discard script alternatives for user {user_id}: {e}")
+
+    def get_metrics(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "refills": self.refills,
+            "refilling": len(self._refills)
+        }
+
+    def _start_refill(self, user_id: int, prompt: str):
+        if user_id in self._refills:
+            return
+        task = asyncio.create_task(self._refill(user_id, prompt))
+        self._refills[user_id] = task
+        task.add_done_callback(lambda done: self._forget_refill(user_id, done))
+
+    def _forget_refill(self, user_id: int, task: asyncio.Task):
+        # Задачу могли уже заменить новой после discard()
+        if self._refills.get(user_id) is task:
+            del self._refills[user_id]
+
+    async def _refill(self, user_id: int, prompt: str):
+        self.refills += 1
+        try:
+            profile = await db.get_user_profile(user_id)
+            scripts = await gpt_service.generate_candidates(prompt, profile, config.SCRIPT_CANDIDATES)
+            await self.push(user_id, prompt, scripts)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to refill script alternatives for user {user_id}: {e}")
+
+    @staticmethod
+    def _key(user_id: int, prompt: str) -> str:
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+        return f"script_alternatives:{user_id}:{digest}"
+
+
+script_alternatives = ScriptAlternatives()
@@ -0,0 +1,298 @@
+import asyncio
+import json
+import logging
+from typing import Any, Dict
+
+from services.database import db
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_NAME = "generations"
+# Watermark по updated_at: смены статуса уже агрегированных генераций
+STATUS_WATERMARK_NAME = "generation_statuses"
+# Запас на транзакции, которые обновили updated_at, но еще не закоммичены
+STATUS_SETTLE_MINUTES = 5
+# Сколько часов обрабатывается за одну транзакцию при догоняющем расчете
+MAX_HOURS_PER_BATCH = 24
+
+
+async def aggregate_once(settle_minutes: int) -> int:
+    """
+    Добавляет в почасовые агрегаты генерации и новых пользователей после watermark.
+    Возвращает количество обработанных часов (0 - догонять нечего).
+    """
+    async with db.transaction() as conn:
+        watermark = await conn.fetchval(
+            "SELECT processed_until FROM stats_watermarks WHERE name = $1 FOR UPDATE",
+            WATERMARK_NAME
+        )
+        if watermark is None:
+            # Первый запуск: начинаем с самой ранней записи
+            await conn.execute("""
+                INSERT INTO stats_watermarks (name, processed_until)
+                SELECT $1, date_trunc('hour', LEAST(
+                    (SELECT MIN(created_at) FROM generations),
+                    (SELECT MIN(created_at) FROM users),
+                    LOCALTIMESTAMP
+                ))
+                ON CONFLICT (name) DO NOTHING
+            """, WATERMARK_NAME)
+            watermark = await conn.fetchval(
+                "SELECT processed_until FROM stats_watermarks WHERE name = $1 FOR UPDATE",
+                WATERMARK_NAME
+            )
+
+        until = await conn.fetchval("""
+            SELECT LEAST(
+                date_trunc('hour', LOCALTIMESTAMP - make_interval(mins => $1)),
+                $2::timestamp + make_interval(hours => $3)
+            )
+        """, settle_minutes, watermark, MAX_HOURS_PER_BATCH)
+        if until <= watermark:
+            return 0
+
+        await conn.execute("""
+            INSERT INTO generation_stats_hourly (hour, generations, completed, failed)
+            SELECT
+                date_trunc('hour', created_at),
+                COUNT(*),
+                COUNT(*) FILTER (WHERE status = 'completed'),
+                COUNT(*) FILTER (WHERE status = 'failed')
+            FROM generations
+            WHERE created_at >= $1 AND created_at < $2
+            GROUP BY 1
+            ON CONFLICT (hour) DO UPDATE SET
+                generations = EXCLUDED.generations,
+                completed = EXCLUDED.completed,
+                failed = EXCLUDED.failed
+        """, watermark, until)
+
+        await conn.execute("""
+            INSERT INTO generation_stats_hourly (hour, new_users)
+            SELECT date_trunc('hour', created_at), COUNT(*)
+            FROM users
+            WHERE created_at >= $1 AND created_at < $2
+            GROUP BY 1
+            ON CONFLICT (hour) DO UPDATE SET new_users = EXCLUDED.new_users
+        """, watermark, until)
+
+        await conn.execute("""
+            INSERT INTO user_activity_daily (day, user_id)
+            SELECT DISTINCT created_at::date, user_id
+            FROM generations
+            WHERE created_at >= $1 AND created_at < $2
+            ON CONFLICT DO NOTHING
+        """, watermark, until)
+
+        await conn.execute(
+            "UPDATE stats_watermarks SET processed_until = $2 WHERE name = $1",
+            WATERMARK_NAME, until
+        )
+        return int((until - watermark).total_seconds() // 3600)
+
+
+async def refresh_statuses() -> int:
+    """
+    Пересчитывает completed/failed для уже агрегированных часов, в которых генерации
+    сменили статус после агрегации (рендер мог закончиться позже STATS_SETTLE_MINUTES).
+    Возвращает количество пересчитанных часов.
+    """
+    async with db.transaction() as conn:
+        watermark = await conn.fetchval(
+            "SELECT processed_until FROM stats_watermarks WHERE name = $1",
+            WATERMARK_NAME
+        )
+        if watermark is None:
+            return 0
+        # Первый запуск: проверяем статусы, измененные за последнюю неделю
+        await conn.execute("""
+            INSERT INTO stats_watermarks (name, processed_until)
+            VALUES ($1, LOCALTIMESTAMP - INTERVAL '7 days')
+            ON CONFLICT (name) DO NOTHING
+        """, STATUS_WATERMARK_NAME)
+        since = await conn.fetchval(
+            "SELECT processed_until FROM stats_watermarks WHERE name = $1 FOR UPDATE",
+            STATUS_WATERMARK_NAME
+        )
+        until = await conn.fetchval(
+            "SELECT LOCALTIMESTAMP - make_interval(mins => $1)", STATUS_SETTLE_MINUTES
+        )
+        if until <= since:
+            return 0
+
+        result = await conn.execute("""
+            WITH touched AS (
+                SELECT DISTINCT date_trunc('hour', created_at) as hour
+                FROM generations
+                WHERE updated_at >= $1 AND updated_at < $2 AND created_at < $3
+            ), counts AS (
+                SELECT
+                    t.hour,
+                    COUNT(*) FILTER (WHERE g.status = 'completed') as completed,
+                    COUNT(*) FILTER (WHERE g.status = 'failed') as failed
+                FROM touched t
+                JOIN generations g ON g.created_at >= t.hour AND g.created_at < t.hour + INTERVAL '1 hour'
+                GROUP BY t.hour
+            )
+            UPDATE generation_stats_hourly s
+            SET completed = c.completed, failed = c.failed
+            FROM counts c
+            WHERE s.hour = c.hour AND (s.completed, s.failed) IS DISTINCT FROM (c.completed, c.failed)
+        """, since, until, watermark)
+
+        await conn.execute(
+            "UPDATE stats_watermarks SET processed_until = $2 WHERE name = $1",
+            STATUS_WATERMARK_NAME, until
+        )
+        return int(result.split()[-1])
+
+
+async def refresh_snapshots():
+    """Обновляет статистику по тарифам и нишам, чтобы админка не считала ее при каждом открытии"""
+    async with db.acquire() as conn:
+        subscriptions = await conn.fetchrow("""
+            SELECT
+                COUNT(*) FILTER (WHERE subscription_type = 'premium') as premium,
+                COUNT(*) FILTER (WHERE subscription_type = 'lite') as lite
+            FROM users
+        """)
+        niches = await conn.fetch("""
+            SELECT niche, COUNT(*) as count
+            FROM user_profiles
+            WHERE niche IS NOT NULL
+            GROUP BY niche
+            ORDER BY count DESC
+            LIMIT 5
+        """)
+        await conn.executemany("""
+            INSERT INTO stats_snapshots (name, data, updated_at)
+            VALUES ($1, $2::jsonb, NOW())
+            ON CONFLICT (name) DO UPDATE SET data = EXCLUDED.data, updated_at = NOW()
+        """, [
+            ("subscriptions", json.dumps(dict(subscriptions))),
+            ("niches", json.dumps([dict(row) for row in niches], ensure_ascii=False))
+        ])
+
+
+async def run_aggregator(interval: int, settle_minutes: int):
+    """Фоновая задача пересчета статистики"""
+    while True:
+        try:
+            while await aggregate_once(settle_minutes):
+                pass
+            await refresh_statuses()
+            await refresh_snapshots()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error aggregating stats: {e}")
+        await asyncio.sleep(interval)
+
+
+async def get_dashboard(days: int = 7) -> Dict[str, Any]:
+    """Статистика для админки: агрегаты плюс еще не агрегированный хвост generations"""
+    async with db.acquire() as conn:
+        watermark = await conn.fetchval(
+            "SELECT processed_until FROM stats_watermarks WHERE name = $1",
+            WATERMARK_NAME
+        )
+
+        # Пользователи не удаляются, поэтому всего = новые по часам + еще не агрегированные
+        total_users = await conn.fetchval("""
+            SELECT
+                (SELECT COALESCE(SUM(new_users), 0) FROM generation_stats_hourly)
+                + (SELECT COUNT(*) FROM users
+                   WHERE created_at >= COALESCE($1::timestamp, '-infinity'::timestamp))
+        """, watermark)
+
+        snapshots = {
+            row['name']: json.loads(row['data'])
+            for row in await conn.fetch("SELECT name, data::text as data FROM stats_snapshots")
+        }
+        subscriptions = snapshots.get("subscriptions", {})
+
+        totals = await conn.fetchrow("""
+            SELECT
+                COALESCE(SUM(generations), 0) as generations,
+                COALESCE(SUM(completed), 0) as completed,
+                COALESCE(SUM(failed), 0) as failed
+            FROM generation_stats_hourly
+        """)
+
+        tail = await conn.fetchrow("""
+            SELECT
+                COUNT(*) as generations,
+                COUNT(*) FILTER (WHERE status = 'completed') as completed,
+                COUNT(*) FILTER (WHERE status = 'failed') as failed
+            FROM generations
+            WHERE created_at >= COALESCE($1::timestamp, '-infinity'::timestamp)
+        """, watermark)
+
+        active = await conn.fetchrow("""
+            SELECT
+                COUNT(DISTINCT user_id) FILTER (WHERE day >= CURRENT_DATE - 6) as week,
+                COUNT(DISTINCT user_id) as month
+            FROM (
+                SELECT day, user_id FROM user_activity_daily
+                WHERE day >= CURRENT_DATE - 29
+                UNION ALL
+                SELECT created_at::date, user_id FROM generations
+                WHERE created_at >= COALESCE($1::timestamp, '-infinity'::timestamp)
+                  AND created_at >= CURRENT_DATE - 29
+            ) activity
+        """, watermark)
+
+        weeks = await conn.fetchrow("""
+            SELECT
+                COALESCE(SUM(generations) FILTER (WHERE hour >= LOCALTIMESTAMP - INTERVAL '7 days'), 0) as this_week,
+                COALESCE(SUM(generations) FILTER (WHERE hour < LOCALTIMESTAMP - INTERVAL '7 days'), 0) as previous_week
+            FROM generation_stats_hourly
+            WHERE hour >= LOCALTIMESTAMP - INTERVAL '14 days'
+        """)
+
+        daily = await conn.fetch("""
+            SELECT
+                h.day,
+                h.generations,
+                h.completed,
+                h.failed,
+                h.new_users,
+                COALESCE(a.active_users, 0) as active_users
+            FROM (
+                SELECT
+                    hour::date as day,
+                    SUM(generations) as generations,
+                    SUM(completed) as completed,
+                    SUM(failed) as failed,
+                    SUM(new_users) as new_users
+                FROM generation_stats_hourly
+                WHERE hour >= CURRENT_DATE - ($1::int - 1)
+                GROUP BY 1
+            ) h
+            LEFT JOIN (
+                SELECT day, COUNT(*) as active_users
+                FROM user_activity_daily
+                WHERE day >= CURRENT_DATE - ($1::int - 1)
+                GROUP BY day
+            ) a ON a.day = h.day
+            ORDER BY h.day DESC
+        """, days)
+
+    return {
+        "watermark": watermark,
+        "users": {
+            "total": total_users,
+            "premium": subscriptions.get("premium", 0),
+            "lite": subscriptions.get("lite", 0)
+        },
+        "generations": {
+            key: totals[key] + tail[key] for key in ("generations", "completed", "failed")
+        },
+        "pending_aggregation": tail['generations'],
+        "active_week_users": active['week'],
+        "active_month_users": active['month'],
+        "this_week": weeks['this_week'] + tail['generations'],
+        "previous_week": weeks['previous_week'],
+        "daily": [dict(row) for row in daily],
+        "niches": snapshots.get("niches", [])
+    }
@@ -1,5 +1,6 @@
 from datetime import datetime, timedelta
 from config import config
+import asyncio
 import logging
 from services.database import db
 
@@ -13,8 +14,8 @@ async def get_user_limits_info(user_id: int, db_pool) -> dict:
                   subscription_type, 
                   subscription_expire, 
                   COALESCE(video_credits, 0) as video_credits,
-                  (SELECT COUNT(*) FROM generations 
-                   WHERE user_id = $1 AND DATE(created_at) = CURRENT_DATE) as generations_today
+                  COALESCE((SELECT count FROM user_usage
+                   WHERE user_id = $1 AND period = to_char(LOCALTIMESTAMP, 'YYYY-MM-DD')), 0) as generations_today
                FROM users WHERE user_id = $1""",
             user_id
         )
@@ -66,19 +67,10 @@ async def check_user_limits(user_id: int, db_pool) -> tuple:
             daily_limit = config.PREMIUM_DAILY_LIMIT
             monthly_limit = config.PREMIUM_MONTHLY_LIMIT
         
-        # Проверяем дневной лимит
-        today = datetime.now().date()
-        today_count = await conn.fetchval(
-            "SELECT COUNT(*) FROM generations WHERE user_id = $1 AND DATE(created_at) = $2",
-            user_id, today
-        )
-        
-        # Проверяем месячный лимит
-        month_start = datetime.now().replace(day=1).date()
-        month_count = await conn.fetchval(
-            "SELECT COUNT(*) FROM generations WHERE user_id = $1 AND DATE(created_at) >= $2",
-            user_id, month_start
-        )
+        # Проверяем дневной и месячный лимиты по счетчикам
+        usage = await db.get_usage_counters(user_id, conn)
+        today_count = usage['today']
+        month_count = usage['month']
         
         # Проверяем кредиты
         credits = await conn.fetchval("SELECT COALESCE(video_credits, 0) FROM users WHERE user_id = $1", user_id)
@@ -118,14 +110,8 @@ async def get_usage_info(user_id: int, db_pool) -> dict:
             return None
         
         # Получаем статистику использования
-        usage = await conn.fetchrow(
-            """SELECT 
-                  COUNT(CASE WHEN DATE(created_at) = CURRENT_DATE THEN 1 END) as today_count,
-                  COUNT(CASE WHEN DATE_TRUNC('month', created_at) = DATE_TRUNC('month', CURRENT_DATE) THEN 1 END) as month_count
-               FROM generations 
-               WHERE user_id = $1""",
-            user_id
-        )
+        counters = await db.get_usage_counters(user_id, conn)
+        usage = {'today_count': counters['today'], 'month_count': counters['month']}
         
         # Определяем лимиты
         if user['subscription_type'] == 'free':
@@ -155,7 +141,7 @@ async def get_usage_info(user_id: int, db_pool) -> dict:
 async def update_subscription(user_id: int, sub_type: str, duration_days: int, db_pool):
     """Обновление подписки пользователя"""
     expire_date = datetime.now() + timedelta(days=duration_days)
-    async with db.pool.acquire() as conn:
+    async with db.acquire() as conn:
         # Проверяем, есть ли пользователь
         exists = await conn.fetchval(
             "SELECT 1 FROM users WHERE user_id = $1",
@@ -182,8 +168,8 @@ async def get_user_subscription_info(user_id: int, db_pool) -> dict:
     async with db_pool.acquire() as conn:
         user = await conn.fetchrow(
             """SELECT subscription_type, subscription_expire, 
-                  (SELECT COUNT(*) FROM generations 
-                   WHERE user_id = $1 AND DATE(created_at) = CURRENT_DATE) as generations_today
+                  COALESCE((SELECT count FROM user_usage
+                   WHERE user_id = $1 AND period = to_char(LOCALTIMESTAMP, 'YYYY-MM-DD')), 0) as generations_today
                FROM users WHERE user_id = $1""",
             user_id
         )
@@ -202,4 +188,21 @@ async def get_user_subscription_info(user_id: int, db_pool) -> dict:
             "generations_today": user['generations_today'],
             "daily_limit": limit,
             "has_available": user['generations_today'] < limit
-        }
\ No newline at end of file
+        }
+
+async def maintain_usage_counters(interval_hours: int):
+    """Фоновая задача: построение счетчиков при первом запуске и ежедневная сверка с generations"""
+    try:
+        if not await db.has_usage_counters():
+            await db.rebuild_usage_counters(full=True)
+    except Exception as e:
+        logger.error(f"Error building usage counters: {e}")
+    
+    while True:
+        await asyncio.sleep(interval_hours * 3600)
+        try:
+            await db.rebuild_usage_counters()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error rebuilding usage counters: {e}")
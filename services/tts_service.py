@@ -1,27 +1,182 @@
-from elevenlabs.client import ElevenLabs
+from elevenlabs.client import AsyncElevenLabs
 from elevenlabs import VoiceSettings
 from config import config
-from typing import Optional
+from typing import Optional, Dict, Any
+from collections import OrderedDict
+import hashlib
+import httpx
+import json
 import logging
 import os
 import asyncio
 from pathlib import Path
+import datetime
 import time
 import shutil
+import uuid
+from utils.resilience import AIMDLimiter, CircuitOpenError, ResiliencePolicy, breaker_from_config
+from utils.speculative import SpeculativeTasks
 
 logger = logging.getLogger(__name__)
 
+
+class InvalidAudioError(Exception):
+    """Сервис вернул пустой или поврежденный файл; стоит повторить запрос"""
+
+
+class AudioCache:
+    """Кэш озвучки на диске с ключом по хэшу параметров и вытеснением LRU по размеру"""
+
+    def __init__(self, cache_dir: Path, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # key -> размер файла, порядок от давно использованных к недавним
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def make_key(text: str, voice_id: str, model_id: str, voice_settings: Dict[str, Any]) -> str:
+        payload = json.dumps(
+            {
+                "text": text,
+                "voice_id": voice_id,
+                "model_id": model_id,
+                "voice_settings": voice_settings
+            },
+            sort_keys=True,
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.mp3"
+
+    def contains(self, key: str) -> bool:
+        return key in self._entries and self._path(key).exists()
+
+    def _load(self):
+        """Восстанавливает индекс по файлам в директории (порядок по mtime)"""
+        files = sorted(self.cache_dir.glob("*.mp3"), key=lambda p: p.stat().st_mtime)
+        for path in files:
+            size = path.stat().st_size
+            self._entries[path.stem] = size
+            self._total_bytes += size
+        self._evict()
+        logger.info(f"TTS cache loaded: {len(self._entries)} files, {self._total_bytes} bytes")
+
+    def get(self, key: str, output_path: str) -> bool:
+        """Копирует закэшированное аудио в output_path. Возвращает False при промахе"""
+        path = self._path(key)
+        if key not in self._entries or not path.exists():
+            self._forget(key)
+            self.misses += 1
+            return False
+
+        try:
+            shutil.copyfile(path, output_path)
+            # mtime хранит время последнего использования для LRU после рестарта
+            os.utime(path)
+        except Exception as e:
+            logger.error(f"TTS cache read error: {e}")
+            self.misses += 1
+            return False
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True
+
+    def put(self, key: str, source_path: str):
+        """Сохраняет готовый аудиофайл в кэш"""
+        path = self._path(key)
+        temp_path = f"{path}.tmp"
+        try:
+            shutil.copyfile(source_path, temp_path)
+            os.replace(temp_path, path)
+        except Exception as e:
+            logger.error(f"TTS cache write error: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        self._forget(key)
+        size = path.stat().st_size
+        self._entries[key] = size
+        self._total_bytes += size
+        self._evict()
+
+    def _forget(self, key: str):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                self._path(key).unlink()
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error(f"TTS cache eviction error: {e}")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "files": len(self._entries),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes
+        }
+
 class TTSService:
     def __init__(self):
-        self.client = ElevenLabs(api_key=config.ELEVENLABS_API_KEY)
+        # Общий HTTP-клиент, чтобы переиспользовать соединения между запросами
+        self.http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(config.ELEVENLABS_TIMEOUT, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=config.ELEVENLABS_MAX_CONNECTIONS,
+                max_keepalive_connections=config.ELEVENLABS_MAX_CONNECTIONS
+            )
+        )
+        self.client = AsyncElevenLabs(
+            api_key=config.ELEVENLABS_API_KEY,
+            httpx_client=self.http_client
+        )
         self.default_voice_id = config.DEFAULT_VOICE_ID
         self.voice_options = {
             "male": config.MALE_VOICE_ID,  # Добавьте в config.py MALE_VOICE_ID
             "female": config.FEMALE_VOICE_ID  # Добавьте в config.py FEMALE_VOICE_ID
         }
         self.default_model = "eleven_multilingual_v2"
+        self.voice_settings = {
+            "stability": 0.8,
+            "similarity_boost": 0.75,
+            "style": 0.0,
+            "speaker_boost": True
+        }
         self.max_retries = 3
         self.retry_delay = 5
+        self.resilience = ResiliencePolicy(
+            "elevenlabs",
+            breaker=breaker_from_config("elevenlabs"),
+            limiter=AIMDLimiter(
+                "elevenlabs",
+                max_limit=config.ELEVENLABS_MAX_CONNECTIONS,
+                latency_target=config.ELEVENLABS_TIMEOUT / 2
+            ),
+            max_tries=self.max_retries,
+            base_delay=self.retry_delay,
+            retryable=(httpx.TransportError, InvalidAudioError)
+        )
         self.output_dir = Path(os.getenv("AUDIO_OUTPUT_DIR", "/tmp/generated_audio"))
         
         try:
@@ -36,6 +191,102 @@ class TTSService:
             logger.error(f"Failed to initialize output directory: {str(e)}")
             raise RuntimeError("Could not initialize TTS output directory")
 
+        self.cache = None
+        if config.TTS_CACHE_MAX_MB > 0:
+            try:
+                self.cache = AudioCache(
+                    Path(config.TTS_CACHE_DIR),
+                    config.TTS_CACHE_MAX_MB * 1024 * 1024
+                )
+            except Exception as e:
+                logger.error(f"Failed to initialize TTS cache, continuing without it: {e}")
+
+        # Озвучка заранее: ключ - user_id, fingerprint - ключ кэша озвучки
+        self.speculations = SpeculativeTasks(config.SPECULATIVE_TTL)
+        # Идущие озвучки по ключу кэша, к ним присоединяется generate_audio
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._budget_day: Optional[datetime.date] = None
+        self._budget_used: Dict[int, int] = {}
+
+    def _resolve_voice(self, voice_id: Optional[str], voice_gender: Optional[str]) -> str:
+        if voice_id:
+            return voice_id
+        if voice_gender and voice_gender in self.voice_options:
+            return self.voice_options[voice_gender]
+        return self.default_voice_id
+
+    def _cache_key(self, text: str, voice_gender: Optional[str]) -> str:
+        voice_id = self._resolve_voice(None, voice_gender)
+        return AudioCache.make_key(text, voice_id, self.default_model, self.voice_settings)
+
+    def speculate(self, user_id: int, tier: Optional[str], text: str, voice_gender: Optional[str] = None) -> bool:
+        """Начинает озвучку показанного сценария заранее в пределах дневного бюджета тарифа"""
+        # Прошлый вариант сценария больше не нужен
+        self.speculations.cancel(user_id)
+        if not config.SPECULATIVE_TTS or not self.cache or not text:
+            return False
+
+        key = self._cache_key(text, voice_gender)
+        if key in self._inflight or self.cache.contains(key):
+            return False
+        if not self._charge_budget(user_id, tier, len(text)):
+            return False
+
+        self.speculations.start(user_id, key, lambda: self._start_inflight(key, text, voice_gender))
+        logger.info(f"Speculative TTS started for user {user_id} ({len(text)} chars)")
+        return True
+
+    def claim_speculation(self, user_id: int, text: str, voice_gender: Optional[str] = None) -> bool:
+        """
+        Забирает озвучку, начатую заранее для этого текста (generate_audio дождется ее или возьмет из кэша).
+        Озвучка другого текста отменяется.
+        """
+        if not self.cache:
+            return False
+        work = self.speculations.take(user_id, self._cache_key(text, voice_gender))
+        if work is None:
+            return False
+        # Пригодившаяся озвучка не расходует бюджет
+        self._budget_used[user_id] = max(0, self._budget_used.get(user_id, 0) - len(text))
+        return True
+
+    def cancel_speculation(self, user_id: int):
+        self.speculations.cancel(user_id)
+
+    def _charge_budget(self, user_id: int, tier: Optional[str], chars: int) -> bool:
+        today = datetime.date.today()
+        if self._budget_day != today:
+            self._budget_day = today
+            self._budget_used.clear()
+
+        if tier == "premium":
+            limit = config.SPECULATIVE_TTS_PREMIUM_CHARS
+        elif tier == "lite":
+            limit = config.SPECULATIVE_TTS_LITE_CHARS
+        else:
+            limit = config.SPECULATIVE_TTS_FREE_CHARS
+
+        used = self._budget_used.get(user_id, 0)
+        if used + chars > limit:
+            return False
+        self._budget_used[user_id] = used + chars
+        return True
+
+    def _start_inflight(self, key: str, text: str, voice_gender: Optional[str]) -> asyncio.Task:
+        task = asyncio.create_task(self._presynthesize(text, voice_gender))
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._inflight.pop(key, None) if self._inflight.get(key) is done else None)
+        return task
+
+    async def _presynthesize(self, text: str, voice_gender: Optional[str]):
+        """Озвучка в кэш; сам файл не нужен"""
+        output_path = str(self.output_dir / f"speculative_{uuid.uuid4().hex}.mp3")
+        try:
+            await self.generate_audio(text, output_path, voice_gender=voice_gender)
+        finally:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+
     async def generate_audio(
         self,
         text: str,
@@ -49,12 +300,7 @@ class TTSService:
             return False
             
         # Выбираем голос: если указан voice_id - используем его, иначе по полу, иначе дефолтный
-        if voice_id:
-            voice_id = voice_id
-        elif voice_gender and voice_gender in self.voice_options:
-            voice_id = self.voice_options[voice_gender]
-        else:
-            voice_id = self.default_voice_id
+        voice_id = self._resolve_voice(voice_id, voice_gender)
         
         # Генерация пути если не указан
         if not output_path:
@@ -64,51 +310,68 @@ class TTSService:
         else:
             output_path = str(Path(output_path).absolute())
 
+        cache_key = None
+        if self.cache:
+            cache_key = AudioCache.make_key(text, voice_id, self.default_model, self.voice_settings)
+            # Эту озвучку уже делают заранее: дожидаемся ее и берем из кэша
+            pending = self._inflight.get(cache_key)
+            if pending and pending is not asyncio.current_task():
+                try:
+                    await asyncio.shield(pending)
+                except asyncio.CancelledError:
+                    if not pending.cancelled():
+                        raise
+                except Exception:
+                    pass
+            if self.cache.get(cache_key, output_path):
+                logger.info(f"TTS cache hit, audio copied to {output_path}")
+                return True
+
         temp_path = None
         try:
             # Создаем временный файл в той же директории
             temp_path = f"{output_path}.tmp"
             
-            for attempt in range(1, self.max_retries + 1):
+            attempt = 0
+            while True:
+                attempt += 1
                 try:
                     logger.info(f"Attempt {attempt} to generate audio (text length: {len(text)})")
                     
-                    # Генерация аудио
-                    response = self.client.text_to_speech.convert(
-                        voice_id=voice_id,
-                        text=text,
-                        model_id=self.default_model,
-                        voice_settings=VoiceSettings(
-                            stability=0.8,
-                            similarity_boost=0.75,
-                            style=0.0,
-                            speaker_boost=True
+                    async with self.resilience.attempt():
+                        # Генерация аудио (ответ приходит потоком)
+                        response = self.client.text_to_speech.convert(
+                            voice_id=voice_id,
+                            text=text,
+                            model_id=self.default_model,
+                            voice_settings=VoiceSettings(**self.voice_settings)
                         )
-                    )
-                    
-                    # Запись во временный файл
-                    with open(temp_path, "wb") as f:
-                        for chunk in response:
-                            if chunk:
-                                f.write(chunk)
-                    
-                    # Проверка временного файла
-                    if not os.path.exists(temp_path):
-                        raise Exception("Temporary audio file was not created")
                         
-                    temp_size = os.path.getsize(temp_path)
-                    if temp_size == 0:
-                        raise Exception("Generated audio file is empty")
-                    
-                    # Проверка заголовка MP3
-                    with open(temp_path, "rb") as f:
-                        header = f.read(3)
-                        if header != b'ID3' and not header.startswith(b'\xFF\xFB'):
-                            raise Exception("Invalid audio file format")
+                        # Пишем чанки во временный файл по мере получения
+                        with open(temp_path, "wb") as f:
+                            async for chunk in response:
+                                if chunk:
+                                    f.write(chunk)
+                        
+                        # Проверка временного файла
+                        if not os.path.exists(temp_path):
+                            raise InvalidAudioError("Temporary audio file was not created")
+                            
+                        temp_size = os.path.getsize(temp_path)
+                        if temp_size == 0:
+                            raise InvalidAudioError("Generated audio file is empty")
+                        
+                        # Проверка заголовка MP3
+                        with open(temp_path, "rb") as f:
+                            header = f.read(3)
+                            if header != b'ID3' and not header.startswith(b'\xFF\xFB'):
+                                raise InvalidAudioError("Invalid audio file format")
                     
                     # Переносим в итоговый файл
                     shutil.move(temp_path, output_path)
                     logger.info(f"Audio successfully saved to {output_path} (size: {temp_size} bytes)")
+                    if cache_key:
+                        self.cache.put(cache_key, output_path)
                     return True
                     
                 except Exception as e:
@@ -121,16 +384,19 @@ class TTSService:
                         except:
                             pass
                     
-                    if attempt < self.max_retries:
-                        delay = self.retry_delay * attempt
-                        logger.info(f"Retrying in {delay} seconds...")
+                    # Повторяем только временные ошибки; при разомкнутом предохранителе сразу gTTS
+                    if self.resilience.should_retry(e, attempt):
+                        delay = self.resilience.retry_delay(e, attempt)
+                        self.resilience.retries += 1
+                        logger.info(f"Retrying in {delay:.1f} seconds...")
                         await asyncio.sleep(delay)
                     else:
-                        logger.error("All attempts failed")
+                        if isinstance(e, CircuitOpenError):
+                            logger.error("ElevenLabs is unavailable, using fallback")
+                        else:
+                            logger.error("All attempts failed")
                         return await self._try_fallback_service(text, output_path)
             
-            return False
-            
         except Exception as e:
             logger.error(f"Fatal error in audio generation: {str(e)}", exc_info=True)
             return False
@@ -152,7 +418,8 @@ class TTSService:
                 # Создаем временный файл
                 temp_path = f"{output_path}.tmp"
                 tts = gTTS(text=text, lang='ru')
-                tts.save(temp_path)
+                # gTTS синхронный, выполняем в отдельном потоке
+                await asyncio.to_thread(tts.save, temp_path)
                 
                 # Проверяем результат
                 if not os.path.exists(temp_path):
@@ -180,4 +447,8 @@ class TTSService:
                 except:
                     pass
 
+    async def close(self):
+        """Закрытие HTTP-соединений"""
+        await self.http_client.aclose()
+
 tts_service = TTSService()
\ No newline at end of file
@@ -1,8 +1,9 @@
-import subprocess
 import os
 from pathlib import Path
 from config import config
 from utils.file_utils import generate_temp_file_path
+from utils.process_utils import run_process, ProcessError
+from services.asset_service import background_library, NORMALIZE_FILTER
 import logging
 import math
 import re
@@ -10,6 +11,22 @@ from typing import Optional
 
 logger = logging.getLogger(__name__)
 
+SUBTITLES_STYLE = (
+    "Fontsize=12,"
+    "PrimaryColour=&HFFFFFF&,"
+    "OutlineColour=&H000000&,"
+    "BorderStyle=1,"
+    "Outline=1,"
+    "Shadow=0,"
+    "Alignment=2,"
+    "MarginV=30,"
+    "MarginL=20,MarginR=20,"
+    "FontName=Arial,"
+    "WrapStyle=1"
+)
+
+BLACK_BACKGROUND_SOURCE = "color=c=black:s=1080x1920:r=30"
+
 def extract_captions(full_script: str) -> str:
     """Извлекает текст для субтитров из сценария"""
     caption_lines = []
@@ -24,15 +41,15 @@ def extract_captions(full_script: str) -> str:
     
     return '\n'.join(caption_lines)
 
-def _has_audio_stream(file_path: str) -> bool:
+async def _has_audio_stream(file_path: str) -> bool:
     """Проверяет, есть ли в файле аудиопоток"""
     try:
-        result = subprocess.run([
+        result = await run_process([
             "ffprobe", "-v", "error", "-select_streams", "a",
             "-show_entries", "stream=codec_type", 
             "-of", "default=nokey=1:noprint_wrappers=1", file_path
-        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        return result.returncode == 0 and result.stdout.strip() == "audio"
+        ], timeout=config.FFPROBE_TIMEOUT, check=False)
+        return result.returncode == 0 and "audio" in result.stdout.split()
     except Exception as e:
         logger.error(f"Ошибка проверки аудиопотока: {str(e)}")
         return False
@@ -43,6 +60,123 @@ async def create_video(
     output_path: str, 
     background: Optional[str] = None
 ) -> bool:
+    """Сборка видео: фон + озвучка + субтитры"""
+    if config.RENDER_SINGLE_PASS:
+        return await _create_video_single_pass(script, audio_path, output_path, background)
+    return await _create_video_multi_pass(script, audio_path, output_path, background)
+
+async def _create_video_single_pass(
+    script: str,
+    audio_path: str,
+    output_path: str,
+    background: Optional[str] = None
+) -> bool:
+    """Сборка видео одним процессом ffmpeg через общий filter_complex"""
+    subtitles_path = None
+    
+    try:
+        if not audio_path or not isinstance(audio_path, str):
+            raise ValueError("Неверный путь к аудио файлу")
+            
+        if not os.path.exists(audio_path):
+            raise FileNotFoundError(f"Аудио файл не найден: {audio_path}")
+        
+        # Громкость меняется фильтром, длительность у исходного файла та же
+        audio_duration = await _get_audio_duration(audio_path)
+        
+        asset = background_library.get(background)
+        if asset:
+            # Метаданные уже есть в индексе, пробовать файл не нужно
+            bg_path = asset.render_path
+            has_bg_audio = asset.has_audio
+            needs_scaling = not asset.is_normalized
+        elif background:
+            bg_path = os.path.join("video_assets", background)
+            if not os.path.exists(bg_path):
+                raise FileNotFoundError(f"Фоновое видео не найдено: {bg_path}")
+            has_bg_audio = await _has_audio_stream(bg_path)
+            needs_scaling = True
+        else:
+            has_bg_audio = False
+            needs_scaling = False
+        
+        if background:
+            # Бесконечно зацикливаем фон, длину ограничивает -t
+            video_input = ["-stream_loop", "-1", "-i", bg_path]
+        else:
+            video_input = ["-f", "lavfi", "-i", BLACK_BACKGROUND_SOURCE]
+        
+        subtitles_path = generate_temp_file_path("srt")
+        captions_text = extract_captions(script)
+        await _generate_dynamic_subtitles(
+            captions_text if captions_text else script,
+            audio_path,
+            subtitles_path,
+            duration=audio_duration
+        )
+        
+        video_filters = f"subtitles='{subtitles_path}':force_style='{SUBTITLES_STYLE}'"
+        if needs_scaling:
+            video_filters = f"{NORMALIZE_FILTER},{video_filters}"
+        filter_complex = [f"[0:v]{video_filters}[v]"]
+        if has_bg_audio:
+            filter_complex.extend([
+                "[0:a]volume=0.1[bg_audio]",
+                "[1:a]volume=3.0[voice_audio]",
+                "[bg_audio][voice_audio]amix=inputs=2:duration=shortest[a]"
+            ])
+        elif background:
+            filter_complex.append("[1:a]volume=3.0[a]")
+        else:
+            # Многопроходная сборка смешивала голос с тишиной черного фона через amix,
+            # который делит громкость пополам; сохраняем тот же уровень
+            filter_complex.append("[1:a]volume=1.5[a]")
+        
+        cmd = [
+            "ffmpeg",
+            "-y",
+            *video_input,
+            "-i", audio_path,
+            "-filter_complex", ";".join(filter_complex),
+            "-map", "[v]",
+            "-map", "[a]",
+            "-c:v", "libx264",
+            "-preset", "fast",
+            "-c:a", "aac",
+            "-t", f"{audio_duration:.3f}",
+            "-shortest",
+            output_path
+        ]
+        
+        logger.info(f"Выполняем команду ffmpeg: {' '.join(cmd)}")
+        result = await run_process(cmd, timeout=config.FFMPEG_TIMEOUT)
+        logger.debug(f"Вывод ffmpeg: {result.stderr}")
+        
+        if not os.path.exists(output_path):
+            raise Exception("Выходной видеофайл не был создан")
+            
+        return True
+        
+    except ProcessError as e:
+        logger.error(f"Ошибка ffmpeg: {e.stderr}")
+        return False
+    except Exception as e:
+        logger.error(f"Ошибка создания видео: {str(e)}", exc_info=True)
+        return False
+    finally:
+        if subtitles_path and os.path.exists(subtitles_path):
+            try:
+                os.remove(subtitles_path)
+            except Exception as e:
+                logger.error(f"Ошибка удаления временного файла {subtitles_path}: {e}")
+
+async def _create_video_multi_pass(
+    script: str, 
+    audio_path: str, 
+    output_path: str, 
+    background: Optional[str] = None
+) -> bool:
+    """Сборка видео в несколько проходов ffmpeg через промежуточные файлы"""
     subtitles_path = None
     bg_path = None
     looped_video_path = None
@@ -65,10 +199,10 @@ async def create_video(
             "-af", "volume=3.0",
             normalized_audio_path
         ]
-        subprocess.run(normalize_cmd, check=True)
+        await run_process(normalize_cmd, timeout=config.FFMPEG_TIMEOUT)
         
         # Получаем длительность аудио
-        audio_duration = _get_audio_duration(normalized_audio_path)
+        audio_duration = await _get_audio_duration(normalized_audio_path)
         
         # Если фон не указан, используем черный фон
         if not background:
@@ -87,15 +221,20 @@ async def create_video(
                 "-shortest",
                 bg_path
             ]
-            subprocess.run(cmd_create_bg, check=True)
+            await run_process(cmd_create_bg, timeout=config.FFMPEG_TIMEOUT)
         else:
             # Проверяем и выбираем фон
-            bg_path = os.path.join("video_assets", background)
-            if not os.path.exists(bg_path):
-                raise FileNotFoundError(f"Фоновое видео не найдено: {bg_path}")
-            
-            # Проверяем длительность фона
-            bg_duration = _get_video_duration(bg_path)
+            asset = background_library.get(background)
+            if asset:
+                bg_path = asset.render_path
+                bg_duration = asset.duration
+            else:
+                bg_path = os.path.join("video_assets", background)
+                if not os.path.exists(bg_path):
+                    raise FileNotFoundError(f"Фоновое видео не найдено: {bg_path}")
+                
+                # Проверяем длительность фона
+                bg_duration = await _get_video_duration(bg_path)
             
             # Если видео короче аудио, создаем зацикленную версию
             if bg_duration < audio_duration:
@@ -111,7 +250,7 @@ async def create_video(
                     "-t", str(audio_duration),
                     looped_video_path
                 ]
-                subprocess.run(cmd_loop_video, check=True)
+                await run_process(cmd_loop_video, timeout=config.FFMPEG_TIMEOUT)
                 bg_path = looped_video_path
 
         # Генерация субтитров
@@ -124,22 +263,11 @@ async def create_video(
         )
         
         # Проверяем, есть ли аудио в фоновом видео
-        has_bg_audio = _has_audio_stream(bg_path)
+        has_bg_audio = await _has_audio_stream(bg_path)
 
         # Формируем фильтры для FFmpeg
         filter_complex = [
-            f"[0:v]subtitles='{subtitles_path}':force_style="
-            "'Fontsize=12,"
-            "PrimaryColour=&HFFFFFF&,"
-            "OutlineColour=&H000000&,"
-            "BorderStyle=1,"
-            "Outline=1,"
-            "Shadow=0,"
-            "Alignment=2,"
-            "MarginV=30,"
-            "MarginL=20,MarginR=20,"
-            "FontName=Arial,"
-            "WrapStyle=1'[v]"
+            f"[0:v]subtitles='{subtitles_path}':force_style='{SUBTITLES_STYLE}'[v]"
         ]
 
         # Добавляем аудиофильтры в зависимости от наличия аудио в фоне
@@ -170,15 +298,15 @@ async def create_video(
         ]
         
         logger.info(f"Выполняем команду ffmpeg: {' '.join(cmd)}")
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        logger.debug(f"Вывод ffmpeg: {result.stdout}")
+        result = await run_process(cmd, timeout=config.FFMPEG_TIMEOUT)
+        logger.debug(f"Вывод ffmpeg: {result.stderr}")
         
         if not os.path.exists(output_path):
             raise Exception("Выходной видеофайл не был создан")
             
         return True
         
-    except subprocess.CalledProcessError as e:
+    except ProcessError as e:
         logger.error(f"Ошибка ffmpeg: {e.stderr}")
         return False
     except Exception as e:
@@ -198,10 +326,16 @@ async def create_video(
             except Exception as e:
                 logger.error(f"Ошибка удаления временного фона: {e}")
 
-async def _generate_dynamic_subtitles(script: str, audio_path: str, output_path: str):
+async def _generate_dynamic_subtitles(
+    script: str,
+    audio_path: str,
+    output_path: str,
+    duration: Optional[float] = None
+):
     """Генерация субтитров с разбивкой по времени и переносом строк"""
     try:
-        duration = _get_audio_duration(audio_path)
+        if duration is None:
+            duration = await _get_audio_duration(audio_path)
         if duration <= 0:
             raise ValueError("Некорректная длительность аудио")
         
@@ -240,14 +374,14 @@ async def _generate_dynamic_subtitles(script: str, audio_path: str, output_path:
         logger.error(f"Ошибка генерации субтитров: {str(e)}")
         raise
 
-def _get_audio_duration(audio_path: str) -> float:
+async def _get_audio_duration(audio_path: str) -> float:
     """Получение длительности аудиофайла"""
     try:
-        result = subprocess.run([
+        result = await run_process([
             "ffprobe", "-v", "error", "-show_entries", 
             "format=duration", "-of", 
             "default=noprint_wrappers=1:nokey=1", audio_path
-        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        ], timeout=config.FFPROBE_TIMEOUT, check=False)
         
         if result.returncode != 0:
             raise Exception(f"Ошибка ffprobe: {result.stderr}")
@@ -257,14 +391,14 @@ def _get_audio_duration(audio_path: str) -> float:
         logger.error(f"Ошибка получения длительности аудио: {str(e)}")
         raise
 
-def _get_video_duration(video_path: str) -> float:
+async def _get_video_duration(video_path: str) -> float:
     """Получение длительности видеофайла"""
     try:
-        result = subprocess.run([
+        result = await run_process([
             "ffprobe", "-v", "error", "-show_entries", 
             "format=duration", "-of", 
             "default=noprint_wrappers=1:nokey=1", video_path
-        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        ], timeout=config.FFPROBE_TIMEOUT, check=False)
         
         if result.returncode != 0:
             raise Exception(f"Ошибка ffprobe: {result.stderr}")
@@ -0,0 +1,169 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# KEYS: значение, версия; ARGV: версия до загрузки, значение, TTL
+# Значение записывается, только если с начала загрузки не было инвалидации (на любом экземпляре)
+SET_IF_VERSION_SCRIPT = """
+local version = redis.call('GET', KEYS[2]) or ''
+if version ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+# KEYS: значение, версия; ARGV: TTL версии
+INVALIDATE_SCRIPT = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+redis.call('DEL', KEYS[1])
+return 1
+"""
+
+
+def _encode(value: Any) -> str:
+    def default(obj):
+        if isinstance(obj, datetime):
+            return {"__datetime__": obj.isoformat()}
+        if isinstance(obj, date):
+            return {"__date__": obj.isoformat()}
+        raise TypeError(f"Cannot serialize {type(obj).__name__}")
+    return json.dumps(value, default=default, ensure_ascii=False)
+
+
+def _decode(raw: str) -> Any:
+    def object_hook(obj):
+        if "__datetime__" in obj:
+            return datetime.fromisoformat(obj["__datetime__"])
+        if "__date__" in obj:
+            return date.fromisoformat(obj["__date__"])
+        return obj
+    return json.loads(raw, object_hook=object_hook)
+
+
+class TTLCache:
+    """
+    LRU-кэш в памяти с TTL и необязательным общим уровнем в Redis.
+    Отсутствие значения (None) тоже кэшируется.
+    """
+
+    def __init__(self, name: str, max_size: int, ttl: float):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        # Срок жизни копии в памяти процесса
+        self.local_ttl = ttl
+        self.redis = None
+        self._set_script = None
+        self._invalidate_script = None
+        self._items: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        # Версии ключей, которые сейчас загружаются: загрузка, начатая до инвалидации, не попадет в кэш
+        self._versions: Dict[Hashable, int] = {}
+        self._loads: Dict[Hashable, int] = {}
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def setup_redis(self, redis, local_ttl: float):
+        """
+        Включает общий уровень в Redis. Инвалидация удаляет ключ в Redis и меняет его версию,
+        чтобы загрузка, начатая до нее на любом экземпляре, не записала старое значение.
+        Копии в памяти других экземпляров она не удаляет, поэтому они хранятся не дольше local_ttl.
+        """
+        self.redis = redis
+        self.local_ttl = min(self.ttl, local_ttl)
+        self._set_script = redis.register_script(SET_IF_VERSION_SCRIPT)
+        self._invalidate_script = redis.register_script(INVALIDATE_SCRIPT)
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Возвращает значение из кэша или загружает его через loader"""
+        item = self._items.get(key)
+        if item and item[0] > time.monotonic():
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+        version = self._versions.get(key, 0)
+        # Версия в Redis до загрузки: инвалидация на другом экземпляре меняет ее
+        redis_version = None
+        self._loads[key] = self._loads.get(key, 0) + 1
+        try:
+            if self.redis is not None:
+                try:
+                    raw, redis_version = await self.redis.mget(
+                        self._redis_key(key), self._version_key(key)
+                    )
+                    redis_version = redis_version or ""
+                    if raw is not None:
+                        value = _decode(raw)
+                        self.redis_hits += 1
+                        self._store(key, value, version)
+                        return value
+                except Exception as e:
+                    logger.error(f"Redis cache {self.name} read failed: {e}")
+
+            self.misses += 1
+            value = await loader()
+            if self._store(key, value, version) and redis_version is not None:
+                try:
+                    await self._set_script(
+                        keys=[self._redis_key(key), self._version_key(key)],
+                        args=[redis_version, _encode(value), int(self.ttl)]
+                    )
+                except Exception as e:
+                    logger.error(f"Redis cache {self.name} write failed: {e}")
+            return value
+        finally:
+            self._finish_load(key)
+
+    async def invalidate(self, key: Hashable):
+        self._items.pop(key, None)
+        if key in self._loads:
+            self._versions[key] = self._versions.get(key, 0) + 1
+        if self.redis is not None:
+            try:
+                # Версия живет дольше значения: ее должна пережить любая начатая загрузка
+                await self._invalidate_script(
+                    keys=[self._redis_key(key), self._version_key(key)],
+                    args=[int(self.ttl) * 2]
+                )
+            except Exception as e:
+                logger.error(f"Redis cache {self.name} invalidation failed: {e}")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "size": len(self._items),
+            "max_size": self.max_size
+        }
+
+    def _store(self, key: Hashable, value: Any, version: int) -> bool:
+        if self._versions.get(key, 0) != version or self.max_size <= 0:
+            return False
+        self._items[key] = (time.monotonic() + self.local_ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+        return True
+
+    def _finish_load(self, key: Hashable):
+        loads = self._loads.pop(key) - 1
+        if loads:
+            self._loads[key] = loads
+        else:
+            # Загрузок ключа больше нет, версия не нужна
+            self._versions.pop(key, None)
+
+    def _redis_key(self, key: Hashable) -> str:
+        return f"cache:{self.name}:{key}"
+
+    def _version_key(self, key: Hashable) -> str:
+        return f"cache:{self.name}:{key}:version"
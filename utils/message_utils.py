@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup, Message
+
+logger = logging.getLogger(__name__)
+
+# Лимит длины текста сообщения Telegram
+MAX_MESSAGE_LENGTH = 4096
+
+
+class ThrottledEditor:
+    """
+    Постепенно обновляет сообщение по мере поступления текста.
+    Сообщение правится не чаще min_interval секунд: после every_chunks новых
+    фрагментов или, если фрагменты идут медленно, через max_interval секунд.
+    """
+
+    def __init__(
+        self,
+        message: Message,
+        every_chunks: int = 20,
+        min_interval: float = 0.5,
+        max_interval: float = 1.0,
+        cursor: str = " ▌"
+    ):
+        self.message = message
+        self.every_chunks = every_chunks
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.cursor = cursor
+        self.edits = 0
+        self._text = ""
+        self._pending_chunks = 0
+        self._last_edit = 0.0
+        # Не раньше этого момента (после RetryAfter от Telegram)
+        self._blocked_until = 0.0
+
+    async def update(self, text: str):
+        """Новый промежуточный текст; правка отправляется, если пришло ее время"""
+        self._pending_chunks += 1
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return
+        elapsed = now - self._last_edit
+        # Первый фрагмент показываем сразу
+        due = (
+            self.edits == 0
+            or elapsed >= self.max_interval
+            or (self._pending_chunks >= self.every_chunks and elapsed >= self.min_interval)
+        )
+        if due:
+            await self._edit(text + self.cursor)
+
+    async def finish(self, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None):
+        """Итоговый текст; отправляется всегда, при необходимости после паузы Telegram"""
+        delay = self._blocked_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self._edit(text, reply_markup, wait=True)
+
+    async def _edit(self, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None, wait: bool = False):
+        text = text[:MAX_MESSAGE_LENGTH]
+        self._pending_chunks = 0
+        self._last_edit = time.monotonic()
+        if text == self._text and reply_markup is None:
+            return
+        try:
+            await self.message.edit_text(text, reply_markup=reply_markup, parse_mode=None)
+            self._text = text
+            self.edits += 1
+        except TelegramRetryAfter as e:
+            self._blocked_until = time.monotonic() + e.retry_after
+            if wait:
+                await asyncio.sleep(e.retry_after)
+                await self._edit(text, reply_markup, wait=True)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
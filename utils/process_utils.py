@@ -0,0 +1,114 @@
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних строк stderr храним для сообщения об ошибке
+STDERR_TAIL_LINES = 50
+
+
+@dataclass
+class ProcessResult:
+    returncode: int
+    stdout: str
+    stderr: str
+
+
+class ProcessError(Exception):
+    """Ошибка выполнения внешнего процесса (ненулевой код или таймаут)"""
+
+    def __init__(self, cmd: List[str], returncode: Optional[int], stderr: str, timed_out: bool = False):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stderr = stderr
+        self.timed_out = timed_out
+        reason = "timeout" if timed_out else f"exit code {returncode}"
+        super().__init__(f"{cmd[0]} failed ({reason}): {stderr[-500:]}")
+
+
+async def _stream_stderr(stream: asyncio.StreamReader, tail: deque, name: str):
+    """Читает stderr по мере поступления и пишет его в лог построчно"""
+    buffer = b""
+    while True:
+        chunk = await stream.read(4096)
+        if not chunk:
+            break
+        # ffmpeg обновляет прогресс через \r, поэтому режем и по нему
+        buffer += chunk.replace(b"\r", b"\n")
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            text = line.decode("utf-8", errors="replace").strip()
+            if text:
+                tail.append(text)
+                logger.debug(f"[{name}] {text}")
+    text = buffer.decode("utf-8", errors="replace").strip()
+    if text:
+        tail.append(text)
+        logger.debug(f"[{name}] {text}")
+
+
+async def _kill(proc: asyncio.subprocess.Process):
+    """Убивает процесс и дожидается его завершения"""
+    if proc.returncode is not None:
+        return
+    try:
+        proc.kill()
+    except ProcessLookupError:
+        pass
+    await proc.wait()
+
+
+async def run_process(
+    cmd: List[str],
+    timeout: Optional[float] = None,
+    check: bool = True
+) -> ProcessResult:
+    """
+    Запускает внешний процесс без блокировки event loop
+
+    Args:
+        cmd: Команда и аргументы
+        timeout: Максимальное время выполнения в секундах (None - без ограничения)
+        check: Бросать ProcessError при ненулевом коде возврата
+
+    Returns:
+        Результат выполнения процесса
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    tail = deque(maxlen=STDERR_TAIL_LINES)
+    name = f"{cmd[0]}:{proc.pid}"
+
+    try:
+        stdout, _, _ = await asyncio.wait_for(
+            asyncio.gather(
+                proc.stdout.read(),
+                _stream_stderr(proc.stderr, tail, name),
+                proc.wait()
+            ),
+            timeout=timeout
+        )
+    except asyncio.TimeoutError:
+        logger.error(f"Процесс {name} превысил таймаут {timeout} сек, завершаем")
+        await _kill(proc)
+        raise ProcessError(cmd, proc.returncode, "\n".join(tail), timed_out=True)
+    except asyncio.CancelledError:
+        logger.warning(f"Процесс {name} отменен, завершаем")
+        await _kill(proc)
+        raise
+
+    result = ProcessResult(
+        returncode=proc.returncode,
+        stdout=stdout.decode("utf-8", errors="replace"),
+        stderr="\n".join(tail)
+    )
+    if check and result.returncode != 0:
+        raise ProcessError(cmd, result.returncode, result.stderr)
+    return result
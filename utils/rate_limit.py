@@ -0,0 +1,37 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Ограничитель частоты: не больше rate операций в секунду с запасом burst"""
+
+    def __init__(self, rate: float, burst: float = 1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        # Пауза для всех ожидающих (например, после RetryAfter от Telegram)
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Останавливает выдачу токенов на seconds секунд"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        # Токены начнут накапливаться только после паузы
+        self.tokens = 0
+        self.updated = self.paused_until
+
+    async def acquire(self):
+        # Ожидающие обслуживаются по очереди, чтобы не было гонки за токен
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.burst, self.tokens + max(0.0, now - self.updated) * self.rate)
+                self.updated = max(self.updated, now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
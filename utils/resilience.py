@@ -0,0 +1,309 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple, Type, TypeVar
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Классы ошибок
+RATE_LIMITED = "rate_limited"  # 429: повторить позже и снизить параллельность
+RETRYABLE = "retryable"        # таймауты, обрывы соединения, 5xx
+FATAL = "fatal"                # 4xx и ошибки в коде: повтор не поможет
+
+RETRYABLE_STATUS = {408, 409, 425, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Запрос не отправлен: сервис недавно отвечал ошибками"""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} circuit is open, retry in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+def status_code(exc: BaseException) -> Optional[int]:
+    """HTTP-статус из исключения клиента (openai, httpx, elevenlabs)"""
+    code = getattr(exc, "status_code", None)
+    if code is None:
+        code = getattr(getattr(exc, "response", None), "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """Значение Retry-After из ответа, если сервис его прислал"""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def classify(exc: BaseException, retryable: Tuple[Type[BaseException], ...] = ()) -> str:
+    code = status_code(exc)
+    if code == 429:
+        return RATE_LIMITED
+    if code is not None:
+        return RETRYABLE if code in RETRYABLE_STATUS or code >= 500 else FATAL
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError, ConnectionError) + tuple(retryable)):
+        return RETRYABLE
+    return FATAL
+
+
+class CircuitBreaker:
+    """
+    Размыкается, когда доля ошибок за окно window секунд достигает failure_rate
+    (при не менее min_calls вызовах). Через open_seconds пропускает один пробный вызов.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_rate: float = 0.5, min_calls: int = 10,
+                 window: float = 60, open_seconds: float = 30):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self._calls: "deque[Tuple[float, bool]]" = deque()
+        self._probe = False
+
+    def check(self):
+        """Пропускает вызов или бросает CircuitOpenError"""
+        if self.state == self.OPEN:
+            retry_in = self.opened_at + self.open_seconds - time.monotonic()
+            if retry_in > 0:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, retry_in)
+            self.state = self.HALF_OPEN
+            self._probe = False
+        if self.state == self.HALF_OPEN:
+            if self._probe:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, self.open_seconds)
+            self._probe = True
+
+    def record(self, success: bool):
+        now = time.monotonic()
+        if self.state == self.HALF_OPEN:
+            self._probe = False
+            if success:
+                logger.info(f"Circuit {self.name} closed")
+                self.state = self.CLOSED
+                self._calls.clear()
+            else:
+                self._open(now)
+            return
+
+        self._calls.append((now, success))
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+        if success:
+            return
+        failures = sum(1 for _, ok in self._calls if not ok)
+        if len(self._calls) >= self.min_calls and failures / len(self._calls) >= self.failure_rate:
+            self._open(now)
+
+    def release(self):
+        """Вызов прерван без результата (отмена): освобождает пробный слот"""
+        if self.state == self.HALF_OPEN:
+            self._probe = False
+
+    def _open(self, now: float):
+        logger.warning(f"Circuit {self.name} opened for {self.open_seconds}s")
+        self.state = self.OPEN
+        self.opened_at = now
+        self.trips += 1
+        self._calls.clear()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        failures = sum(1 for _, ok in self._calls if not ok)
+        return {
+            "state": self.state,
+            "calls": len(self._calls),
+            "failures": failures,
+            "trips": self.trips,
+            "rejected": self.rejected
+        }
+
+
+class AIMDLimiter:
+    """
+    Адаптивный лимит одновременных запросов: растет на 1 за каждое окно
+    успешных быстрых ответов и делится пополам при 429 или медленных ответах.
+    """
+
+    def __init__(self, name: str, initial: int = 4, min_limit: int = 1, max_limit: int = 32,
+                 latency_target: float = 10.0, backoff: float = 0.5):
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.in_flight = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def on_success(self, latency: float):
+        if latency > self.latency_target:
+            self.on_overload()
+            return
+        # Аддитивный рост: +1 после примерно limit успешных ответов
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def on_overload(self):
+        now = time.monotonic()
+        # Одна волна ошибок от уже отправленных запросов снижает лимит один раз
+        if now - self._last_decrease < self.latency_target:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        self.decreases += 1
+        logger.warning(f"Concurrency limit for {self.name} lowered to {int(self.limit)}")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "decreases": self.decreases
+        }
+
+
+def breaker_from_config(name: str) -> CircuitBreaker:
+    """Предохранитель с порогами из настроек CIRCUIT_*"""
+    return CircuitBreaker(
+        name,
+        failure_rate=config.CIRCUIT_FAILURE_RATE,
+        min_calls=config.CIRCUIT_MIN_CALLS,
+        window=config.CIRCUIT_WINDOW,
+        open_seconds=config.CIRCUIT_OPEN_SECONDS
+    )
+
+
+class ResiliencePolicy:
+    """
+    Вызов внешнего сервиса через предохранитель, адаптивный лимит параллельности
+    и повторы только для временных ошибок (экспоненциальная задержка с джиттером).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        breaker: Optional[CircuitBreaker] = None,
+        limiter: Optional[AIMDLimiter] = None,
+        max_tries: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 30.0,
+        retryable: Tuple[Type[BaseException], ...] = ()
+    ):
+        self.name = name
+        self.breaker = breaker or CircuitBreaker(name)
+        self.limiter = limiter
+        self.max_tries = max_tries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retryable = retryable
+        self.retries = 0
+        self.errors: Dict[str, int] = {RATE_LIMITED: 0, RETRYABLE: 0, FATAL: 0}
+
+    @asynccontextmanager
+    async def attempt(self) -> AsyncIterator[None]:
+        """Одна попытка: слот лимитера, проверка предохранителя и учет результата"""
+        if self.limiter is None:
+            self.breaker.check()
+            async with self._observe():
+                yield
+        else:
+            # Предохранитель проверяется уже со слотом: если вызов отменят
+            # в ожидании слота, пробный вызов не останется занятым
+            async with self.limiter.slot():
+                self.breaker.check()
+                async with self._observe():
+                    yield
+
+    @asynccontextmanager
+    async def _observe(self) -> AsyncIterator[None]:
+        started = time.monotonic()
+        try:
+            yield
+        except (asyncio.CancelledError, GeneratorExit):
+            self.breaker.release()
+            raise
+        except Exception as e:
+            kind = self.classify(e)
+            self.errors[kind] += 1
+            # Ошибки запроса (4xx, баги) не говорят о здоровье сервиса
+            self.breaker.record(success=kind == FATAL)
+            if self.limiter is not None and kind != FATAL:
+                self.limiter.on_overload()
+            raise
+        self.breaker.record(success=True)
+        if self.limiter is not None:
+            self.limiter.on_success(time.monotonic() - started)
+
+    def classify(self, exc: BaseException) -> str:
+        return classify(exc, self.retryable)
+
+    def should_retry(self, exc: BaseException, attempt: int) -> bool:
+        if attempt >= self.max_tries or isinstance(exc, CircuitOpenError):
+            return False
+        return self.classify(exc) != FATAL
+
+    def retry_delay(self, exc: BaseException, attempt: int) -> float:
+        delay = retry_after(exc)
+        if delay is None:
+            delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+            delay *= random.uniform(0.5, 1.0)
+        return min(delay, self.max_delay)
+
+    async def call(self, fn: Callable[[], Awaitable[T]]) -> T:
+        """Выполняет fn() с повторами временных ошибок"""
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                async with self.attempt():
+                    return await fn()
+            except Exception as e:
+                if not self.should_retry(e, attempt):
+                    raise
+                delay = self.retry_delay(e, attempt)
+                self.retries += 1
+                logger.warning(f"{self.name} attempt {attempt} failed ({self.classify(e)}), retrying in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "breaker": self.breaker.get_metrics(),
+            "limiter": self.limiter.get_metrics() if self.limiter else None,
+            "retries": self.retries,
+            "errors": dict(self.errors)
+        }
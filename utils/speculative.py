@@ -0,0 +1,115 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class StreamBuffer:
+    """
+    Читает асинхронный поток в фоне и запоминает фрагменты.
+    Итерация отдает уже полученные фрагменты, затем новые по мере поступления.
+    """
+
+    def __init__(self, source: AsyncIterator[str]):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+        self.task = asyncio.create_task(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[str]):
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._changed.set()
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._changed.set()
+
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+    def cancel(self):
+        self.task.cancel()
+
+    async def __aiter__(self):
+        position = 0
+        while True:
+            while position < len(self.chunks):
+                yield self.chunks[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            self._changed.clear()
+            # Фрагмент мог прийти между проверкой и clear()
+            if position < len(self.chunks) or self.done:
+                continue
+            await self._changed.wait()
+
+
+class SpeculativeTasks:
+    """
+    Работа, запущенная заранее в расчете на следующий шаг пользователя.
+    На ключ приходится одна задача; она отдается, только если совпал fingerprint
+    (входные данные не изменились), и отменяется по истечении ttl.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._items: Dict[Hashable, Tuple[Hashable, Any, asyncio.TimerHandle]] = {}
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+
+    def start(self, key: Hashable, fingerprint: Hashable, factory: Callable[[], Any]) -> Any:
+        """Запускает работу (объект с методом cancel()) вместо предыдущей для этого ключа"""
+        self.cancel(key)
+        work = factory()
+        timer = asyncio.get_running_loop().call_later(self.ttl, self.cancel, key)
+        self._items[key] = (fingerprint, work, timer)
+        self.started += 1
+        return work
+
+    def take(self, key: Hashable, fingerprint: Hashable) -> Optional[Any]:
+        """Забирает работу, если она запущена для тех же входных данных"""
+        item = self._items.pop(key, None)
+        if item is None:
+            self.misses += 1
+            return None
+        item_fingerprint, work, timer = item
+        timer.cancel()
+        if item_fingerprint != fingerprint:
+            work.cancel()
+            self.cancelled += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        return work
+
+    def cancel(self, key: Hashable):
+        item = self._items.pop(key, None)
+        if item is None:
+            return
+        _, work, timer = item
+        timer.cancel()
+        work.cancel()
+        self.cancelled += 1
+
+    def get_metrics(self) -> Dict[str, int]:
+        return {
+            "started": self.started,
+            "hits": self.hits,
+            "misses": self.misses,
+            "cancelled": self.cancelled,
+            "active": len(self._items)
+        }